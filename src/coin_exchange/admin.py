@@ -26,6 +26,7 @@ from coin_exchange.models import (
     Order,
     Review,
     Pool,
+    OrderCounter,
     TrackingAddress,
     TrackingTransaction,
     ReferralOrder,
@@ -309,14 +310,32 @@ class PoolAdmin(admin.ModelAdmin):
         return request.user.is_superuser
 
 
+@admin.register(OrderCounter)
+class OrderCounterAdmin(admin.ModelAdmin):
+    list_display = ['day', 'direction', 'order_type', 'count']
+    list_filter = ('direction', 'order_type')
+
+    def get_queryset(self, request):
+        return self.model.objects.all().order_by('-day')
+
+    def has_add_permission(self, request, obj=None):
+        return False
+
+    def has_delete_permission(self, request, obj=None):
+        return False
+
+    def has_change_permission(self, request, obj=None):
+        return False
+
+
 @admin.register(TrackingAddress)
 class TrackingAddressAdmin(admin.ModelAdmin):
-    list_display = ['user', 'address', 'currency', 'status', 'order']
+    list_display = ['user', 'address', 'currency', 'status', 'order', 'next_check_at', 'attempts']
 
 
 @admin.register(TrackingTransaction)
 class TrackingTransactionAdmin(admin.ModelAdmin):
-    list_display = ['tx_hash', 'currency', 'status', 'order', 'direction']
+    list_display = ['tx_hash', 'currency', 'status', 'order', 'direction', 'next_check_at', 'attempts']
 
 
 @admin.register(CryptoFund)
@@ -408,7 +427,7 @@ class CryptoFundActionAdmin(admin.ModelAdmin):
 class CryptoTokenAdmin(admin.ModelAdmin):
     list_display = ['address', 'protocol', 'name', 'symbol', 'decimals', 'auto_price',
                     'buy_price', 'sell_price', 'active']
-    readonly_fields = ['name', 'symbol', 'decimals']
+    readonly_fields = ['name', 'symbol', 'decimals', 'scanned_block']
 
     def save_model(self, request, obj, form, change):
         obj.user = request.user
@@ -1,18 +1,27 @@
+import logging
+import time
+from collections import defaultdict
+from concurrent.futures import ThreadPoolExecutor, wait, FIRST_COMPLETED
+from datetime import timedelta
 from decimal import Decimal
 
-import requests
 from django.conf import settings
-from django.db import transaction
+from django.db import transaction, connection
 from django.db.models import Q
+from django.utils import timezone
 
 from coin_exchange.constants import TRACKING_ADDRESS_STATUS, TRACKING_TRANSACTION_STATUS, \
-    TRACKING_TRANSACTION_DIRECTION, ORDER_STATUS, PAYMENT_STATUS
-from coin_exchange.models import TrackingAddress, Order, TrackingTransaction, SellingPayment, SellingPaymentDetail
+    TRACKING_TRANSACTION_DIRECTION, ORDER_STATUS, PAYMENT_STATUS, TRACKING_MAX_WORKERS, TRACKING_ITEM_TIMEOUT, \
+    BLOCK_SCAN_MAX_BLOCKS, BLOCK_SCAN_CONFIRMATIONS, TOKEN_LOG_BLOCK_RANGE, TOKEN_LOG_MAX_BLOCKS, \
+    TOKEN_LOG_RECIPIENT_BATCH, TOKEN_CONFIRMATIONS, TRACKING_CHECK_BASE_DELAY, TRACKING_CHECK_MAX_DELAY, \
+    TRACKING_CHECK_AGE_RATIO, TRACKING_BLOCK_TIME
+from coin_exchange.models import TrackingAddress, Order, TrackingTransaction, SellingPayment, SellingPaymentDetail, \
+    CryptoAddress, BlockScanState, CryptoToken
 from coin_system.business import round_crypto_currency
 from coin_user.models import ExchangeUser
 from common.constants import CURRENCY, DIRECTION
 from common.provider_data import BitstampTxData
-from integration import coinbase, bitpay, etherscan, bitstamp
+from integration import coinbase, bitpay, etherscan, bitstamp, explorer, ethereum
 from integration.objects import AddressResponse, TransactionResponse
 
 
@@ -35,6 +44,26 @@ class AddressManagement(object):
 
         return address, False
 
+    @staticmethod
+    def normalize_address(address: str) -> str:
+        return address.strip().lower()
+
+    @staticmethod
+    def register_address(address: str, **links) -> CryptoAddress:
+        # Only the given links are changed, the others are kept
+        obj, _ = CryptoAddress.objects.update_or_create(address=AddressManagement.normalize_address(address),
+                                                        defaults=links)
+        return obj
+
+    @staticmethod
+    def get_address(address: str) -> CryptoAddress:
+        return CryptoAddress.objects.filter(address=AddressManagement.normalize_address(address)).first()
+
+    @staticmethod
+    def is_sell_address(address: str) -> bool:
+        return CryptoAddress.objects.filter(address=AddressManagement.normalize_address(address),
+                                            sell_order__isnull=False).exists()
+
 
 class CryptoTransactionManagement(object):
     @staticmethod
@@ -58,6 +87,106 @@ class CryptoTransactionManagement(object):
         return tx_hash, BitstampTxData(provider_data).to_json()
 
 
+class TrackingExecutor(object):
+    """
+    Run a tracking function on many rows with a bounded thread pool.
+    A row still running after its own timeout is given up, its thread ends with the timeout of the explorer requests.
+    """
+
+    def __init__(self, max_workers: int = TRACKING_MAX_WORKERS, item_timeout: float = TRACKING_ITEM_TIMEOUT):
+        self.max_workers = max_workers
+        self.item_timeout = item_timeout
+
+    @staticmethod
+    def _track(func, pk: int, started: dict):
+        started[pk] = time.monotonic()
+        try:
+            func(pk)
+        finally:
+            # Connection of the worker thread
+            connection.close()
+
+    def run(self, func, pks: list) -> dict:
+        progress = {'total': len(pks), 'success': 0, 'failed': 0, 'timeout': 0}
+        if not pks:
+            return progress
+
+        started = {}
+        executor = ThreadPoolExecutor(max_workers=min(self.max_workers, len(pks)))
+        futures = {executor.submit(self._track, func, pk, started): pk for pk in pks}
+        pending = set(futures)
+        while pending:
+            # Wake up at least every second to give up late rows
+            done, pending = wait(pending, timeout=min(1, self.item_timeout), return_when=FIRST_COMPLETED)
+            for future in done:
+                if future.exception():
+                    progress['failed'] += 1
+                    logging.error('Tracking %s failed: %s', futures[future], future.exception())
+                else:
+                    progress['success'] += 1
+
+            now = time.monotonic()
+            late = {future for future in pending
+                    if futures[future] in started and now - started[futures[future]] > self.item_timeout}
+            progress['timeout'] += len(late)
+            pending -= late
+            logging.info('Tracking %s: %s', func.__name__, progress)
+
+        executor.shutdown(wait=False)
+        return progress
+
+
+class TrackingScheduleManagement(object):
+    """
+    Tracked items are only checked once due. The delay doubles with each check without news and is at least a part
+    of the age of the item, a pending transaction waits for the blocks of its missing confirmations.
+    """
+
+    @staticmethod
+    def get_delay(attempts: int, tracked_since) -> int:
+        age = Decimal((timezone.now() - tracked_since).total_seconds())
+        delay = max(TRACKING_CHECK_BASE_DELAY * 2 ** min(attempts, 16), age * TRACKING_CHECK_AGE_RATIO)
+        return int(min(delay, TRACKING_CHECK_MAX_DELAY))
+
+    @staticmethod
+    def get_tracked_since(obj: TrackingAddress):
+        # A re-used address is tracked again from its new order
+        return obj.order.created_at if obj.order else obj.created_at
+
+    @staticmethod
+    def reset(obj):
+        obj.attempts = 0
+        obj.next_check_at = timezone.now() + timedelta(seconds=TRACKING_CHECK_BASE_DELAY)
+
+    @staticmethod
+    def postpone(obj, tracked_since):
+        obj.attempts += 1
+        obj.next_check_at = timezone.now() + timedelta(
+            seconds=TrackingScheduleManagement.get_delay(obj.attempts, tracked_since))
+
+    @staticmethod
+    def schedule_address(obj: TrackingAddress, has_news: bool):
+        if has_news:
+            TrackingScheduleManagement.reset(obj)
+        else:
+            TrackingScheduleManagement.postpone(obj, TrackingScheduleManagement.get_tracked_since(obj))
+        obj.save(update_fields=['next_check_at', 'attempts', 'updated_at'])
+
+    @staticmethod
+    def schedule_transaction(obj: TrackingTransaction, resp: TransactionResponse):
+        if obj.status != TRACKING_TRANSACTION_STATUS.pending:
+            obj.next_check_at = None
+            return
+
+        confirmations = resp.get_pending_confirmations()
+        if confirmations:
+            obj.next_check_at = timezone.now() + timedelta(
+                seconds=max(TRACKING_CHECK_BASE_DELAY,
+                            TRACKING_BLOCK_TIME.get(obj.currency, TRACKING_CHECK_BASE_DELAY) * confirmations))
+        else:
+            TrackingScheduleManagement.postpone(obj, obj.created_at)
+
+
 class TrackingManagement(object):
     @staticmethod
     @transaction.atomic
@@ -77,10 +206,15 @@ class TrackingManagement(object):
             )
         else:
             obj.status = TRACKING_ADDRESS_STATUS.has_order
-            obj.save(update_fields=['status', ])
+            obj.next_check_at = timezone.now()
+            obj.attempts = 0
+            obj.save(update_fields=['status', 'next_check_at', 'attempts'])
 
+        links = {'tracking_address': obj}
+        if order.direction == DIRECTION.sell:
+            links['sell_order'] = order
         if add_payment and order.direction == DIRECTION.sell:
-            SellingPayment.objects.create(
+            links['selling_payment'] = SellingPayment.objects.create(
                 address=order.address,
                 order=order,
                 amount=0,
@@ -88,6 +222,7 @@ class TrackingManagement(object):
                 overspent=0,
                 status=PAYMENT_STATUS.under,
             )
+        AddressManagement.register_address(order.address, **links)
 
         return obj
 
@@ -116,41 +251,69 @@ class TrackingManagement(object):
         )
 
     @staticmethod
-    def load_tracking_address():
-        url = settings.EXCHANGE_API + '/tracking-addresses/{}/'
-        for tracking in TrackingAddress.objects.all():
-            try:
-                # Just don't push too much
-                requests.post(url.format(tracking.id), timeout=200)
-            except Exception:
-                pass
+    def load_tracking_address() -> dict:
+        # 1 chunk per explorer request, chunks are tracked concurrently
+        chunks = []
+        for currency, size in explorer.ADDRESS_BATCH_SIZE.items():
+            pks = list(TrackingAddress.objects.filter(currency=currency, next_check_at__lte=timezone.now())
+                       .values_list('id', flat=True))
+            chunks += [tuple(pks[i:i + size]) for i in range(0, len(pks), size)]
+        return TrackingExecutor().run(TrackingManagement.track_system_addresses, chunks)
 
     @staticmethod
-    def load_tracking_transaction():
-        url = settings.EXCHANGE_API + '/tracking-transactions/{}/'
-        for tracking in TrackingTransaction.objects.all():
-            try:
-                # Just don't push too much
-                requests.post(url.format(tracking.id), timeout=200)
-            except Exception:
-                pass
+    def load_tracking_transaction() -> dict:
+        pks = list(TrackingTransaction.objects.filter(next_check_at__lte=timezone.now()).values_list('id', flat=True))
+        return TrackingExecutor().run(TrackingManagement.track_system_transaction, pks)
 
     @staticmethod
     def track_system_address(pk: int):
-        obj = TrackingAddress.objects.get(id=pk)
-        network_tracking = TrackingManagement.track_network_address(obj.address, obj.currency)
-        tx_hashes = network_tracking.tx_hashes
-        tracking_tx_hashes = TrackingTransaction.objects.filter(tracking_address=obj).values_list('tx_hash', flat=True)
-        new_tx_hashes = set(tx_hashes) - set(tracking_tx_hashes)
+        TrackingAddress.objects.get(id=pk)
+        TrackingManagement.track_system_addresses([pk])
 
-        for tx_hash in new_tx_hashes:
-            TrackingManagement.create_tracking_transaction(obj, tx_hash)
+    @staticmethod
+    def track_system_addresses(pks: list):
+        objs = defaultdict(list)
+        for obj in TrackingAddress.objects.select_related('order').filter(id__in=pks):
+            objs[obj.currency].append(obj)
+
+        for currency, currency_objs in objs.items():
+            try:
+                network_trackings = TrackingManagement.track_network_addresses(
+                    [obj.address for obj in currency_objs], currency)
+            except Exception:
+                # Not retried on each sweep while the explorer fails
+                for obj in currency_objs:
+                    TrackingScheduleManagement.schedule_address(obj, False)
+                raise
+
+            tracking_tx_hashes = defaultdict(set)
+            for tracking_address_id, tx_hash in TrackingTransaction.objects \
+                    .filter(tracking_address__in=currency_objs).values_list('tracking_address_id', 'tx_hash'):
+                tracking_tx_hashes[tracking_address_id].add(tx_hash)
+
+            for obj in currency_objs:
+                network_tracking = network_trackings.get(obj.address)
+                new_tx_hashes = set(network_tracking.tx_hashes) - tracking_tx_hashes[obj.id] \
+                    if network_tracking else set()
+                for tx_hash in new_tx_hashes:
+                    TrackingManagement.create_tracking_transaction(obj, tx_hash)
+                TrackingScheduleManagement.schedule_address(obj, bool(new_tx_hashes))
 
     @staticmethod
-    @transaction.atomic
     def track_system_transaction(pk: int):
         obj = TrackingTransaction.objects.get(id=pk)
-        resp = TrackingManagement.track_network_transaction(obj.tx_hash, obj.currency)
+        try:
+            resp = TrackingManagement.track_network_transaction(obj.tx_hash, obj.currency)
+            with transaction.atomic():
+                TrackingManagement.update_system_transaction(obj, resp)
+        except Exception:
+            # Not retried on each sweep while it fails
+            TrackingScheduleManagement.postpone(obj, obj.created_at)
+            obj.save(update_fields=['next_check_at', 'attempts', 'updated_at'])
+            raise
+
+    @staticmethod
+    def update_system_transaction(obj: TrackingTransaction, resp: TransactionResponse):
         if resp.check_pending():
             obj.status = TRACKING_TRANSACTION_STATUS.pending
         else:
@@ -166,8 +329,10 @@ class TrackingManagement(object):
                 order.save(update_fields=['status', 'updated_at'])
         else:
             if obj.status == TRACKING_TRANSACTION_STATUS.success:
-                payment = SellingPayment.objects.select_related('order') \
-                    .get(address__iexact=obj.tracking_address.address)
+                crypto_address = AddressManagement.get_address(obj.tracking_address.address)
+                if not crypto_address or not crypto_address.selling_payment_id:
+                    raise SellingPayment.DoesNotExist
+                payment = crypto_address.selling_payment
                 SellingPaymentDetail.objects.create(
                     payment=payment,
                     currency=obj.currency,
@@ -175,6 +340,10 @@ class TrackingManagement(object):
                     tx_hash=obj.tx_hash,
                 )
 
+        # A final transaction is not checked anymore
+        TrackingScheduleManagement.schedule_transaction(obj, resp)
+        obj.save(update_fields=['status', 'next_check_at', 'attempts', 'updated_at'])
+
     @staticmethod
     def track_network_address(address: str, currency: str) -> AddressResponse:
         if settings.TEST:
@@ -185,6 +354,13 @@ class TrackingManagement(object):
         if currency == CURRENCY.BTC:
             return bitpay.get_btc_address(address)
 
+    @staticmethod
+    def track_network_addresses(addresses: list, currency: str) -> dict:
+        if settings.TEST:
+            return {address: AddressResponse(address, Decimal('0'), tx_hashes=['TestTxHash']) for address in addresses}
+
+        return explorer.get_addresses(currency, addresses)
+
     @staticmethod
     def track_network_transaction(tx_hash: str, currency: str) -> TransactionResponse:
         if settings.TEST:
@@ -197,9 +373,154 @@ class TrackingManagement(object):
 
     @staticmethod
     def remove_tracking(order: Order):
-        TrackingTransaction.objects.filter(Q(order=order) | Q(to_address__iexact=order.address)).delete()
-        TrackingAddress.objects.filter(order=order).delete()
+        TrackingManagement.remove_orders_tracking([order.pk], [order.address])
+
+    @staticmethod
+    def remove_orders_tracking(order_ids: list, addresses: list):
+        # Transactions sent to the addresses are found by their tracking address, 1 DELETE per table
+        tracking_address_ids = CryptoAddress.objects \
+            .filter(address__in={AddressManagement.normalize_address(address) for address in addresses},
+                    tracking_address__isnull=False) \
+            .values_list('tracking_address_id', flat=True)
+        TrackingTransaction.objects.filter(Q(order_id__in=order_ids) |
+                                           Q(tracking_address_id__in=list(tracking_address_ids))).delete()
+        TrackingAddress.objects.filter(order_id__in=order_ids).delete()
 
     @staticmethod
     def remove_transaction_tracking(tx_hash: str):
         TrackingTransaction.objects.filter(tx_hash__iexact=tx_hash).delete()
+
+
+class BlockScanManagement(object):
+    """
+    Deposits found by reading each new block once and matching its receiving addresses against the tracked
+    addresses, whatever the number of tracked addresses.
+    """
+
+    @staticmethod
+    def get_address_index(currency: str) -> dict:
+        # Normalized address: tracking address waiting for a deposit
+        objs = TrackingAddress.objects.select_related('order') \
+            .filter(currency=currency, order__isnull=False).exclude(status=TRACKING_ADDRESS_STATUS.completed)
+        return {AddressManagement.normalize_address(obj.address): obj for obj in objs}
+
+    @staticmethod
+    def scan(currency: str) -> dict:
+        # Only confirmed blocks, a scanned block is not read again if a reorg replaces it
+        height = explorer.get_block_height(currency) - BLOCK_SCAN_CONFIRMATIONS[currency]
+        # The 1st run starts from the current block
+        state, _ = BlockScanState.objects.get_or_create(currency=currency, defaults={'height': height - 1})
+        progress = {
+            'from': state.height + 1,
+            'to': min(height, state.height + BLOCK_SCAN_MAX_BLOCKS[currency]),
+            'deposits': 0,
+        }
+        if progress['from'] > progress['to']:
+            return progress
+
+        index = BlockScanManagement.get_address_index(currency)
+        if not index:
+            # Nothing to find in these blocks
+            state.height = progress['to']
+            state.save(update_fields=['height', 'updated_at'])
+            return progress
+
+        for block in range(progress['from'], progress['to'] + 1):
+            txs = explorer.get_block_transactions(currency, block)
+            with transaction.atomic():
+                for tx_hash, addresses in txs:
+                    for address in addresses:
+                        obj = index.get(AddressManagement.normalize_address(address))
+                        if not obj or TrackingTransaction.objects.filter(tx_hash=tx_hash, currency=currency).exists():
+                            continue
+                        if TrackingTransaction.objects.filter(order_id=obj.order_id).exists():
+                            # 1 tracking transaction per order
+                            logging.warning('Deposit %s of order %s is not tracked', tx_hash, obj.order_id)
+                            continue
+                        TrackingManagement.create_tracking_transaction(obj, tx_hash)
+                        progress['deposits'] += 1
+                # Saved with the deposits of the block, a failed run goes on from there
+                state.height = block
+                state.save(update_fields=['height', 'updated_at'])
+
+        return progress
+
+
+class TokenDepositManagement(object):
+    """
+    ERC20 deposits found in the Transfer logs of the active tokens, 1 eth_getLogs request covering all the
+    contracts per block range, the node keeping only the transfers to our payment addresses.
+    """
+
+    @staticmethod
+    def get_payment_index(symbols: set) -> dict:
+        # (normalized address, currency): id of the selling payment waiting for the deposit
+        return {(address, currency): payment_id for address, currency, payment_id in CryptoAddress.objects
+                .filter(selling_payment__currency__in=symbols, selling_payment__status=PAYMENT_STATUS.under)
+                .values_list('address', 'selling_payment__currency', 'selling_payment_id')}
+
+    @staticmethod
+    def scan() -> dict:
+        tokens = {AddressManagement.normalize_address(token.address): token
+                  for token in CryptoToken.objects.filter(active=True)}
+        if not tokens:
+            return {}
+
+        # Only confirmed blocks, a credited deposit can not be dropped by a reorg
+        height = ethereum.get_block_number() - TOKEN_CONFIRMATIONS
+        # A new token starts from the current block
+        new_tokens = [address for address, token in tokens.items() if token.scanned_block is None]
+        CryptoToken.objects.filter(address__in=[tokens[address].address for address in new_tokens]) \
+            .update(scanned_block=height - 1)
+        scanned_blocks = {address: height - 1 if token.scanned_block is None else token.scanned_block
+                          for address, token in tokens.items()}
+
+        start = min(scanned_blocks.values()) + 1
+        progress = {
+            'from': start,
+            'to': min(height, start + TOKEN_LOG_MAX_BLOCKS - 1),
+            'deposits': 0,
+        }
+        if progress['from'] > progress['to']:
+            return progress
+
+        index = TokenDepositManagement.get_payment_index({token.symbol for token in tokens.values()})
+        recipients = sorted({address for address, currency in index})
+        for from_block in range(progress['from'], progress['to'] + 1, TOKEN_LOG_BLOCK_RANGE):
+            to_block = min(progress['to'], from_block + TOKEN_LOG_BLOCK_RANGE - 1)
+            contracts = [address for address, block in scanned_blocks.items() if block < to_block]
+            logs = []
+            for i in range(0, len(recipients), TOKEN_LOG_RECIPIENT_BATCH):
+                logs += ethereum.get_transfer_logs(contracts, recipients[i:i + TOKEN_LOG_RECIPIENT_BATCH],
+                                                   from_block, to_block)
+
+            with transaction.atomic():
+                # Several transfers of a transaction to the same payment make 1 deposit
+                amounts = defaultdict(Decimal)
+                for log in logs:
+                    contract = AddressManagement.normalize_address(log.contract)
+                    token = tokens.get(contract)
+                    if not token or log.block_number <= scanned_blocks[contract]:
+                        continue
+                    payment_id = index.get((AddressManagement.normalize_address(log.to_address), token.symbol))
+                    if payment_id:
+                        amounts[(payment_id, token.symbol, log.tx_hash)] += \
+                            Decimal(log.value) / Decimal(10 ** token.decimals)
+
+                existing = set(SellingPaymentDetail.objects
+                               .filter(tx_hash__in={tx_hash for payment_id, currency, tx_hash in amounts})
+                               .values_list('payment_id', 'tx_hash'))
+                for (payment_id, currency, tx_hash), amount in amounts.items():
+                    if (payment_id, tx_hash) in existing:
+                        continue
+                    SellingPaymentDetail.objects.create(payment_id=payment_id, currency=currency, amount=amount,
+                                                        tx_hash=tx_hash)
+                    progress['deposits'] += 1
+
+                # Saved with the deposits of the range, a failed run goes on from there
+                CryptoToken.objects.filter(address__in=[tokens[address].address for address in contracts]) \
+                    .update(scanned_block=to_block)
+                for address in contracts:
+                    scanned_blocks[address] = to_block
+
+        return progress
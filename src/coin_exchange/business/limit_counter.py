@@ -0,0 +1,479 @@
+import logging
+import time
+from decimal import Decimal
+
+import simplejson
+from django.core.cache import cache
+from django.db import transaction
+from django.db.models import F, Case, When, Value
+
+from coin_exchange.constants import LIMIT_COUNTER_KEY_POOL, LIMIT_COUNTER_KEY_USER, LIMIT_COUNTER_KEY_DIRTY, \
+    LIMIT_COUNTER_FIAT_SCALE, LIMIT_COUNTER_CRYPTO_SCALE, LIMIT_COUNTER_FLUSH_BATCH, USER_LIMIT_WINDOW, \
+    USER_LIMIT_BUCKET, CONFIG_USER_LIMIT_RESET_AT
+from coin_exchange.exceptions import CoinUserOverLimitException, CoinOverLimitException
+from coin_exchange.models import UserLimit, Pool
+from coin_system.business import get_config
+from coin_system.constants import CACHE_KEY_CONFIG
+from coin_system.models import Config
+from common.business import get_now
+from common.constants import DIRECTION_ALL, VALUE_TYPE
+from common.exceptions import UnexpectedException
+
+# Pool counters are hashes with limit and usage as scaled integers.
+# User counters are hashes with limit and 1 field b:<bucket start> per time bucket, their usage is the sum
+# of the buckets in the rolling window, older buckets are removed when they are read.
+# Every script returns -1 when a counter is not loaded yet, the caller loads it from the DB and runs it again.
+
+# KEYS: pool counter, ARGV: amount
+# Return 1 if over the limit, 0 otherwise
+CHECK_POOL_SCRIPT = '''
+local counter = redis.call('HMGET', KEYS[1], 'limit', 'usage')
+if not counter[1] then
+    return -1
+end
+if tonumber(counter[2]) + tonumber(ARGV[1]) > tonumber(counter[1]) then
+    return 1
+end
+return 0
+'''
+
+# Sets usage to the usage of the user counter user_key in the window from window_start,
+# older buckets are removed on the way
+USER_USAGE_SCRIPT = '''
+local usage = 0
+local fields = redis.call('HGETALL', user_key)
+for i = 1, #fields, 2 do
+    local bucket = tonumber(string.match(fields[i], '^b:(%d+)$'))
+    if bucket then
+        if bucket >= window_start then
+            usage = usage + tonumber(fields[i + 1])
+        else
+            redis.call('HDEL', user_key, fields[i])
+        end
+    end
+end
+'''
+
+# KEYS: user counter, ARGV: amount, 1st bucket in the window
+# Return 1 if over the limit, 0 otherwise
+CHECK_USER_SCRIPT = '''
+local user_key, window_start = KEYS[1], tonumber(ARGV[2])
+local limit = redis.call('HGET', user_key, 'limit')
+if not limit then
+    return -1
+end
+''' + USER_USAGE_SCRIPT + '''
+if usage + tonumber(ARGV[1]) > tonumber(limit) then
+    return 1
+end
+return 0
+'''
+
+# KEYS: dirty set, user counter, pool counter
+# ARGV: user amount, pool amount, bucket of the order, 1st bucket in the window
+# Check both limits and take the amounts in 1 step, so concurrent orders can't go over them together.
+# Return 1 if over the pool limit, 2 if over the user limit, 0 when taken
+RESERVE_SCRIPT = '''
+local user_key, window_start = KEYS[2], tonumber(ARGV[4])
+local limit = redis.call('HGET', user_key, 'limit')
+local pool = redis.call('HMGET', KEYS[3], 'limit', 'usage')
+if not limit or not pool[1] then
+    return -1
+end
+''' + USER_USAGE_SCRIPT + '''
+if usage + tonumber(ARGV[1]) > tonumber(limit) then
+    return 2
+end
+if tonumber(pool[2]) + tonumber(ARGV[2]) > tonumber(pool[1]) then
+    return 1
+end
+redis.call('HINCRBY', user_key, 'b:' .. ARGV[3], ARGV[1])
+redis.call('HINCRBY', KEYS[3], 'usage', ARGV[2])
+redis.call('SADD', KEYS[1], KEYS[2], KEYS[3])
+return 0
+'''
+
+# KEYS: dirty set, user counter, pool counter
+# ARGV: user amount, pool amount (negative to release), bucket of the order, 1st bucket in the window
+# Usage never goes under 0, releasing a bucket out of the window does nothing
+UPDATE_SCRIPT = '''
+if redis.call('EXISTS', KEYS[2]) == 0 or redis.call('EXISTS', KEYS[3]) == 0 then
+    return -1
+end
+if tonumber(ARGV[3]) >= tonumber(ARGV[4]) then
+    local field = 'b:' .. ARGV[3]
+    if redis.call('HINCRBY', KEYS[2], field, ARGV[1]) <= 0 then
+        redis.call('HDEL', KEYS[2], field)
+    end
+end
+if redis.call('HINCRBY', KEYS[3], 'usage', ARGV[2]) < 0 then
+    redis.call('HSET', KEYS[3], 'usage', 0)
+end
+redis.call('SADD', KEYS[1], KEYS[2], KEYS[3])
+return 0
+'''
+
+# KEYS: dirty set, counter, ARGV: field, amount to release
+# The field is removed when nothing is left in it
+RELEASE_SCRIPT = '''
+if redis.call('EXISTS', KEYS[2]) == 0 then
+    return -1
+end
+if redis.call('HINCRBY', KEYS[2], ARGV[1], -tonumber(ARGV[2])) <= 0 then
+    if string.sub(ARGV[1], 1, 2) == 'b:' then
+        redis.call('HDEL', KEYS[2], ARGV[1])
+    else
+        redis.call('HSET', KEYS[2], ARGV[1], 0)
+    end
+end
+redis.call('SADD', KEYS[1], KEYS[2])
+return 0
+'''
+
+
+def get_redis():
+    # Counters need a django-redis cache, other backends keep the limits in the DB only
+    try:
+        from django_redis import get_redis_connection
+        return get_redis_connection('default')
+    except NotImplementedError:
+        return None
+
+
+def to_units(amount: Decimal, scale: int) -> int:
+    return int(amount * scale)
+
+
+def from_units(units, scale: int) -> Decimal:
+    return Decimal(int(units)) / scale
+
+
+def get_bucket(timestamp: float) -> int:
+    return int(timestamp) - int(timestamp) % USER_LIMIT_BUCKET
+
+
+def get_window_start(now: float = None) -> int:
+    """
+    1st bucket counted in the user usage, the bucket of the last reset is still counted.
+    """
+    now = now if now is not None else time.time()
+    try:
+        reset_at = int(get_config(CONFIG_USER_LIMIT_RESET_AT).value)
+    except UnexpectedException:
+        reset_at = 0
+
+    return max(get_bucket(now - USER_LIMIT_WINDOW), get_bucket(reset_at))
+
+
+def load_buckets(user_limit: UserLimit) -> dict:
+    buckets = simplejson.loads(user_limit.usage_buckets or '{}')
+    if not buckets and user_limit.usage and user_limit.updated_at:
+        # Usage written before the buckets, counted at its last update
+        return {get_bucket(user_limit.updated_at.timestamp()): user_limit.usage}
+
+    return {int(bucket): Decimal(amount) for bucket, amount in buckets.items()}
+
+
+def dump_buckets(user_limit: UserLimit, buckets: dict, window_start: int):
+    buckets = {bucket: amount for bucket, amount in buckets.items() if bucket >= window_start and amount > 0}
+    user_limit.usage_buckets = simplejson.dumps({str(bucket): str(amount) for bucket, amount in buckets.items()})
+    user_limit.usage = sum(buckets.values(), Decimal(0))
+
+
+class LimitCounterManagement(object):
+    @staticmethod
+    def pool_key(direction: str, currency: str) -> str:
+        return LIMIT_COUNTER_KEY_POOL.format(direction, currency)
+
+    @staticmethod
+    def user_key(user_id: int) -> str:
+        return LIMIT_COUNTER_KEY_USER.format(user_id)
+
+    @staticmethod
+    def load_counter(redis, key: str):
+        # Another worker could have loaded it already, keep its values
+        pipe = redis.pipeline()
+        kind, *args = key.split('.')[1:]
+        if kind == 'pool':
+            direction, currency = args
+            pool = Pool.objects.get(direction=direction, currency=currency)
+            pipe.hsetnx(key, 'limit', to_units(pool.limit, LIMIT_COUNTER_CRYPTO_SCALE))
+            pipe.hsetnx(key, 'usage', to_units(pool.usage, LIMIT_COUNTER_CRYPTO_SCALE))
+        else:
+            user_limit = UserLimit.objects.get(user_id=args[0], direction=DIRECTION_ALL)
+            pipe.hsetnx(key, 'limit', to_units(user_limit.limit, LIMIT_COUNTER_FIAT_SCALE))
+            for bucket, amount in load_buckets(user_limit).items():
+                pipe.hsetnx(key, 'b:{}'.format(bucket), to_units(amount, LIMIT_COUNTER_FIAT_SCALE))
+        pipe.execute()
+
+    @staticmethod
+    def run_script(script: str, keys: list, args: list, counter_keys: list):
+        redis = get_redis()
+        result = redis.register_script(script)(keys=keys, args=args)
+        if result == -1:
+            for key in counter_keys:
+                if not redis.exists(key):
+                    LimitCounterManagement.load_counter(redis, key)
+            result = redis.register_script(script)(keys=keys, args=args)
+        return result
+
+    @staticmethod
+    def check_pool(direction: str, amount: Decimal, currency: str):
+        if not get_redis():
+            pool = Pool.objects.get(direction=direction, currency=currency)
+            if pool.usage + amount > pool.limit:
+                raise CoinOverLimitException
+            return
+
+        key = LimitCounterManagement.pool_key(direction, currency)
+        if LimitCounterManagement.run_script(CHECK_POOL_SCRIPT, [key],
+                                             [to_units(amount, LIMIT_COUNTER_CRYPTO_SCALE)], [key]):
+            raise CoinOverLimitException
+
+    @staticmethod
+    def check_user_limit(user, amount: Decimal):
+        window_start = get_window_start()
+        if not get_redis():
+            user_limit = UserLimit.objects.get(user=user, direction=DIRECTION_ALL, fiat_currency=user.currency)
+            usage = sum((value for bucket, value in load_buckets(user_limit).items() if bucket >= window_start),
+                        Decimal(0))
+            if usage + amount > user_limit.limit:
+                raise CoinUserOverLimitException
+            return
+
+        key = LimitCounterManagement.user_key(user.pk)
+        if LimitCounterManagement.run_script(CHECK_USER_SCRIPT, [key],
+                                             [to_units(amount, LIMIT_COUNTER_FIAT_SCALE), window_start], [key]):
+            raise CoinUserOverLimitException
+
+    @staticmethod
+    def reserve_usage(user, user_amount: Decimal, direction: str, currency: str, pool_amount: Decimal,
+                      timestamp: float = None) -> bool:
+        """
+        Check the user and pool limits and take the amounts if they fit.
+        Return True when taken in Redis, it is not rolled back with the transaction so the caller gives it back
+        with update_usage if the order is not committed. In the DB it is rolled back with the transaction.
+        """
+        bucket = get_bucket(timestamp if timestamp is not None else time.time())
+        window_start = get_window_start()
+        if not get_redis():
+            LimitCounterManagement.reserve_db_usage(user, user_amount, direction, currency, pool_amount,
+                                                    bucket, window_start)
+            return False
+
+        counter_keys = [LimitCounterManagement.user_key(user.pk),
+                        LimitCounterManagement.pool_key(direction, currency)]
+        result = LimitCounterManagement.run_script(RESERVE_SCRIPT, [LIMIT_COUNTER_KEY_DIRTY] + counter_keys,
+                                                   [to_units(user_amount, LIMIT_COUNTER_FIAT_SCALE),
+                                                    to_units(pool_amount, LIMIT_COUNTER_CRYPTO_SCALE),
+                                                    bucket, window_start],
+                                                   counter_keys)
+        if result == 1:
+            raise CoinOverLimitException
+        if result == 2:
+            raise CoinUserOverLimitException
+        return True
+
+    @staticmethod
+    @transaction.atomic
+    def reserve_db_usage(user, user_amount: Decimal, direction: str, currency: str, pool_amount: Decimal,
+                         bucket: int, window_start: int):
+        # The user row is locked, the pool is only updated while the amount fits in its limit
+        user_limit = UserLimit.objects.select_for_update().get(user=user, direction=DIRECTION_ALL,
+                                                               fiat_currency=user.currency)
+        buckets = load_buckets(user_limit)
+        usage = sum((value for key, value in buckets.items() if key >= window_start), Decimal(0))
+        if usage + user_amount > user_limit.limit:
+            raise CoinUserOverLimitException
+
+        if not Pool.objects.filter(direction=direction, currency=currency, usage__lte=F('limit') - pool_amount) \
+                .update(usage=F('usage') + pool_amount, updated_at=get_now()):
+            raise CoinOverLimitException
+
+        buckets[bucket] = buckets.get(bucket, Decimal(0)) + user_amount
+        dump_buckets(user_limit, buckets, window_start)
+        user_limit.save(update_fields=['usage', 'usage_buckets', 'updated_at'])
+
+    @staticmethod
+    def update_usage(user, user_amount: Decimal, direction: str, currency: str, pool_amount: Decimal,
+                     timestamp: float = None):
+        # The user usage goes in the bucket of the order, so releasing it later takes it from the same bucket
+        bucket = get_bucket(timestamp if timestamp is not None else time.time())
+        window_start = get_window_start()
+        if not get_redis():
+            LimitCounterManagement.update_db_usage(user, user_amount, direction, currency, pool_amount,
+                                                   bucket, window_start)
+            return
+
+        counter_keys = [LimitCounterManagement.user_key(user.pk),
+                        LimitCounterManagement.pool_key(direction, currency)]
+        LimitCounterManagement.run_script(UPDATE_SCRIPT, [LIMIT_COUNTER_KEY_DIRTY] + counter_keys,
+                                          [to_units(user_amount, LIMIT_COUNTER_FIAT_SCALE),
+                                           to_units(pool_amount, LIMIT_COUNTER_CRYPTO_SCALE),
+                                           bucket, window_start],
+                                          counter_keys)
+
+    @staticmethod
+    @transaction.atomic
+    def update_db_usage(user, user_amount: Decimal, direction: str, currency: str, pool_amount: Decimal,
+                        bucket: int, window_start: int):
+        # Only the row of this user is locked
+        user_limit = UserLimit.objects.select_for_update().filter(user=user, direction=DIRECTION_ALL,
+                                                                  fiat_currency=user.currency).first()
+        if user_limit and bucket >= window_start:
+            buckets = load_buckets(user_limit)
+            buckets[bucket] = buckets.get(bucket, Decimal(0)) + user_amount
+            dump_buckets(user_limit, buckets, window_start)
+            user_limit.save(update_fields=['usage', 'usage_buckets', 'updated_at'])
+
+        if pool_amount >= 0:
+            Pool.objects.filter(direction=direction, currency=currency) \
+                .update(usage=F('usage') + pool_amount, updated_at=get_now())
+        else:
+            pool = Pool.objects.get(direction=direction, currency=currency)
+            if pool.usage < -pool_amount:
+                pool.usage = 0
+            else:
+                pool.usage = F('usage') + pool_amount
+            pool.save()
+
+    @staticmethod
+    def release_usage(user_amounts: dict, pool_amounts: dict):
+        """
+        Release the usage of many orders at once.
+        user_amounts: {user id: {bucket: amount in the user currency}}
+        pool_amounts: {(direction, currency): amount}
+        """
+        window_start = get_window_start()
+        if not get_redis():
+            LimitCounterManagement.release_db_usage(user_amounts, pool_amounts, window_start)
+            return
+
+        # Redis is not rolled back with the transaction, the usage is only released once the orders are committed
+        transaction.on_commit(lambda: LimitCounterManagement.release_redis_usage(user_amounts, pool_amounts,
+                                                                                 window_start))
+
+    @staticmethod
+    def release_redis_usage(user_amounts: dict, pool_amounts: dict, window_start: int):
+        for user_id, buckets in user_amounts.items():
+            key = LimitCounterManagement.user_key(user_id)
+            for bucket, amount in buckets.items():
+                if bucket >= window_start:
+                    LimitCounterManagement.run_script(RELEASE_SCRIPT, [LIMIT_COUNTER_KEY_DIRTY, key],
+                                                      ['b:{}'.format(bucket),
+                                                       to_units(amount, LIMIT_COUNTER_FIAT_SCALE)], [key])
+        for (direction, currency), amount in pool_amounts.items():
+            key = LimitCounterManagement.pool_key(direction, currency)
+            LimitCounterManagement.run_script(RELEASE_SCRIPT, [LIMIT_COUNTER_KEY_DIRTY, key],
+                                              ['usage', to_units(amount, LIMIT_COUNTER_CRYPTO_SCALE)], [key])
+
+    @staticmethod
+    @transaction.atomic
+    def release_db_usage(user_amounts: dict, pool_amounts: dict, window_start: int):
+        # 1 UPDATE per pool and 1 per user, whatever the number of orders
+        now = get_now()
+        for (direction, currency), amount in pool_amounts.items():
+            Pool.objects.filter(direction=direction, currency=currency) \
+                .update(usage=Case(When(usage__lt=amount, then=Value(0)), default=F('usage') - amount),
+                        updated_at=now)
+
+        user_limits = UserLimit.objects.select_for_update() \
+            .filter(user_id__in=user_amounts.keys(), direction=DIRECTION_ALL, fiat_currency=F('user__currency'))
+        for user_limit in user_limits:
+            buckets = load_buckets(user_limit)
+            for bucket, amount in user_amounts[user_limit.user_id].items():
+                if bucket >= window_start:
+                    buckets[bucket] = buckets.get(bucket, Decimal(0)) - amount
+            dump_buckets(user_limit, buckets, window_start)
+            user_limit.save(update_fields=['usage', 'usage_buckets', 'updated_at'])
+
+    @staticmethod
+    def set_limit(key: str, limit: Decimal, scale: int):
+        # Only update a loaded counter, the others get the new limit when they are loaded
+        redis = get_redis()
+        if redis and redis.exists(key):
+            redis.hset(key, 'limit', to_units(limit, scale))
+
+    @staticmethod
+    def set_user_limit(user_limit: UserLimit):
+        LimitCounterManagement.set_limit(LimitCounterManagement.user_key(user_limit.user_id),
+                                         user_limit.limit, LIMIT_COUNTER_FIAT_SCALE)
+
+    @staticmethod
+    def reload_counter(key: str):
+        # The row was written outside of the counters (e.g. by an admin), drop the counter once it is committed
+        # so it is loaded again from the row and the next flush doesn't write the old usage over it
+        redis = get_redis()
+        if redis:
+            def drop():
+                pipe = redis.pipeline()
+                pipe.srem(LIMIT_COUNTER_KEY_DIRTY, key)
+                pipe.delete(key)
+                pipe.execute()
+            transaction.on_commit(drop)
+
+    @staticmethod
+    def reload_pool_counter(pool: Pool):
+        LimitCounterManagement.reload_counter(LimitCounterManagement.pool_key(pool.direction, pool.currency))
+
+    @staticmethod
+    def reload_user_counter(user_limit: UserLimit):
+        LimitCounterManagement.reload_counter(LimitCounterManagement.user_key(user_limit.user_id))
+
+    @staticmethod
+    def flush():
+        """
+        Write the usage of the changed counters back to Pool and UserLimit.
+        """
+        redis = get_redis()
+        if not redis:
+            return 0
+
+        count = 0
+        window_start = get_window_start()
+        while True:
+            keys = [key.decode() for key in
+                    redis.execute_command('SPOP', LIMIT_COUNTER_KEY_DIRTY, LIMIT_COUNTER_FLUSH_BATCH) or []]
+            if not keys:
+                return count
+
+            pipe = redis.pipeline()
+            for key in keys:
+                pipe.hgetall(key)
+            now = get_now()
+            for key, counter in zip(keys, pipe.execute()):
+                if not counter:
+                    continue
+                try:
+                    counter = {field.decode(): value for field, value in counter.items()}
+                    kind, *args = key.split('.')[1:]
+                    if kind == 'pool':
+                        Pool.objects.filter(direction=args[0], currency=args[1]) \
+                            .update(usage=from_units(counter['usage'], LIMIT_COUNTER_CRYPTO_SCALE), updated_at=now)
+                    else:
+                        user_limit = UserLimit(user_id=args[0])
+                        dump_buckets(user_limit, {int(field[2:]): from_units(value, LIMIT_COUNTER_FIAT_SCALE)
+                                                  for field, value in counter.items() if field.startswith('b:')},
+                                     window_start)
+                        UserLimit.objects.filter(user_id=args[0], direction=DIRECTION_ALL) \
+                            .update(usage=user_limit.usage, usage_buckets=user_limit.usage_buckets, updated_at=now)
+                    count += 1
+                except Exception as e:
+                    # Flush it again next time
+                    redis.sadd(LIMIT_COUNTER_KEY_DIRTY, key)
+                    logging.exception(e)
+
+    @staticmethod
+    def reset_user_usage():
+        # Usage before the current bucket is not counted anymore, nothing is written per user
+        Config.objects.update_or_create(key=CONFIG_USER_LIMIT_RESET_AT,
+                                        defaults={'value': str(int(time.time())), 'value_type': VALUE_TYPE.int})
+        cache.delete(CACHE_KEY_CONFIG.format(CONFIG_USER_LIMIT_RESET_AT))
+
+    @staticmethod
+    def drop_user_counter(user_id: int):
+        # Write the usage back first, the counter is loaded again from the DB on next use
+        redis = get_redis()
+        if redis:
+            LimitCounterManagement.flush()
+            redis.delete(LimitCounterManagement.user_key(user_id))
@@ -1,17 +1,16 @@
 import logging
 
 import simplejson
+from collections import defaultdict
 from datetime import timedelta
 from decimal import Decimal
 
-import requests
-from django.conf import settings
 from django.contrib.auth.models import User
 from django.db import transaction
-from django.db.models import F, Q
-from requests import Timeout
+from django.db.models import Q
 
-from coin_exchange.business.crypto import CryptoTransactionManagement
+from coin_exchange.business.crypto import CryptoTransactionManagement, TrackingManagement, AddressManagement
+from coin_exchange.business.limit_counter import LimitCounterManagement, get_bucket
 from coin_exchange.business.quote import QuoteManagement
 from coin_exchange.constants import (
     MIN_ETH_AMOUNT,
@@ -22,14 +21,16 @@ from coin_exchange.constants import (
     REF_CODE_LENGTH,
     ORDER_STATUS, ORDER_USER_PAYMENT_TYPE)
 from coin_exchange.exceptions import AmountIsTooSmallException, PriceChangeException, InvalidOrderStatusException
-from coin_exchange.models import UserLimit, Pool, Order
+from coin_exchange.models import Order, UserLimit
 from coin_exchange.serializers import OrderSerializer, SellingOrderSerializer
 from coin_system.business import round_crypto_currency
 from common.business import validate_crypto_address, get_now, generate_random_code, RateManagement
-from common.constants import DIRECTION, CURRENCY, FIAT_CURRENCY, DIRECTION_ALL
-from common.exceptions import InvalidAddress, InvalidInputDataException
+from common.constants import DIRECTION, CURRENCY, FIAT_CURRENCY
+from common.exceptions import InvalidAddress, InvalidInputDataException, InvalidDataException
 from common.provider_data import ProviderData
 from integration import bitstamp
+from notification.business import NotificationOutboxManagement
+from notification.constants import NOTIFICATION_OUTBOX_KIND
 
 
 class OrderManagement(object):
@@ -49,9 +50,9 @@ class OrderManagement(object):
     #                                         > REJECTED
 
     @staticmethod
-    @transaction.atomic
     def add_order(user: User, serializer: OrderSerializer) -> Order:
         safe_data = serializer.validated_data
+        quote_token = safe_data.pop('quote_token', None)
         amount = safe_data['amount']
         currency = safe_data['currency']
         address = safe_data['address']
@@ -59,17 +60,18 @@ class OrderManagement(object):
         fiat_local_currency = safe_data['fiat_local_currency']
         direction = DIRECTION.buy
 
-        check_fiat_amount, check_fee, quote_data = OrderManagement._validate_data(user, direction,
-                                                                                  address, amount, currency,
-                                                                                  fiat_local_amount,
-                                                                                  fiat_local_currency,
-                                                                                  safe_data)
-        order = serializer.save(
+        check_fiat_amount, check_fee, quote = OrderManagement._validate_data(user, direction,
+                                                                             address, amount, currency,
+                                                                             fiat_local_amount,
+                                                                             fiat_local_currency,
+                                                                             safe_data, quote_token)
+        order = OrderManagement._save_order(
+            serializer,
             user=user.exchange_user,
             fiat_amount=check_fiat_amount,
             fiat_currency=FIAT_CURRENCY.USD,
-            raw_fiat_amount=quote_data['raw_fiat_amount'],
-            price=quote_data['price'],
+            raw_fiat_amount=quote.raw_fiat_amount,
+            price=quote.price,
             direction=direction,
             duration=ORDER_EXPIRATION_DURATION,
             fee=check_fee,
@@ -79,9 +81,9 @@ class OrderManagement(object):
         return order
 
     @staticmethod
-    @transaction.atomic
     def add_selling_order(user: User, serializer: SellingOrderSerializer) -> Order:
         safe_data = serializer.validated_data
+        quote_token = safe_data.pop('quote_token', None)
         amount = safe_data['amount']
         currency = safe_data['currency']
         address = safe_data['address']
@@ -89,18 +91,19 @@ class OrderManagement(object):
         fiat_local_currency = safe_data['fiat_local_currency']
         direction = DIRECTION.sell
 
-        check_fiat_amount, check_fee, quote_data = OrderManagement._validate_data(user, direction,
-                                                                                  address, amount, currency,
-                                                                                  fiat_local_amount,
-                                                                                  fiat_local_currency,
-                                                                                  safe_data)
+        check_fiat_amount, check_fee, quote = OrderManagement._validate_data(user, direction,
+                                                                             address, amount, currency,
+                                                                             fiat_local_amount,
+                                                                             fiat_local_currency,
+                                                                             safe_data, quote_token)
 
-        order = serializer.save(
+        order = OrderManagement._save_order(
+            serializer,
             user=user.exchange_user,
             fiat_amount=check_fiat_amount,
             fiat_currency=FIAT_CURRENCY.USD,
-            raw_fiat_amount=quote_data['raw_fiat_amount'],
-            price=quote_data['price'],
+            raw_fiat_amount=quote.raw_fiat_amount,
+            price=quote.price,
             direction=DIRECTION.sell,
             status=ORDER_STATUS.transferring,
             fee=check_fee,
@@ -109,6 +112,22 @@ class OrderManagement(object):
         )
         return order
 
+    @staticmethod
+    def _save_order(serializer, **kwargs) -> Order:
+        # The limits are checked and taken with the order, Redis is not rolled back with the transaction
+        # so what was taken there is given back when the order is not committed
+        order, reserved = None, False
+        try:
+            with transaction.atomic():
+                order = serializer.save(**kwargs)
+                reserved = OrderManagement.reserve_limit(order)
+        except Exception:
+            if reserved:
+                OrderManagement.decrease_limit(order.user, order.amount, order.currency, order.direction,
+                                               order.fiat_local_amount, order.fiat_local_currency, order.created_at)
+            raise
+        return order
+
     @staticmethod
     @transaction.atomic
     def cancel_order(user: User, order: Order):
@@ -167,58 +186,74 @@ class OrderManagement(object):
 
     @staticmethod
     @transaction.atomic
-    def expire_order():
+    def expire_order() -> int:
+        # Set based, no post_save for each order: the limits of all orders are released together
         now = get_now()
-        orders = Order.objects.filter(created_at__lt=now - timedelta(seconds=ORDER_EXPIRATION_DURATION),
-                                      status=ORDER_STATUS.pending, order_type=ORDER_TYPE.bank,
-                                      direction=DIRECTION.buy)
+        orders = list(Order.objects.select_for_update()
+                      .filter(created_at__lt=now - timedelta(seconds=ORDER_EXPIRATION_DURATION),
+                              status=ORDER_STATUS.pending, order_type=ORDER_TYPE.bank, direction=DIRECTION.buy)
+                      .values('id', 'user_id', 'user__currency', 'amount', 'currency', 'direction',
+                              'fiat_local_amount', 'fiat_local_currency', 'address', 'created_at'))
+        if not orders:
+            return 0
+
+        order_ids = [order['id'] for order in orders]
+        Order.objects.filter(id__in=order_ids).update(status=ORDER_STATUS.expired, updated_at=now)
+
+        user_amounts = defaultdict(lambda: defaultdict(Decimal))
+        pool_amounts = defaultdict(Decimal)
         for order in orders:
-            order.status = ORDER_STATUS.expired
-            order.save(update_fields=['status', 'updated_at'])
+            # Convert local currency to user currency
+            update_amount = order['fiat_local_amount']
+            if order['user__currency'] != order['fiat_local_currency']:
+                update_amount = RateManagement.convert_currency(update_amount, order['fiat_local_currency'],
+                                                                order['user__currency'])
+            user_amounts[order['user_id']][get_bucket(order['created_at'].timestamp())] += update_amount
+            pool_amounts[(order['direction'], order['currency'])] += order['amount']
+
+        LimitCounterManagement.release_usage(user_amounts, pool_amounts)
+        TrackingManagement.remove_orders_tracking(order_ids, [order['address'] for order in orders])
+
+        return len(orders)
 
     @staticmethod
     def reset_user_limit():
-        UserLimit.objects.filter(direction=DIRECTION_ALL).update(usage=0, updated_at=get_now())
+        LimitCounterManagement.reset_user_usage()
 
     @staticmethod
-    def increase_limit(user, amount, currency, direction, fiat_local_amount, fiat_local_currency):
+    def reserve_limit(order: Order) -> bool:
+        # Convert local currency to user currency
+        user = order.user
+        update_amount = order.fiat_local_amount
+        if user.currency != order.fiat_local_currency:
+            update_amount = RateManagement.convert_currency(update_amount, order.fiat_local_currency, user.currency)
+
+        try:
+            return LimitCounterManagement.reserve_usage(user, update_amount, order.direction, order.currency,
+                                                        order.amount, order.created_at.timestamp())
+        except UserLimit.DoesNotExist as e:
+            logging.exception(e)
+            raise InvalidDataException
+
+    @staticmethod
+    def increase_limit(user, amount, currency, direction, fiat_local_amount, fiat_local_currency, created_at=None):
         # Convert local currency to user currency
         update_amount = fiat_local_amount
         if user.currency != fiat_local_currency:
             update_amount = RateManagement.convert_currency(update_amount, fiat_local_currency, user.currency)
-        UserLimit.objects.filter(user=user,
-                                 direction=DIRECTION_ALL,
-                                 fiat_currency=user.currency) \
-            .update(usage=F('usage') + update_amount,
-                    updated_at=get_now())
 
-        Pool.objects.filter(direction=direction,
-                            currency=currency).update(usage=F('usage') + amount,
-                                                      updated_at=get_now())
+        LimitCounterManagement.update_usage(user, update_amount, direction, currency, amount,
+                                            created_at.timestamp() if created_at else None)
 
     @staticmethod
-    def decrease_limit(user, amount, currency, direction, fiat_local_amount, fiat_local_currency):
+    def decrease_limit(user, amount, currency, direction, fiat_local_amount, fiat_local_currency, created_at=None):
         # Convert local currency to user currency
         update_amount = fiat_local_amount
         if user.currency != fiat_local_currency:
             update_amount = RateManagement.convert_currency(update_amount, fiat_local_currency, user.currency)
 
-        user_limit = UserLimit.objects.get(user=user,
-                                           direction=DIRECTION_ALL,
-                                           fiat_currency=user.currency)
-        if user_limit.usage < update_amount:
-            user_limit.usage = 0
-        else:
-            user_limit.usage = F('usage') - update_amount
-        user_limit.save()
-
-        pool = Pool.objects.get(direction=direction,
-                                currency=currency)
-        if pool.usage < amount:
-            pool.usage = 0
-        else:
-            pool.usage = F('usage') - amount
-        pool.save()
+        LimitCounterManagement.update_usage(user, -update_amount, direction, currency, -amount,
+                                            created_at.timestamp() if created_at else None)
 
     @staticmethod
     def load_transferring_order_to_track():
@@ -232,9 +267,12 @@ class OrderManagement(object):
             try:
                 data = ProviderData(None, order.provider_data).from_json()
                 tx = dict_tx.get(data.get('tx_id', ''))
-                if tx:
-                    order.tx_hash = tx.get('transaction_id', '')
-                    order.save(update_fields=['status', 'tx_hash', 'updated_at'])
+                if tx and tx.get('transaction_id'):
+                    order.tx_hash = tx['transaction_id']
+                    # The order reached transferring without a tx hash, it is tracked from now on
+                    with transaction.atomic():
+                        order.save(update_fields=['tx_hash', 'updated_at'])
+                        TrackingManagement.create_tracking_simple_transaction(order)
             except Exception as ex:
                 logging.exception(ex)
 
@@ -252,28 +290,33 @@ class OrderManagement(object):
             raise PriceChangeException
 
     @staticmethod
-    def _validate_data(user, direction, address, amount, currency, fiat_local_amount, fiat_local_currency, safe_data):
+    def _validate_data(user, direction, address, amount, currency, fiat_local_amount, fiat_local_currency, safe_data,
+                       quote_token: str = None):
         OrderManagement._check_minimum_amount(amount, currency)
         if not validate_crypto_address(currency, address):
             raise InvalidAddress
-        if Order.objects.filter(address=address, direction=DIRECTION.sell).first():
+        if AddressManagement.is_sell_address(address):
             raise InvalidAddress
 
-        quote_data = QuoteManagement.get_quote(user, {
-            'amount': round_crypto_currency(amount),
-            'currency': currency,
-            'fiat_currency': fiat_local_currency,
-            'check': True,
-            'user_check': True,
-            'direction': direction,
-        }).data
-        check_fiat_amount = Decimal(quote_data['fiat_amount'])
-        check_fiat_local_amount = Decimal(quote_data['fiat_local_amount'])
-        check_fee = Decimal(quote_data['fee'])
+        quote = None
+        if quote_token:
+            quote = QuoteManagement.load_quote(quote_token, amount, currency, direction, fiat_local_currency)
+
+        # The limits are not checked here, they are taken with the order by reserve_limit
+        if not quote:
+            quote = QuoteManagement.get_quote(user, {
+                'amount': round_crypto_currency(amount),
+                'currency': currency,
+                'fiat_currency': fiat_local_currency,
+                'direction': direction,
+            })
+        check_fiat_amount = quote.fiat_amount
+        check_fiat_local_amount = quote.fiat_local_amount
+        check_fee = quote.fee
         if direction == DIRECTION.buy and safe_data['order_type'] == ORDER_TYPE.cod:
-            check_fiat_amount = Decimal(quote_data['fiat_amount_cod'])
-            check_fiat_local_amount = Decimal(quote_data['fiat_local_amount_cod'])
-            check_fee = Decimal(quote_data['fee_cod'])
+            check_fiat_amount = quote.fiat_amount_cod
+            check_fiat_local_amount = quote.fiat_local_amount_cod
+            check_fee = quote.fee_cod
         if direction == DIRECTION.sell:
             if safe_data.get('user_info'):
                 user_info = simplejson.loads(safe_data['user_info'])
@@ -283,22 +326,14 @@ class OrderManagement(object):
                         raise InvalidInputDataException
 
         OrderManagement._check_different_in_threshold(fiat_local_amount, check_fiat_local_amount)
-        return check_fiat_amount, check_fee, quote_data
+        return check_fiat_amount, check_fee, quote
 
     @staticmethod
     def send_new_order_notification(order: Order):
-        if settings.UNIT_TEST:
-            return
-
-        url = settings.NOTIFICATION_API + '/new-order-notification/'
-        try:
-            requests.post(url, json={
-                'order_type': order.order_type,
-                'direction': order.direction,
-                'ref_code': order.ref_code,
-                'id': order.id,
-            }, headers={'Content-type': 'application/json'}, timeout=200)
-        except Timeout:
-            pass
-        except Exception as ex:
-            logging.error(ex)
+        # Written with the order, sent by the outbox worker
+        NotificationOutboxManagement.add(NOTIFICATION_OUTBOX_KIND.new_order, {
+            'order_type': order.order_type,
+            'direction': order.direction,
+            'ref_code': order.ref_code,
+            'id': order.id,
+        })
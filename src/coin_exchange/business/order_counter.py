@@ -0,0 +1,71 @@
+from datetime import date, datetime, time, timedelta
+
+from django.db import transaction, IntegrityError
+from django.db.models import F, Count
+from django.utils import timezone
+
+from coin_exchange.constants import ORDER_TYPE
+from coin_exchange.models import Order, OrderCounter
+from common.business import get_now
+from common.constants import DIRECTION
+
+# Only the COD buys are counted, the counter row is updated in the transaction of each of these orders
+COUNTED_ORDERS = {(DIRECTION.buy, ORDER_TYPE.cod)}
+
+
+def get_day(timestamp: datetime) -> date:
+    return timezone.localdate(timestamp)
+
+
+def get_day_range(day: date) -> tuple:
+    # Start and end of the day in the current timezone, so created_at is compared with its index
+    start = timezone.make_aware(datetime.combine(day, time.min))
+    return start, start + timedelta(days=1)
+
+
+class OrderCounterManagement(object):
+    @staticmethod
+    def increase_counter(order: Order):
+        day = get_day(order.created_at)
+        counters = OrderCounter.objects.filter(day=day, direction=order.direction, order_type=order.order_type)
+        if counters.update(count=F('count') + 1, updated_at=get_now()):
+            return
+
+        try:
+            with transaction.atomic():
+                OrderCounter.objects.create(day=day, direction=order.direction, order_type=order.order_type, count=1)
+        except IntegrityError:
+            # Created by another order in the meantime
+            counters.update(count=F('count') + 1, updated_at=get_now())
+
+    @staticmethod
+    def get_count(day: date, direction: str, order_type: str) -> int:
+        count = OrderCounter.objects.filter(day=day, direction=direction, order_type=order_type) \
+            .values_list('count', flat=True).first()
+        return count or 0
+
+    @staticmethod
+    def get_orders(day: date):
+        start, end = get_day_range(day)
+        return Order.objects.filter(created_at__gte=start, created_at__lt=end)
+
+    @staticmethod
+    def recount(day: date) -> dict:
+        """
+        Rebuild the counters of a day from its orders, for audit or after a missed update.
+        """
+        result = {}
+        counts = OrderCounterManagement.get_orders(day).order_by() \
+            .values('direction', 'order_type').annotate(total=Count('id'))
+        for item in counts:
+            if (item['direction'], item['order_type']) in COUNTED_ORDERS:
+                result[(item['direction'], item['order_type'])] = item['total']
+
+        for counter in OrderCounter.objects.filter(day=day):
+            result.setdefault((counter.direction, counter.order_type), 0)
+
+        for (direction, order_type), count in result.items():
+            OrderCounter.objects.update_or_create(day=day, direction=direction, order_type=order_type,
+                                                  defaults={'count': count})
+
+        return result
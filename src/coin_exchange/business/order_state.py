@@ -0,0 +1,185 @@
+import logging
+from collections import defaultdict
+
+from django.db import transaction
+
+from coin_exchange.business.crypto import TrackingManagement
+from coin_exchange.business.order import OrderManagement
+from coin_exchange.business.order_counter import OrderCounterManagement
+from coin_exchange.business.promotion import PromotionManagement
+from coin_exchange.business.referral import ReferralManagement
+from coin_exchange.constants import ORDER_STATUS, ORDER_TYPE
+from coin_exchange.models import Order
+from coin_user.business import UserManagement
+from common.constants import DIRECTION
+
+# Pseudo status reached by a new order
+ORDER_CREATED = 'created'
+
+# Status changes allowed per direction, (None, ORDER_CREATED) being the creation
+ORDER_TRANSITIONS = {
+    DIRECTION.buy: {
+        (None, ORDER_CREATED),
+        (ORDER_STATUS.pending, ORDER_STATUS.fiat_transferring),
+        (ORDER_STATUS.pending, ORDER_STATUS.processing),
+        (ORDER_STATUS.pending, ORDER_STATUS.cancelled),
+        (ORDER_STATUS.pending, ORDER_STATUS.expired),
+        (ORDER_STATUS.fiat_transferring, ORDER_STATUS.processing),
+        (ORDER_STATUS.processing, ORDER_STATUS.transferring),
+        (ORDER_STATUS.processing, ORDER_STATUS.transfer_failed),
+        (ORDER_STATUS.processing, ORDER_STATUS.rejected),
+        (ORDER_STATUS.processing, ORDER_STATUS.cancelled),
+        (ORDER_STATUS.transfer_failed, ORDER_STATUS.transferring),
+        (ORDER_STATUS.transferring, ORDER_STATUS.transfer_failed),
+        (ORDER_STATUS.transferring, ORDER_STATUS.success),
+    },
+    DIRECTION.sell: {
+        (None, ORDER_CREATED),
+        (ORDER_STATUS.transferring, ORDER_STATUS.transferred),
+        (ORDER_STATUS.transferred, ORDER_STATUS.processing),
+        (ORDER_STATUS.processing, ORDER_STATUS.success),
+        (ORDER_STATUS.processing, ORDER_STATUS.rejected),
+    },
+}
+
+
+class EffectBatch(object):
+    """
+    Deferred effects of 1 transition, run together in the request once it is committed.
+    """
+    __slots__ = ('effects', 'order')
+
+    def __init__(self, effects: list, order: Order):
+        self.effects = effects
+        self.order = order
+
+    def __call__(self):
+        for effect in self.effects:
+            run_effect(effect, self.order)
+
+
+def run_effect(effect, order: Order):
+    try:
+        effect(order)
+    except Exception as ex:
+        # I don't want the alter flow effect the ORDER
+        logging.exception(ex)
+
+
+def get_loaded_status(order: Order):
+    # Status of the order in the DB, kept by Order.from_db and after each save
+    if order.loaded_status is None:
+        order.loaded_status = Order.objects.filter(pk=order.pk).values_list('status', flat=True).first()
+    return order.loaded_status
+
+
+class OrderStateMachine(object):
+    """
+    Side effects registered per transition, a transition being identified by the direction, the status the
+    order had when it was loaded and the status it is saved with.
+    Immediate effects run in the transaction saving the order, deferred effects are run after commit.
+    """
+
+    def __init__(self, transitions: dict = None):
+        self.transitions = transitions or ORDER_TRANSITIONS
+        # {(direction, from status, to status): [(order types, effect, deferred)]}
+        self.effects = defaultdict(list)
+
+    def register(self, directions: tuple, transitions: tuple, effect, order_types: tuple = None,
+                 deferred: bool = True):
+        for direction in directions:
+            for from_status, to_status in transitions:
+                if (from_status, to_status) not in self.transitions[direction]:
+                    raise ValueError('{} order can not go from {} to {}'.format(direction, from_status, to_status))
+                self.effects[(direction, from_status, to_status)].append((order_types, effect, deferred))
+
+    def saved(self, order: Order, created: bool, update_fields=None):
+        """
+        Called after saving an order, run the effects of its status change.
+        """
+        if created:
+            self.transition(order, None, ORDER_CREATED)
+        elif update_fields is None or 'status' in update_fields:
+            from_status = get_loaded_status(order)
+            if from_status == order.status:
+                pass
+            elif (from_status, order.status) in self.transitions[order.direction]:
+                self.transition(order, from_status, order.status)
+            else:
+                # Manual corrections, by the admin for instance, are saved without effects
+                logging.warning('%s order %s went from %s to %s, no effect is run',
+                                order.direction, order.pk, from_status, order.status)
+        else:
+            return
+        order.loaded_status = order.status
+
+    def transition(self, order: Order, from_status, to_status: str):
+        deferred_effects = []
+        for order_types, effect, deferred in self.effects[(order.direction, from_status, to_status)]:
+            if order_types and order.order_type not in order_types:
+                continue
+            if deferred:
+                deferred_effects.append(effect)
+            else:
+                run_effect(effect, order)
+
+        if deferred_effects:
+            # Run at once when the order is saved out of a transaction
+            transaction.on_commit(EffectBatch(deferred_effects, order))
+
+
+def decrease_limit(order: Order):
+    OrderManagement.decrease_limit(order.user, order.amount, order.currency, order.direction,
+                                   order.fiat_local_amount, order.fiat_local_currency, order.created_at)
+
+
+def create_tracking_transaction(order: Order):
+    if order.tx_hash:
+        TrackingManagement.create_tracking_simple_transaction(order)
+
+
+def complete_order(order: Order):
+    UserManagement.update_first_purchase(order.user)
+    ReferralManagement.create_referral(order)
+    PromotionManagement.create_promotion(order)
+    # TODO Send notification
+
+
+BUY = (DIRECTION.buy,)
+SELL = (DIRECTION.sell,)
+CREATED = ((None, ORDER_CREATED),)
+BUY_RELEASED = (
+    (ORDER_STATUS.pending, ORDER_STATUS.expired),
+    (ORDER_STATUS.pending, ORDER_STATUS.cancelled),
+    (ORDER_STATUS.processing, ORDER_STATUS.cancelled),
+    (ORDER_STATUS.processing, ORDER_STATUS.rejected),
+)
+SELL_RELEASED = ((ORDER_STATUS.processing, ORDER_STATUS.rejected),)
+
+order_state_machine = OrderStateMachine()
+
+# Limits and counters are checked by the next orders, they are kept in the transaction of the order.
+# The limits of a new order are taken with it by OrderManagement.reserve_limit
+order_state_machine.register(BUY, CREATED, OrderCounterManagement.increase_counter, order_types=(ORDER_TYPE.cod,),
+                             deferred=False)
+order_state_machine.register(BUY, BUY_RELEASED, decrease_limit, deferred=False)
+order_state_machine.register(SELL, SELL_RELEASED, decrease_limit, deferred=False)
+# Notifications go to the outbox in the same transaction, the outbox worker sends them
+order_state_machine.register(BUY, CREATED, OrderManagement.send_new_order_notification,
+                             order_types=(ORDER_TYPE.cod,), deferred=False)
+order_state_machine.register(BUY, ((ORDER_STATUS.pending, ORDER_STATUS.fiat_transferring),),
+                             OrderManagement.send_new_order_notification, order_types=(ORDER_TYPE.bank,),
+                             deferred=False)
+order_state_machine.register(SELL, CREATED, OrderManagement.send_new_order_notification, deferred=False)
+order_state_machine.register(BUY, ((ORDER_STATUS.processing, ORDER_STATUS.transferring),
+                                   (ORDER_STATUS.transfer_failed, ORDER_STATUS.transferring)),
+                             create_tracking_transaction)
+order_state_machine.register(BUY, ((ORDER_STATUS.transferring, ORDER_STATUS.success),), complete_order)
+order_state_machine.register(BUY, BUY_RELEASED + ((ORDER_STATUS.transferring, ORDER_STATUS.success),),
+                             TrackingManagement.remove_tracking)
+
+order_state_machine.register(SELL, CREATED, TrackingManagement.add_tracking_address_payment)
+order_state_machine.register(SELL, ((ORDER_STATUS.processing, ORDER_STATUS.success),), complete_order)
+order_state_machine.register(SELL, SELL_RELEASED + ((ORDER_STATUS.transferring, ORDER_STATUS.transferred),
+                                                    (ORDER_STATUS.processing, ORDER_STATUS.success)),
+                             TrackingManagement.remove_tracking)
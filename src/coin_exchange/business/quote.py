@@ -1,23 +1,72 @@
 import logging
 from decimal import Decimal
 
+from django.core import signing
+from django.core.cache import cache
 from rest_framework.exceptions import NotAuthenticated, ValidationError
+from rest_framework.fields import BooleanField
 
+from coin_exchange.business.limit_counter import LimitCounterManagement
+from coin_exchange.business.order_counter import OrderCounterManagement, get_day
 from coin_exchange.constants import FEE_COIN_ORDER_COD, FEE_COIN_ORDER_BANK, FEE_COIN_SELLING_ORDER_BANK, ORDER_TYPE, \
-    FEE_COIN_SELLING_ORDER_COD
-from coin_exchange.exceptions import CoinUserOverLimitException, CoinOverLimitException
-from coin_exchange.models import UserLimit, Pool, Order
-from coin_exchange.serializers import QuoteSerializer, QuoteInputSerializer, QuoteReverseInputSerializer, \
-    QuoteReverseSerializer
-from coin_system.business import markup_fee, round_currency, remove_markup_fee, round_crypto_currency
+    FEE_COIN_SELLING_ORDER_COD, QUOTE_TOKEN_SALT, QUOTE_TOKEN_DURATION, CACHE_KEY_QUOTE_RESPONSE, \
+    QUOTE_RESPONSE_CACHE_DURATION
+from coin_exchange.exceptions import CoinUserOverLimitException
+from coin_exchange.models import UserLimit
+from coin_exchange.serializers import QuoteInputSerializer, QuoteReverseInputSerializer, QuoteBatchInputSerializer
+from coin_system.business import round_currency, round_crypto_currency, get_fee_schedule, get_fee_version
 from common.business import PriceManagement, RateManagement, get_now
-from common.constants import FIAT_CURRENCY, DIRECTION, DIRECTION_ALL
+from common.constants import FIAT_CURRENCY, DIRECTION
 from common.exceptions import InvalidDataException
+from common.local_cache import SingleFlight
+
+# Identical quote requests of this worker computed at the same time
+quote_single_flight = SingleFlight()
+
+# Bank and COD fee of each direction
+QUOTE_FEE_KEYS = {
+    DIRECTION.buy: (FEE_COIN_ORDER_BANK, FEE_COIN_ORDER_COD),
+    DIRECTION.sell: (FEE_COIN_SELLING_ORDER_BANK, FEE_COIN_SELLING_ORDER_COD),
+}
+
+# Quote values carried by the quote token, enough to create an order without recalculating
+QUOTE_TOKEN_FIELDS = [
+    'amount', 'currency', 'direction', 'price', 'raw_fiat_amount', 'fiat_local_currency',
+    'fiat_amount', 'fiat_local_amount', 'fee',
+    'fiat_amount_cod', 'fiat_local_amount_cod', 'fee_cod',
+]
+QUOTE_TOKEN_TEXT_FIELDS = {'currency', 'direction', 'fiat_local_currency'}
+
+
+class Quote(object):
+    """
+    Immutable result of a quote, amounts are rounded. Cod and local fee values are None on a reverse quote.
+    """
+    __slots__ = ('amount', 'currency', 'direction', 'price', 'raw_fiat_amount', 'fiat_currency', 'fiat_amount',
+                 'fiat_local_currency', 'fiat_local_amount', 'fee', 'fee_local',
+                 'fiat_amount_cod', 'fiat_local_amount_cod', 'fee_cod', 'fee_local_cod')
+
+    def __init__(self, **kwargs):
+        for field in self.__slots__:
+            object.__setattr__(self, field, kwargs.get(field))
+
+    def __setattr__(self, key, value):
+        raise AttributeError('Quote is immutable')
+
+    def __eq__(self, other):
+        return isinstance(other, Quote) and all(getattr(self, field) == getattr(other, field)
+                                                for field in self.__slots__)
+
+    def __repr__(self):
+        return '<Quote {} {} {} {}>'.format(self.direction, self.amount, self.currency, self.fiat_amount)
+
+    def to_dict(self, fields: list = None) -> dict:
+        return {field: getattr(self, field) for field in (fields or self.__slots__)}
 
 
 class QuoteManagement(object):
     @staticmethod
-    def get_quote(user, params) -> QuoteSerializer:
+    def get_quote(user, params) -> Quote:
         input_serializer = QuoteInputSerializer(data={
             'amount': params.get('amount'),
             'currency': params.get('currency'),
@@ -34,69 +83,94 @@ class QuoteManagement(object):
             currency = safe_data['currency']
             amount = safe_data['amount']
             price = QuoteManagement.get_price(direction, safe_data)
+            fees = get_fee_schedule()
 
             raw_fiat_amount = amount * price
             fiat_local_currency = safe_data['fiat_currency']
 
             if safe_data['user_check']:
-                # request.user
-                # User logged in
-                if user and user.is_authenticated:
-                    if fiat_local_currency != user.exchange_user.currency:
-                        raw_fiat_local_amount = RateManagement.convert_currency(raw_fiat_amount,
-                                                                                fiat_local_currency,
-                                                                                user.exchange_user.currency)
-                    else:
-                        raw_fiat_local_amount = RateManagement.convert_to_local_currency(raw_fiat_amount,
-                                                                                         fiat_local_currency)
-
-                    QuoteManagement.check_user_limit(user, raw_fiat_local_amount, user.exchange_user.currency)
-                else:
-                    raise NotAuthenticated
+                QuoteManagement.check_quote_user_limit(user, raw_fiat_amount, fiat_local_currency)
 
             if safe_data['pool_check']:
                 QuoteManagement.check_pool(direction, amount, currency)
 
             if direction == DIRECTION.buy:
-                fiat_amount, fiat_amount_fee = markup_fee(raw_fiat_amount, FEE_COIN_ORDER_BANK)
+                fiat_amount, fiat_amount_fee = fees.markup(raw_fiat_amount, FEE_COIN_ORDER_BANK)
             else:
-                fiat_amount, fiat_amount_fee = markup_fee(raw_fiat_amount, FEE_COIN_SELLING_ORDER_BANK)
+                fiat_amount, fiat_amount_fee = fees.markup(raw_fiat_amount, FEE_COIN_SELLING_ORDER_BANK)
 
             fiat_local_amount = RateManagement.convert_to_local_currency(fiat_amount, fiat_local_currency)
             fee_local = RateManagement.convert_to_local_currency(fiat_amount_fee, fiat_local_currency)
 
             if direction == DIRECTION.buy:
-                fiat_amount_cod, fiat_amount_fee_cod = markup_fee(raw_fiat_amount, FEE_COIN_ORDER_COD)
+                fiat_amount_cod, fiat_amount_fee_cod = fees.markup(raw_fiat_amount, FEE_COIN_ORDER_COD)
                 fiat_local_amount_cod = RateManagement.convert_to_local_currency(fiat_amount_cod, fiat_local_currency)
                 fee_local_cod = RateManagement.convert_to_local_currency(fiat_amount_fee_cod, fiat_local_currency)
             else:
-                fiat_amount_cod, fiat_amount_fee_cod = markup_fee(raw_fiat_amount, FEE_COIN_SELLING_ORDER_COD)
+                fiat_amount_cod, fiat_amount_fee_cod = fees.markup(raw_fiat_amount, FEE_COIN_SELLING_ORDER_COD)
                 fiat_local_amount_cod = RateManagement.convert_to_local_currency(fiat_amount_cod, fiat_local_currency)
                 fee_local_cod = RateManagement.convert_to_local_currency(fiat_amount_fee_cod, fiat_local_currency)
 
-            serializer = QuoteSerializer(data={
-                'fiat_amount': round_currency(fiat_amount),
+            return Quote(
+                fiat_amount=round_currency(fiat_amount),
+                fiat_currency=FIAT_CURRENCY.USD,
+                fiat_local_amount=round_currency(fiat_local_amount),
+                fiat_local_currency=fiat_local_currency,
+                fiat_amount_cod=round_currency(fiat_amount_cod),
+                fiat_local_amount_cod=round_currency(fiat_local_amount_cod),
+                fee=round_currency(fiat_amount_fee),
+                fee_cod=round_currency(fiat_amount_fee_cod),
+                fee_local=round_currency(fee_local),
+                fee_local_cod=round_currency(fee_local_cod),
+                raw_fiat_amount=round_currency(raw_fiat_amount),
+                price=round_currency(price),
+                amount=round_crypto_currency(amount),
+                currency=safe_data['currency'],
+                direction=safe_data['direction'],
+            )
+
+    @staticmethod
+    def get_quotes(params) -> list:
+        input_serializer = QuoteBatchInputSerializer(data=params)
+        input_serializer.is_valid(raise_exception=True)
+        items = input_serializer.validated_data['quotes']
+
+        # Load every price, rate and fee once for the whole batch
+        prices = {currency: PriceManagement.get_cache_price(currency)
+                  for currency in {item['currency'] for item in items}}
+        rates = {fiat_currency: RateManagement.get_cache_rate(fiat_currency)
+                 for fiat_currency in {item['fiat_currency'] for item in items}}
+        fees = get_fee_schedule()
+
+        quotes = []
+        for item in items:
+            direction = item['direction']
+            amount = item['amount']
+            fiat_local_currency = item['fiat_currency']
+            price = prices[item['currency']].get_price(direction, amount=amount)
+            rate = rates[fiat_local_currency]
+            bank_fee_key, cod_fee_key = QUOTE_FEE_KEYS[direction]
+
+            raw_fiat_amount = amount * price
+            fiat_amount, _ = fees.markup(raw_fiat_amount, bank_fee_key)
+            fiat_amount_cod, _ = fees.markup(raw_fiat_amount, cod_fee_key)
+
+            quotes.append({
+                'amount': round_crypto_currency(amount),
+                'currency': item['currency'],
                 'fiat_currency': FIAT_CURRENCY.USD,
-                'fiat_local_amount': round_currency(fiat_local_amount),
+                'direction': direction,
                 'fiat_local_currency': fiat_local_currency,
+                'fiat_amount': round_currency(fiat_amount),
+                'fiat_local_amount': round_currency(fiat_amount * rate),
                 'fiat_amount_cod': round_currency(fiat_amount_cod),
-                'fiat_local_amount_cod': round_currency(fiat_local_amount_cod),
-                'fee': round_currency(fiat_amount_fee),
-                'fee_cod': round_currency(fiat_amount_fee_cod),
-                'fee_local': round_currency(fee_local),
-                'fee_local_cod': round_currency(fee_local_cod),
-                'raw_fiat_amount': round_currency(raw_fiat_amount),
-                'price': round_currency(price),
-                'amount': round_crypto_currency(amount),
-                'currency': safe_data['currency'],
-                'direction': safe_data['direction']
+                'fiat_local_amount_cod': round_currency(fiat_amount_cod * rate),
             })
-            serializer.is_valid(raise_exception=True)
 
-            return serializer
+        return quotes
 
     @staticmethod
-    def get_quote_reverse(user, params) -> QuoteReverseSerializer:
+    def get_quote_reverse(user, params) -> Quote:
         input_serializer = QuoteReverseInputSerializer(data={
             'fiat_amount': params.get('fiat_amount'),
             'currency': params.get('currency'),
@@ -119,72 +193,114 @@ class QuoteManagement(object):
             fiat_local_amount = safe_data['fiat_amount']
             fiat_local_currency = safe_data['fiat_currency']
             fiat_amount = RateManagement.convert_from_local_currency(fiat_local_amount, fiat_local_currency)
+            fees = get_fee_schedule()
 
             if direction == DIRECTION.buy:
                 if order_type == ORDER_TYPE.bank:
-                    raw_fiat_amount, fiat_amount_fee = remove_markup_fee(fiat_amount, FEE_COIN_ORDER_BANK)
+                    raw_fiat_amount, fiat_amount_fee = fees.remove_markup(fiat_amount, FEE_COIN_ORDER_BANK)
                 else:
-                    raw_fiat_amount, fiat_amount_fee = remove_markup_fee(fiat_amount, FEE_COIN_ORDER_COD)
+                    raw_fiat_amount, fiat_amount_fee = fees.remove_markup(fiat_amount, FEE_COIN_ORDER_COD)
             else:
                 if order_type == ORDER_TYPE.bank:
-                    raw_fiat_amount, fiat_amount_fee = remove_markup_fee(fiat_amount, FEE_COIN_SELLING_ORDER_BANK)
+                    raw_fiat_amount, fiat_amount_fee = fees.remove_markup(fiat_amount, FEE_COIN_SELLING_ORDER_BANK)
                 else:
-                    raw_fiat_amount, fiat_amount_fee = remove_markup_fee(fiat_amount, FEE_COIN_SELLING_ORDER_COD)
+                    raw_fiat_amount, fiat_amount_fee = fees.remove_markup(fiat_amount, FEE_COIN_SELLING_ORDER_COD)
 
-            price = QuoteManagement.get_price(direction, safe_data)
+            price = QuoteManagement.get_price(direction, safe_data, raw_fiat_amount)
             amount = raw_fiat_amount / price
 
             if safe_data['user_check']:
-                # request.user
-                # User logged in
-                if user and user.is_authenticated:
-                    if fiat_local_currency != user.exchange_user.currency:
-                        raw_fiat_local_amount = RateManagement.convert_currency(raw_fiat_amount,
-                                                                                fiat_local_currency,
-                                                                                user.exchange_user.currency)
-                    else:
-                        raw_fiat_local_amount = RateManagement.convert_to_local_currency(raw_fiat_amount,
-                                                                                         fiat_local_currency)
-
-                    QuoteManagement.check_user_limit(user, raw_fiat_local_amount, user.exchange_user.currency)
-                else:
-                    raise NotAuthenticated
+                QuoteManagement.check_quote_user_limit(user, raw_fiat_amount, fiat_local_currency)
 
             if safe_data['pool_check']:
                 QuoteManagement.check_pool(direction, amount, currency)
 
             fiat_local_amount = RateManagement.convert_to_local_currency(fiat_amount, fiat_local_currency)
 
-            serializer = QuoteReverseSerializer(data={
-                'fiat_amount': round_currency(fiat_amount),
-                'fiat_currency': FIAT_CURRENCY.USD,
-                'fiat_local_amount': round_currency(fiat_local_amount),
-                'fiat_local_currency': fiat_local_currency,
-                'raw_fiat_amount': round_currency(raw_fiat_amount),
-                'price': round_currency(price),
-                'amount': round_crypto_currency(amount),
-                'currency': safe_data['currency'],
-                'direction': safe_data['direction']
-            })
-            serializer.is_valid(raise_exception=True)
+            return Quote(
+                fiat_amount=round_currency(fiat_amount),
+                fiat_currency=FIAT_CURRENCY.USD,
+                fiat_local_amount=round_currency(fiat_local_amount),
+                fiat_local_currency=fiat_local_currency,
+                raw_fiat_amount=round_currency(raw_fiat_amount),
+                price=round_currency(price),
+                amount=round_crypto_currency(amount),
+                currency=safe_data['currency'],
+                direction=safe_data['direction'],
+            )
 
-            return serializer
+    @staticmethod
+    def get_cached_response(name: str, fields: list, params, loader):
+        # Limit and pool checks depend on the user and the pool usage, their response is never shared
+        for check in ('check', 'user_check'):
+            if params.get(check) is not None and params.get(check) not in BooleanField.FALSE_VALUES:
+                return loader()
+
+        # Any price, rate or fee change makes a new key
+        key = CACHE_KEY_QUOTE_RESPONSE.format(
+            name, PriceManagement.get_price_version(), get_fee_version(),
+            '|'.join(str(params.get(field, '')) for field in fields),
+        )
+
+        def load():
+            data = cache.get(key)
+            if data is None:
+                data = loader()
+                cache.set(key, data, timeout=QUOTE_RESPONSE_CACHE_DURATION)
+            return data
+
+        return quote_single_flight.do(key, load)
 
     @staticmethod
-    def get_price(direction, safe_data):
+    def get_price(direction, safe_data, raw_fiat_amount: Decimal = None):
+        # Priced by the order book depth, by amount or by fiat amount for the reverse quote
         price_obj = PriceManagement.get_cache_price(safe_data['currency'])
-        if direction == DIRECTION.buy:
-            price = price_obj.buy
-        else:
-            price = price_obj.sell
-        return price
+        return price_obj.get_price(direction, amount=safe_data.get('amount'), cost=raw_fiat_amount)
 
     @staticmethod
     def check_pool(direction, amount, currency):
-        pool = Pool.objects.get(direction=direction,
-                                currency=currency)
-        if pool.usage + amount > pool.limit:
-            raise CoinOverLimitException
+        LimitCounterManagement.check_pool(direction, amount, currency)
+
+    @staticmethod
+    def check_quote_user_limit(user, raw_fiat_amount, fiat_local_currency):
+        # request.user
+        # User logged in
+        if user and user.is_authenticated:
+            if fiat_local_currency != user.exchange_user.currency:
+                raw_fiat_local_amount = RateManagement.convert_currency(raw_fiat_amount,
+                                                                        fiat_local_currency,
+                                                                        user.exchange_user.currency)
+            else:
+                raw_fiat_local_amount = RateManagement.convert_to_local_currency(raw_fiat_amount,
+                                                                                 fiat_local_currency)
+
+            QuoteManagement.check_user_limit(user, raw_fiat_local_amount, user.exchange_user.currency)
+        else:
+            raise NotAuthenticated
+
+    @staticmethod
+    def sign_quote(quote: Quote, price_version, fee_version) -> str:
+        data = {key: str(getattr(quote, key)) for key in QUOTE_TOKEN_FIELDS}
+        data['version'] = price_version
+        data['fee_version'] = fee_version
+        return signing.dumps(data, salt=QUOTE_TOKEN_SALT, compress=True)
+
+    @staticmethod
+    def load_quote(token: str, amount: Decimal, currency: str, direction: str, fiat_local_currency: str):
+        # Return the signed quote if it is still usable for this order, otherwise None
+        try:
+            data = signing.loads(token, salt=QUOTE_TOKEN_SALT, max_age=QUOTE_TOKEN_DURATION)
+        except signing.BadSignature:
+            return None
+
+        if data.get('version') != PriceManagement.get_price_version() or data.get('fee_version') != get_fee_version():
+            return None
+        if Decimal(data['amount']) != round_crypto_currency(amount) or data['currency'] != currency or \
+                data['direction'] != direction or data['fiat_local_currency'] != fiat_local_currency:
+            return None
+
+        return Quote(**{key: data[key] if key in QUOTE_TOKEN_TEXT_FIELDS else Decimal(data[key])
+                        for key in QUOTE_TOKEN_FIELDS})
 
     @staticmethod
     def check_user_limit(user, local_price, fiat_currency):
@@ -194,11 +310,8 @@ class QuoteManagement(object):
             check_amount = local_price
             if exchange_user.currency != fiat_currency:
                 check_amount = RateManagement.convert_currency(local_price, exchange_user.currency, fiat_currency)
-            user_limit = UserLimit.objects.get(user=exchange_user, direction=DIRECTION_ALL,
-                                               fiat_currency=exchange_user.currency)
-            if user_limit.usage + check_amount > user_limit.limit:
-                raise CoinUserOverLimitException
-        except UserLimit.DoesNotExist as e:
+            LimitCounterManagement.check_user_limit(exchange_user, check_amount)
+        except (UserLimit.DoesNotExist, InvalidDataException) as e:
             logging.exception(e)
             raise InvalidDataException
 
@@ -222,13 +335,7 @@ class QuoteManagement(object):
                 check_amount = RateManagement.convert_currency(local_amount, exchange_user.currency, fiat_currency)
                 if not (data['min'] <= check_amount <= data['max']):
                     raise CoinUserOverLimitException
-            now = get_now()
-            order = Order.objects.filter(direction=DIRECTION.buy,
-                                         order_type=ORDER_TYPE.cod,
-                                         created_at__day=now.day,
-                                         created_at__month=now.month,
-                                         created_at__year=now.year, ).first()
-            if order:
+            if OrderCounterManagement.get_count(get_day(get_now()), DIRECTION.buy, ORDER_TYPE.cod):
                 raise CoinUserOverLimitException
         else:
             raise InvalidDataException
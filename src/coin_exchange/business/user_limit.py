@@ -1,17 +1,21 @@
+from coin_exchange.business.limit_counter import LimitCounterManagement, load_buckets, dump_buckets, \
+    get_window_start
 from coin_exchange.constants import CONFIG_USER_LIMIT
 from coin_exchange.models import UserLimit
 from coin_system.business import get_config
 from coin_user.models import ExchangeUser
-from common.business import get_now, RateManagement
+from common.business import RateManagement
 
 
 def reset_user_limit():
-    UserLimit.objects.all().update(usage=0, updated_at=get_now())
+    LimitCounterManagement.reset_user_usage()
 
 
 def update_limit_by_level(user: ExchangeUser):
     config = get_config(CONFIG_USER_LIMIT.format(user.currency, user.verification_level))
     UserLimit.objects.filter(user=user, fiat_currency=user.currency).update(limit=config.value)
+    for user_limit in UserLimit.objects.filter(user=user, fiat_currency=user.currency):
+        LimitCounterManagement.set_user_limit(user_limit)
 
 
 def update_currency(user: ExchangeUser, currency: str):
@@ -19,8 +23,14 @@ def update_currency(user: ExchangeUser, currency: str):
     user_limit = UserLimit.objects.filter(user=user).first()
     if user_limit:
         if user_limit.fiat_currency != currency:
+            # Write the counter back first, it is loaded again in the new currency
+            LimitCounterManagement.drop_user_counter(user.pk)
+            user_limit.refresh_from_db()
+
             old_currency = user_limit.fiat_currency
             user_limit.fiat_currency = currency
-            user_limit.usage = RateManagement.convert_currency(user_limit.usage, old_currency, currency)
+            buckets = {bucket: RateManagement.convert_currency(amount, old_currency, currency)
+                       for bucket, amount in load_buckets(user_limit).items()}
+            dump_buckets(user_limit, buckets, get_window_start())
             user_limit.limit = RateManagement.convert_currency(user_limit.limit, old_currency, currency)
             user_limit.save()
@@ -2,6 +2,8 @@ from decimal import Decimal
 
 from model_utils import Choices
 
+from common.constants import CURRENCY
+
 
 ORDER_STATUS = Choices(
     ('pending', 'Pending'),
@@ -99,8 +101,61 @@ CONFIG_USER_LIMIT = "{}_USER_LIMIT_{}"
 MIN_ETH_AMOUNT = Decimal('0.1')
 MIN_BTC_AMOUNT = Decimal('0.01')
 
+QUOTE_BATCH_MAX_SIZE = 50
+QUOTE_TOKEN_DURATION = 60
+QUOTE_TOKEN_SALT = 'coin_exchange.quote'
+QUOTE_RESPONSE_CACHE_DURATION = 10  # in second
+
 ORDER_EXPIRATION_DURATION = 60 * 15
 DIFFERENT_THRESHOLD = Decimal('1')  # 1%
 REF_CODE_LENGTH = 6
 
 CACHE_KEY_TOKEN = 'crypto_tokens'
+CACHE_KEY_QUOTE_RESPONSE = 'quote_response.{}.{}.{}.{}'
+
+# Raw Redis keys of the limit counters, amounts are kept as integers
+LIMIT_COUNTER_KEY_POOL = 'limit_counter.pool.{}.{}'
+LIMIT_COUNTER_KEY_USER = 'limit_counter.user.{}'
+LIMIT_COUNTER_KEY_DIRTY = 'limit_counter.dirty'
+LIMIT_COUNTER_FIAT_SCALE = 10 ** 2
+LIMIT_COUNTER_CRYPTO_SCALE = 10 ** 8
+LIMIT_COUNTER_FLUSH_BATCH = 500
+
+# User limit usage is counted over a rolling window of hourly buckets
+USER_LIMIT_WINDOW = 24 * 60 * 60  # in second
+USER_LIMIT_BUCKET = 60 * 60  # in second
+CONFIG_USER_LIMIT_RESET_AT = 'USER_LIMIT_RESET_AT'
+
+# Tracking sweeps run in the process with a bounded pool
+TRACKING_MAX_WORKERS = 16
+TRACKING_ITEM_TIMEOUT = 30  # in second
+
+# Delay before the next check of a tracked item, doubled by each check without news and at least a part of the
+# age of the item
+TRACKING_CHECK_BASE_DELAY = 60  # in second
+TRACKING_CHECK_MAX_DELAY = 6 * 60 * 60  # in second
+TRACKING_CHECK_AGE_RATIO = Decimal('0.1')
+# Average time between 2 blocks, a pending transaction waits for its missing confirmations
+TRACKING_BLOCK_TIME = {
+    CURRENCY.BTC: 10 * 60,
+    CURRENCY.ETH: 15,
+}  # in second
+
+# Blocks scanned per run and chain, the next run goes on from the saved height.
+# A BTC block holds thousands of transactions read over many pages.
+BLOCK_SCAN_MAX_BLOCKS = {
+    CURRENCY.BTC: 3,
+    CURRENCY.ETH: 100,
+}
+# Blocks on top of a block before it is scanned, a reorg can replace a more recent one
+BLOCK_SCAN_CONFIRMATIONS = {
+    CURRENCY.BTC: 2,
+    CURRENCY.ETH: 12,
+}
+
+# Token Transfer logs are read for all the active tokens at once, over block ranges
+TOKEN_LOG_BLOCK_RANGE = 1000
+TOKEN_LOG_MAX_BLOCKS = 10000
+TOKEN_LOG_RECIPIENT_BATCH = 100
+# Blocks on top of a Transfer before it is credited, a reorg can drop a more recent one
+TOKEN_CONFIRMATIONS = 12
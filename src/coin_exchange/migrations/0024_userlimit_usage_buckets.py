@@ -0,0 +1,18 @@
+# Generated by Django 2.1.4 on 2026-10-18 07:30
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('coin_exchange', '0023_cryptotoken'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='userlimit',
+            name='usage_buckets',
+            field=models.TextField(blank=True, default='{}'),
+        ),
+    ]
@@ -0,0 +1,34 @@
+# Generated by Django 2.1.4 on 2026-10-18 09:12
+
+import common.model_fields
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('coin_exchange', '0024_userlimit_usage_buckets'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='OrderCounter',
+            fields=[
+                ('id', models.AutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('created_at', models.DateTimeField(auto_now_add=True)),
+                ('updated_at', models.DateTimeField(auto_now=True)),
+                ('day', models.DateField()),
+                ('direction', common.model_fields.DirectionField(choices=[('buy', 'Buy'), ('sell', 'Sell')], max_length=5)),
+                ('order_type', models.CharField(choices=[('bank', 'Bank'), ('cod', 'COD')], max_length=20)),
+                ('count', models.PositiveIntegerField(default=0)),
+            ],
+        ),
+        migrations.AddIndex(
+            model_name='order',
+            index=models.Index(fields=['created_at'], name='coin_exchan_created_b9696d_idx'),
+        ),
+        migrations.AlterUniqueTogether(
+            name='ordercounter',
+            unique_together={('day', 'direction', 'order_type')},
+        ),
+    ]
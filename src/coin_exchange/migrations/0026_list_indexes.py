@@ -0,0 +1,29 @@
+# Generated by Django 2.1.4 on 2026-10-18 09:40
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('coin_exchange', '0025_ordercounter'),
+    ]
+
+    operations = [
+        migrations.AddIndex(
+            model_name='order',
+            index=models.Index(fields=['user', 'created_at', 'id'], name='coin_exchan_user_id_64d3b1_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='promotionorder',
+            index=models.Index(fields=['created_at', 'id'], name='coin_exchan_created_c2457f_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='referralorder',
+            index=models.Index(fields=['created_at', 'id'], name='coin_exchan_created_3b4f85_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='review',
+            index=models.Index(fields=['visible', 'created_at', 'id'], name='coin_exchan_visible_838407_idx'),
+        ),
+    ]
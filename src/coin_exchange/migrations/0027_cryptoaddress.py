@@ -0,0 +1,51 @@
+# Generated by Django 2.1.4 on 2026-10-18 10:05
+
+import common.model_fields
+from django.db import migrations, models
+import django.db.models.deletion
+
+
+def fill_crypto_addresses(apps, schema_editor):
+    Order = apps.get_model('coin_exchange', 'Order')
+    TrackingAddress = apps.get_model('coin_exchange', 'TrackingAddress')
+    SellingPayment = apps.get_model('coin_exchange', 'SellingPayment')
+    CryptoAddress = apps.get_model('coin_exchange', 'CryptoAddress')
+
+    # The latest row wins when an address was used more than once
+    addresses = {}
+    for pk, address in Order.objects.filter(direction='sell').order_by('id').values_list('id', 'address'):
+        addresses.setdefault(address.lower(), {})['sell_order_id'] = pk
+    for pk, address in TrackingAddress.objects.order_by('id').values_list('id', 'address'):
+        addresses.setdefault(address.lower(), {})['tracking_address_id'] = pk
+    for pk, address in SellingPayment.objects.order_by('id').values_list('id', 'address'):
+        addresses.setdefault(address.lower(), {})['selling_payment_id'] = pk
+
+    CryptoAddress.objects.bulk_create([CryptoAddress(address=address, **links)
+                                       for address, links in addresses.items()], batch_size=1000)
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('coin_exchange', '0026_list_indexes'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='CryptoAddress',
+            fields=[
+                ('id', models.AutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('created_at', models.DateTimeField(auto_now_add=True)),
+                ('updated_at', models.DateTimeField(auto_now=True)),
+                ('address', common.model_fields.CryptoHashField(max_length=255, unique=True)),
+                ('sell_order', models.ForeignKey(blank=True, null=True, on_delete=django.db.models.deletion.SET_NULL, related_name='sell_order_addresses', to='coin_exchange.Order')),
+                ('selling_payment', models.ForeignKey(blank=True, null=True, on_delete=django.db.models.deletion.SET_NULL, related_name='payment_crypto_addresses', to='coin_exchange.SellingPayment')),
+                ('tracking_address', models.ForeignKey(blank=True, null=True, on_delete=django.db.models.deletion.SET_NULL, related_name='tracking_crypto_addresses', to='coin_exchange.TrackingAddress')),
+            ],
+            options={
+                'verbose_name': 'Crypto Address',
+                'verbose_name_plural': 'Crypto Addresses',
+            },
+        ),
+        migrations.RunPython(fill_crypto_addresses, migrations.RunPython.noop),
+    ]
@@ -0,0 +1,28 @@
+# Generated by Django 2.1.4 on 2026-10-18 11:35
+
+import common.model_fields
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('coin_exchange', '0027_cryptoaddress'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='BlockScanState',
+            fields=[
+                ('id', models.AutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('created_at', models.DateTimeField(auto_now_add=True)),
+                ('updated_at', models.DateTimeField(auto_now=True)),
+                ('currency', common.model_fields.CurrencyField(choices=[('USDT', 'USDT'), ('ETH', 'ETH'), ('BTC', 'BTC')], max_length=5, unique=True)),
+                ('height', models.BigIntegerField()),
+            ],
+            options={
+                'verbose_name': 'Block Scan State',
+                'verbose_name_plural': 'Block Scan States',
+            },
+        ),
+    ]
@@ -0,0 +1,18 @@
+# Generated by Django 2.1.4 on 2026-10-18 12:10
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('coin_exchange', '0028_blockscanstate'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='cryptotoken',
+            name='scanned_block',
+            field=models.BigIntegerField(blank=True, null=True),
+        ),
+    ]
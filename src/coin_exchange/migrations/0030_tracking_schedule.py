@@ -0,0 +1,34 @@
+# Generated by Django 2.1.4 on 2026-10-18 13:20
+
+from django.db import migrations, models
+import django.utils.timezone
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('coin_exchange', '0029_cryptotoken_scanned_block'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='trackingaddress',
+            name='attempts',
+            field=models.PositiveIntegerField(default=0),
+        ),
+        migrations.AddField(
+            model_name='trackingaddress',
+            name='next_check_at',
+            field=models.DateTimeField(db_index=True, default=django.utils.timezone.now),
+        ),
+        migrations.AddField(
+            model_name='trackingtransaction',
+            name='attempts',
+            field=models.PositiveIntegerField(default=0),
+        ),
+        migrations.AddField(
+            model_name='trackingtransaction',
+            name='next_check_at',
+            field=models.DateTimeField(blank=True, db_index=True, default=django.utils.timezone.now, null=True),
+        ),
+    ]
@@ -0,0 +1,21 @@
+# Generated by Django 2.1.4 on 2026-10-18 14:10
+
+from django.db import migrations
+
+
+def seed_user_limit_reset_at(apps, schema_editor):
+    Config = apps.get_model('coin_system', 'Config')
+    # No reset yet, the usage is counted over the whole window
+    Config.objects.get_or_create(key='USER_LIMIT_RESET_AT', defaults={'value': '0', 'value_type': 'int'})
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('coin_exchange', '0030_tracking_schedule'),
+        ('coin_system', '0014_auto_20181211_1001'),
+    ]
+
+    operations = [
+        migrations.RunPython(seed_user_limit_reset_at, migrations.RunPython.noop),
+    ]
@@ -1,4 +1,5 @@
 from django.db import models
+from django.utils import timezone
 
 from coin_base.models import TimestampedModel
 from coin_exchange.constants import ORDER_STATUS, ORDER_TYPE, PAYMENT_STATUS, TRACKING_ADDRESS_STATUS, \
@@ -13,6 +14,10 @@ class Order(TimestampedModel):
     class Meta:
         verbose_name = 'Exch Buying Order'
         verbose_name_plural = 'Exch Buying Orders'
+        indexes = [
+            models.Index(fields=['created_at']),
+            models.Index(fields=['user', 'created_at', 'id']),
+        ]
 
     user = models.ForeignKey(ExchangeUser, related_name='user_orders', on_delete=models.PROTECT)
     user_info = models.TextField(null=True)
@@ -38,6 +43,16 @@ class Order(TimestampedModel):
     reviewed = models.BooleanField(default=False)
     first_purchase = models.BooleanField(default=False)
 
+    # Status in the DB, a saved status change is checked and handled from it
+    loaded_status = None
+
+    @classmethod
+    def from_db(cls, db, field_names, values):
+        instance = super(Order, cls).from_db(db, field_names, values)
+        if 'status' in field_names:
+            instance.loaded_status = instance.status
+        return instance
+
     def __str__(self):
         return 'Order #{} for {}ing {:.6f} {}'.format(self.id, self.direction, self.amount, self.currency)
 
@@ -92,6 +107,40 @@ class TrackingAddress(TimestampedModel):
     address = model_fields.CryptoHashField()
     currency = model_fields.CurrencyField()
     status = models.CharField(max_length=20, choices=TRACKING_ADDRESS_STATUS, default=TRACKING_ADDRESS_STATUS.created)
+    # Checked by the sweeps once due, checks without news push it back
+    next_check_at = models.DateTimeField(default=timezone.now, db_index=True)
+    attempts = models.PositiveIntegerField(default=0)
+
+
+class CryptoAddress(TimestampedModel):
+    class Meta:
+        verbose_name = 'Crypto Address'
+        verbose_name_plural = 'Crypto Addresses'
+
+    # Lowercase, so every lookup is an exact match on the unique index
+    address = model_fields.CryptoHashField(unique=True)
+    sell_order = models.ForeignKey(Order, related_name='sell_order_addresses', on_delete=models.SET_NULL,
+                                   null=True, blank=True)
+    tracking_address = models.ForeignKey(TrackingAddress, related_name='tracking_crypto_addresses',
+                                         on_delete=models.SET_NULL, null=True, blank=True)
+    selling_payment = models.ForeignKey(SellingPayment, related_name='payment_crypto_addresses',
+                                        on_delete=models.SET_NULL, null=True, blank=True)
+
+    def __str__(self):
+        return '%s' % self.address
+
+
+class BlockScanState(TimestampedModel):
+    class Meta:
+        verbose_name = 'Block Scan State'
+        verbose_name_plural = 'Block Scan States'
+
+    currency = model_fields.CurrencyField(unique=True)
+    # Last block scanned for deposits
+    height = models.BigIntegerField()
+
+    def __str__(self):
+        return '%s - %s' % (self.currency, self.height)
 
 
 class TrackingTransaction(TimestampedModel):
@@ -109,12 +158,18 @@ class TrackingTransaction(TimestampedModel):
     tracking_address = models.ForeignKey(TrackingAddress, related_name='address_transactions', null=True, blank=True,
                                          on_delete=models.CASCADE)
     to_address = model_fields.CryptoHashField(blank=True)
+    # Not checked anymore once final
+    next_check_at = models.DateTimeField(default=timezone.now, null=True, blank=True, db_index=True)
+    attempts = models.PositiveIntegerField(default=0)
 
 
 class Review(TimestampedModel):
     class Meta:
         verbose_name = 'Review'
         verbose_name_plural = 'Reviews'
+        indexes = [
+            models.Index(fields=['visible', 'created_at', 'id']),
+        ]
 
     user = models.ForeignKey(ExchangeUser, related_name='user_reviews', on_delete=models.SET_NULL,
                              null=True, blank=True)
@@ -148,6 +203,19 @@ class Pool(TimestampedModel):
         return '%s - %s' % (DIRECTION[self.direction], self.currency)
 
 
+class OrderCounter(TimestampedModel):
+    class Meta:
+        unique_together = ('day', 'direction', 'order_type')
+
+    day = models.DateField()
+    direction = model_fields.DirectionField()
+    order_type = models.CharField(max_length=20, choices=ORDER_TYPE)
+    count = models.PositiveIntegerField(default=0)
+
+    def __str__(self):
+        return '%s - %s - %s' % (self.day, DIRECTION[self.direction], ORDER_TYPE[self.order_type])
+
+
 class UserLimit(TimestampedModel):
     class Meta:
         unique_together = ('user', 'direction')
@@ -156,6 +224,8 @@ class UserLimit(TimestampedModel):
     direction = model_fields.DirectionField()
     limit = model_fields.FiatAmountField()
     usage = model_fields.FiatAmountField()
+    # Usage per hour bucket of the rolling window, in JSON
+    usage_buckets = models.TextField(default='{}', blank=True)
     fiat_currency = model_fields.FiatCurrencyField()
 
     def __str__(self):
@@ -166,6 +236,9 @@ class ReferralOrder(TimestampedModel):
     class Meta:
         verbose_name = 'Referral Transaction'
         verbose_name_plural = 'Referral Transactions'
+        indexes = [
+            models.Index(fields=['created_at', 'id']),
+        ]
 
     order = models.ForeignKey(Order, related_name='order_referrals', on_delete=models.PROTECT)
     user = models.ForeignKey(ExchangeUser, related_name='user_order_referrals', null=True, on_delete=models.PROTECT)
@@ -221,6 +294,9 @@ class PromotionOrder(TimestampedModel):
     class Meta:
         verbose_name = 'Promotion Transaction'
         verbose_name_plural = 'Promotion Transactions'
+        indexes = [
+            models.Index(fields=['created_at', 'id']),
+        ]
 
     order = models.ForeignKey(Order, related_name='order_promotions', on_delete=models.PROTECT)
     user = models.ForeignKey(ExchangeUser, related_name='user_order_promotions', null=True, on_delete=models.PROTECT)
@@ -287,3 +363,5 @@ class CryptoToken(models.Model):
     buy_price = model_fields.FiatAmountField(null=True, blank=True)
     sell_price = model_fields.FiatAmountField(null=True, blank=True)
     active = models.BooleanField(default=True)
+    # Last block scanned for Transfer logs
+    scanned_block = models.BigIntegerField(null=True, blank=True)
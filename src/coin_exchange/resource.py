@@ -15,7 +15,7 @@ from coin_exchange.models import Review, Order, ReferralOrder, PromotionOrder
 from coin_exchange.serializers import ReviewSerializer, OrderSerializer, SellingOrderSerializer, \
     ReferralOrderSerializer, PromotionOrderSerializer
 from common.constants import DIRECTION
-from common.http import StandardPagination
+from common.http import StandardCursorPagination
 
 
 class ReviewViewSet(mixins.CreateModelMixin,
@@ -24,8 +24,8 @@ class ReviewViewSet(mixins.CreateModelMixin,
     authentication_classes = (JWTAuthentication, TokenAuthentication)
     permission_classes = (IsAuthenticatedOrReadOnly,)
     serializer_class = ReviewSerializer
-    pagination_class = StandardPagination
-    queryset = Review.objects.filter(visible=True).order_by('-created_at')
+    pagination_class = StandardCursorPagination
+    queryset = Review.objects.filter(visible=True).order_by('-created_at', '-id')
 
     filterset_fields = (
         'country',
@@ -56,7 +56,7 @@ class OrderViewSet(mixins.CreateModelMixin,
     authentication_classes = (JWTAuthentication, TokenAuthentication)
     permission_classes = (IsAuthenticated,)
     serializer_class = OrderSerializer
-    pagination_class = StandardPagination
+    pagination_class = StandardCursorPagination
     queryset = Order.objects.none()
 
     filterset_fields = (
@@ -102,7 +102,7 @@ class OrderViewSet(mixins.CreateModelMixin,
         return Response(status=status.HTTP_200_OK)
 
     def get_queryset(self):
-        qs = Order.objects.filter(user__user=self.request.user).order_by('-created_at')
+        qs = Order.objects.filter(user__user=self.request.user).order_by('-created_at', '-id')
 
         return qs
 
@@ -110,8 +110,8 @@ class OrderViewSet(mixins.CreateModelMixin,
 class ReferralOrderViewSet(viewsets.ReadOnlyModelViewSet):
     permission_classes = (IsAuthenticatedOrReadOnly,)
     serializer_class = ReferralOrderSerializer
-    pagination_class = StandardPagination
-    queryset = ReferralOrder.objects.all().order_by('-created_at')
+    pagination_class = StandardCursorPagination
+    queryset = ReferralOrder.objects.all().order_by('-created_at', '-id')
 
     # @method_decorator(cache_page(5 * 60))
     def dispatch(self, *args, **kwargs):
@@ -121,8 +121,8 @@ class ReferralOrderViewSet(viewsets.ReadOnlyModelViewSet):
 class PromotionOrderViewSet(viewsets.ReadOnlyModelViewSet):
     permission_classes = (IsAuthenticatedOrReadOnly,)
     serializer_class = PromotionOrderSerializer
-    pagination_class = StandardPagination
-    queryset = PromotionOrder.objects.all().order_by('-created_at')
+    pagination_class = StandardCursorPagination
+    queryset = PromotionOrder.objects.all().order_by('-created_at', '-id')
 
     # @method_decorator(cache_page(5 * 60))
     def dispatch(self, *args, **kwargs):
@@ -1,7 +1,9 @@
 from rest_framework import serializers
 
+from coin_exchange.constants import QUOTE_BATCH_MAX_SIZE
 from coin_exchange.models import Order, Review, ReferralOrder, PromotionOrder
 from common import serializer_fields
+from common.constants import FIAT_CURRENCY, DIRECTION
 
 
 class QuoteInputSerializer(serializers.Serializer):
@@ -13,22 +15,21 @@ class QuoteInputSerializer(serializers.Serializer):
     direction = serializer_fields.DirectionField()
 
 
-class QuoteSerializer(serializers.Serializer):
-    fiat_amount = serializer_fields.FiatAmountField()
-    fiat_currency = serializer_fields.FiatCurrencyField()
-    fiat_local_amount = serializer_fields.FiatAmountField()
-    fiat_local_currency = serializer_fields.FiatCurrencyField()
-    fiat_amount_cod = serializer_fields.FiatAmountField()
-    fiat_local_amount_cod = serializer_fields.FiatAmountField()
-    raw_fiat_amount = serializer_fields.FiatAmountField()
-    fee = serializer_fields.FiatAmountField()
-    fee_cod = serializer_fields.FiatAmountField()
-    fee_local = serializer_fields.FiatAmountField()
-    fee_local_cod = serializer_fields.FiatAmountField()
-    price = serializer_fields.FiatAmountField()
+class QuoteBatchItemInputSerializer(serializers.Serializer):
     amount = serializer_fields.CryptoAmountField()
     currency = serializer_fields.CryptoCurrencyField()
-    direction = serializer_fields.DirectionField()
+    fiat_currency = serializer_fields.FiatCurrencyField(default=FIAT_CURRENCY.USD)
+    direction = serializer_fields.DirectionField(default=DIRECTION.buy)
+
+
+class QuoteBatchInputSerializer(serializers.Serializer):
+    quotes = QuoteBatchItemInputSerializer(many=True, allow_empty=False)
+
+    def validate_quotes(self, value):
+        if len(value) > QUOTE_BATCH_MAX_SIZE:
+            raise serializers.ValidationError('Ensure this field has no more than {} elements.'.format(
+                QUOTE_BATCH_MAX_SIZE))
+        return value
 
 
 class QuoteReverseInputSerializer(serializers.Serializer):
@@ -41,24 +42,14 @@ class QuoteReverseInputSerializer(serializers.Serializer):
     order_type = serializers.CharField()
 
 
-class QuoteReverseSerializer(serializers.Serializer):
-    fiat_amount = serializer_fields.FiatAmountField()
-    fiat_currency = serializer_fields.FiatCurrencyField()
-    fiat_local_amount = serializer_fields.FiatAmountField()
-    fiat_local_currency = serializer_fields.FiatCurrencyField()
-    raw_fiat_amount = serializer_fields.FiatAmountField()
-    price = serializer_fields.FiatAmountField()
-    amount = serializer_fields.CryptoAmountField()
-    currency = serializer_fields.CryptoCurrencyField()
-    direction = serializer_fields.DirectionField()
-
-
 class OrderSerializer(serializers.ModelSerializer):
     class Meta:
         model = Order
         exclude = ('user', 'raw_fiat_amount', 'price', 'fee', 'provider_data')
         read_only_fields = ('fiat_amount', 'fiat_currency', 'ref_code', 'reviewed')
 
+    quote_token = serializers.CharField(write_only=True, required=False)
+
 
 class SellingOrderSerializer(serializers.ModelSerializer):
     class Meta:
@@ -66,6 +57,8 @@ class SellingOrderSerializer(serializers.ModelSerializer):
         exclude = ('user', 'raw_fiat_amount', 'price', 'fee', 'receipt_url', 'provider_data')
         read_only_fields = ('fiat_amount', 'fiat_currency', 'ref_code', 'reviewed')
 
+    quote_token = serializers.CharField(write_only=True, required=False)
+
 
 class ReviewSerializer(serializers.ModelSerializer):
     class Meta:
@@ -1,20 +1,14 @@
-import logging
-
 from django.db.models import F
 from django.db.models.signals import post_save
 from django.dispatch import receiver
 
-from coin_exchange.business.crypto import TrackingManagement
-from coin_exchange.business.order import OrderManagement
-from coin_exchange.business.promotion import PromotionManagement
-from coin_exchange.business.referral import ReferralManagement
+from coin_exchange.business.limit_counter import LimitCounterManagement
+from coin_exchange.business.order_state import order_state_machine
 from coin_exchange.business.user_limit import update_limit_by_level
-from coin_exchange.constants import ORDER_STATUS, PAYMENT_STATUS, ORDER_TYPE
-from coin_exchange.models import Order, SellingPaymentDetail
-from coin_user.business import UserManagement
+from coin_exchange.constants import ORDER_STATUS, PAYMENT_STATUS
+from coin_exchange.models import Order, SellingPaymentDetail, Pool, UserLimit
 from coin_user.constants import VERIFICATION_STATUS
 from coin_user.models import ExchangeUser
-from common.constants import DIRECTION
 
 
 @receiver(post_save, sender=ExchangeUser)
@@ -27,52 +21,19 @@ def post_save_exchange_user(sender, **kwargs):
             update_limit_by_level(user)
 
 
+@receiver(post_save, sender=Pool)
+def post_save_pool(sender, **kwargs):
+    LimitCounterManagement.reload_pool_counter(kwargs['instance'])
+
+
+@receiver(post_save, sender=UserLimit)
+def post_save_user_limit(sender, **kwargs):
+    LimitCounterManagement.reload_user_counter(kwargs['instance'])
+
+
 @receiver(post_save, sender=Order)
 def post_save_order(sender, **kwargs):
-    order = kwargs['instance']
-    created = kwargs['created']
-    try:
-        if created:
-            OrderManagement.increase_limit(order.user, order.amount, order.currency, order.direction,
-                                           order.fiat_local_amount, order.fiat_local_currency)
-            if order.direction == DIRECTION.buy:
-                if order.order_type == ORDER_TYPE.cod:
-                    OrderManagement.send_new_order_notification(order)
-            elif order.direction == DIRECTION.sell:
-                TrackingManagement.add_tracking_address_payment(order)
-                OrderManagement.send_new_order_notification(order)
-        else:
-            update_fields = kwargs['update_fields']
-            if update_fields and 'status' in update_fields:
-                if order.status in [ORDER_STATUS.expired, ORDER_STATUS.cancelled, ORDER_STATUS.rejected]:
-                    OrderManagement.decrease_limit(order.user, order.amount, order.currency, order.direction,
-                                                   order.fiat_local_amount, order.fiat_local_currency)
-                    TrackingManagement.remove_tracking(order)
-                if order.direction == DIRECTION.buy:
-                    if order.status == ORDER_STATUS.fiat_transferring:
-                        if order.order_type == ORDER_TYPE.bank:
-                            OrderManagement.send_new_order_notification(order)
-                    if order.status == ORDER_STATUS.transferring:
-                        if order.tx_hash:
-                            TrackingManagement.create_tracking_simple_transaction(order)
-                    elif order.status == ORDER_STATUS.success:
-                        UserManagement.update_first_purchase(order.user)
-                        ReferralManagement.create_referral(order)
-                        PromotionManagement.create_promotion(order)
-                        TrackingManagement.remove_tracking(order)
-                        # TODO Send notification
-                elif order.direction == DIRECTION.sell:
-                    if order.status == ORDER_STATUS.transferred:
-                        TrackingManagement.remove_tracking(order)
-                    elif order.status == ORDER_STATUS.success:
-                        UserManagement.update_first_purchase(order.user)
-                        ReferralManagement.create_referral(order)
-                        PromotionManagement.create_promotion(order)
-                        TrackingManagement.remove_tracking(order)
-                        # TODO Send notification
-    except Exception as ex:
-        # I don't want the alter flow effect the ORDER
-        logging.exception(ex)
+    order_state_machine.saved(kwargs['instance'], kwargs['created'], kwargs['update_fields'])
 
 
 @receiver(post_save, sender=SellingPaymentDetail)
@@ -1,14 +1,26 @@
-from unittest.mock import MagicMock
+import time
+from datetime import timedelta
+from decimal import Decimal
+from unittest import TestCase
+from unittest.mock import MagicMock, patch
 
 from django.urls import reverse
+from django.utils import timezone
 from rest_framework import status
-from rest_framework.test import APITestCase
+from rest_framework.test import APITestCase, APITransactionTestCase
 
-from coin_exchange.business.crypto import AddressManagement
-from coin_exchange.constants import TRACKING_ADDRESS_STATUS
-from coin_exchange.factories import TrackingAddressFactory
-from common.constants import CURRENCY
+from coin_exchange.business.crypto import AddressManagement, TrackingManagement, TrackingExecutor, \
+    BlockScanManagement, TokenDepositManagement
+from coin_exchange.constants import TRACKING_ADDRESS_STATUS, PAYMENT_STATUS, ORDER_STATUS, \
+    TRACKING_TRANSACTION_STATUS, BLOCK_SCAN_CONFIRMATIONS, BLOCK_SCAN_MAX_BLOCKS
+from coin_exchange.factories import TrackingAddressFactory, OrderFactory
+from coin_exchange.models import SellingPaymentDetail, TrackingTransaction, TrackingAddress, BlockScanState, \
+    SellingPayment, CryptoToken, Order
+from common.constants import CURRENCY, DIRECTION, FIAT_CURRENCY
+from common.tests.eth_chain import EthTesterChain
 from common.tests.utils import AuthenticationUtils
+from integration import explorer, ethereum
+from integration.objects import BTCTransactionResponse
 
 
 class CryptoTests(APITestCase):
@@ -35,3 +47,242 @@ class CryptoTests(APITestCase):
 
         self.assertEqual(response.status_code, status.HTTP_201_CREATED)
         self.assertEqual(response.json(), self.test_address)
+
+
+class AddressRegistryTests(APITransactionTestCase):
+    def setUp(self):
+        self.order = OrderFactory(direction=DIRECTION.sell, address='0xAbCdEf0123', user__currency=FIAT_CURRENCY.PHP)
+
+    def test_register(self):
+        crypto_address = AddressManagement.get_address('0xABCDEF0123')
+        self.assertEqual(crypto_address.address, '0xabcdef0123')
+        self.assertEqual(crypto_address.sell_order, self.order)
+        self.assertEqual(crypto_address.tracking_address.order, self.order)
+        self.assertEqual(crypto_address.selling_payment.order, self.order)
+        self.assertTrue(AddressManagement.is_sell_address(' 0xabcdef0123'))
+        self.assertFalse(AddressManagement.is_sell_address('0xOther'))
+
+    def test_tracking(self):
+        tracking_address = AddressManagement.get_address(self.order.address).tracking_address
+        tracking = TrackingManagement.create_tracking_transaction(tracking_address, 'SomeTxHash')
+
+        TrackingManagement.track_system_transaction(tracking.pk)
+        self.assertEqual(SellingPaymentDetail.objects.filter(payment__order=self.order).count(), 1)
+
+        TrackingManagement.remove_tracking(self.order)
+        self.assertFalse(TrackingTransaction.objects.exists())
+        self.assertFalse(TrackingAddress.objects.exists())
+        self.assertTrue(AddressManagement.is_sell_address(self.order.address))
+
+
+class TrackingExecutorTests(TestCase):
+    def test_run(self):
+        def track(pk):
+            if pk == 2:
+                raise ValueError
+            if pk == 3:
+                time.sleep(0.5)
+
+        progress = TrackingExecutor(max_workers=2, item_timeout=0.1).run(track, [1, 2, 3, 4])
+        self.assertEqual(progress, {'total': 4, 'success': 2, 'failed': 1, 'timeout': 1})
+
+    def test_empty(self):
+        self.assertEqual(TrackingExecutor().run(MagicMock(), []), {'total': 0, 'success': 0, 'failed': 0, 'timeout': 0})
+
+
+class TrackingScheduleTests(APITestCase):
+    def setUp(self):
+        self.order = OrderFactory(direction=DIRECTION.sell, currency=CURRENCY.BTC, amount=Decimal('1'),
+                                  user__currency=FIAT_CURRENCY.PHP)
+        self.tracking_address = TrackingAddressFactory(user=self.order.user, order=self.order,
+                                                       address=self.order.address, currency=CURRENCY.BTC,
+                                                       status=TRACKING_ADDRESS_STATUS.has_order)
+        payment = SellingPayment.objects.create(address=self.order.address, order=self.order, amount=0,
+                                                currency=CURRENCY.BTC, overspent=0, status=PAYMENT_STATUS.under)
+        AddressManagement.register_address(self.order.address, selling_payment=payment)
+
+    def assertDelay(self, obj, seconds):
+        obj.refresh_from_db()
+        self.assertAlmostEqual((obj.next_check_at - timezone.now()).total_seconds(), seconds, delta=5)
+
+    def test_load_due(self):
+        TrackingAddressFactory(user=self.order.user, currency=CURRENCY.BTC, address='OtherAddress',
+                               next_check_at=timezone.now() + timedelta(minutes=1))
+        with patch.object(TrackingExecutor, 'run') as run:
+            TrackingManagement.load_tracking_address()
+        self.assertEqual(run.call_args[0][1], [(self.tracking_address.pk,)])
+
+    def test_address_backoff(self):
+        # Checked again soon after news
+        TrackingManagement.track_system_addresses([self.tracking_address.pk])
+        self.assertDelay(self.tracking_address, 60)
+        self.assertEqual(self.tracking_address.attempts, 0)
+
+        TrackingManagement.track_system_addresses([self.tracking_address.pk])
+        self.assertDelay(self.tracking_address, 120)
+        TrackingManagement.track_system_addresses([self.tracking_address.pk])
+        self.assertDelay(self.tracking_address, 240)
+        self.assertEqual(self.tracking_address.attempts, 2)
+
+        # An old order waits for a part of its age
+        Order.objects.filter(pk=self.order.pk).update(created_at=timezone.now() - timedelta(hours=10))
+        TrackingManagement.track_system_addresses([self.tracking_address.pk])
+        self.assertDelay(self.tracking_address, 60 * 60)
+
+    def test_transaction_schedule(self):
+        tracking = TrackingManagement.create_tracking_transaction(self.tracking_address, 'SomeTxHash')
+
+        resp = BTCTransactionResponse('SomeTxHash', Decimal('6'), confirmation=1)
+        with patch.object(TrackingManagement, 'track_network_transaction', return_value=resp):
+            TrackingManagement.track_system_transaction(tracking.pk)
+        # 2 confirmations to go
+        self.assertDelay(tracking, 2 * 10 * 60)
+        self.assertEqual(tracking.status, TRACKING_TRANSACTION_STATUS.pending)
+
+        with patch.object(TrackingManagement, 'track_network_transaction', side_effect=ValueError):
+            with self.assertRaises(ValueError):
+                TrackingManagement.track_system_transaction(tracking.pk)
+        self.assertDelay(tracking, 120)
+        self.assertEqual(tracking.attempts, 1)
+
+        resp = BTCTransactionResponse('SomeTxHash', Decimal('1'), confirmation=1)
+        with patch.object(TrackingManagement, 'track_network_transaction', return_value=resp), \
+                patch.object(AddressManagement, 'get_address', return_value=None):
+            with self.assertRaises(SellingPayment.DoesNotExist):
+                TrackingManagement.track_system_transaction(tracking.pk)
+        tracking.refresh_from_db()
+        self.assertEqual(tracking.status, TRACKING_TRANSACTION_STATUS.pending)
+        self.assertEqual(tracking.attempts, 2)
+
+        TrackingManagement.track_system_transaction(tracking.pk)
+        tracking.refresh_from_db()
+        self.assertEqual(tracking.status, TRACKING_TRANSACTION_STATUS.success)
+        self.assertIsNone(tracking.next_check_at)
+        with patch.object(TrackingExecutor, 'run') as run:
+            TrackingManagement.load_tracking_transaction()
+        self.assertEqual(run.call_args[0][1], [])
+
+
+class BlockScanTests(APITestCase):
+    def setUp(self):
+        order = OrderFactory(direction=DIRECTION.sell, currency=CURRENCY.ETH, user__currency=FIAT_CURRENCY.PHP)
+        self.tracking_address = TrackingAddressFactory(user=order.user, order=order, currency=CURRENCY.ETH,
+                                                       address='0xAbC', status=TRACKING_ADDRESS_STATUS.has_order)
+        order = OrderFactory(direction=DIRECTION.sell, currency=CURRENCY.ETH, user=order.user)
+        self.other_address = TrackingAddressFactory(user=order.user, order=order, currency=CURRENCY.ETH,
+                                                    address='0xDeF', status=TRACKING_ADDRESS_STATUS.has_order)
+        self.height = MagicMock(return_value=102)
+        self.blocks = {
+            100: [('0xtx1', {'0xabc', '0xother'})],
+            101: [('0xtx2', {'0xother'}), ('0xtx3', set())],
+            102: [('0xtx1', {'0xABC'}), ('0xtx4', {'0xdef'})],
+        }
+        patcher = patch.multiple(explorer, BLOCK_HEIGHT_FETCHERS={CURRENCY.ETH: self.height},
+                                 BLOCK_TRANSACTION_FETCHERS={CURRENCY.ETH: self.blocks.get})
+        patcher.start()
+        self.addCleanup(patcher.stop)
+        patcher = patch.dict(BLOCK_SCAN_CONFIRMATIONS, {CURRENCY.ETH: 2})
+        patcher.start()
+        self.addCleanup(patcher.stop)
+
+    def test_scan(self):
+        self.assertEqual(BlockScanManagement.scan(CURRENCY.ETH), {'from': 100, 'to': 100, 'deposits': 1})
+        self.assertEqual(BlockScanManagement.scan(CURRENCY.ETH), {'from': 101, 'to': 100, 'deposits': 0})
+
+        self.height.return_value = 104
+        self.assertEqual(BlockScanManagement.scan(CURRENCY.ETH), {'from': 101, 'to': 102, 'deposits': 1})
+        self.assertEqual(TrackingTransaction.objects.get(tx_hash='0xtx1').tracking_address, self.tracking_address)
+        self.assertEqual(TrackingTransaction.objects.get(tx_hash='0xtx4').tracking_address, self.other_address)
+        self.assertEqual(BlockScanState.objects.get(currency=CURRENCY.ETH).height, 102)
+
+    def test_nothing_tracked(self):
+        TrackingAddress.objects.all().delete()
+        self.height.return_value = 104
+        BlockScanManagement.scan(CURRENCY.ETH)
+        self.height.return_value = 152
+        self.assertEqual(BlockScanManagement.scan(CURRENCY.ETH), {'from': 103, 'to': 150, 'deposits': 0})
+        self.assertEqual(BlockScanState.objects.get(currency=CURRENCY.ETH).height, 150)
+
+    def test_max_blocks(self):
+        BlockScanManagement.scan(CURRENCY.ETH)
+        self.height.return_value = 104
+        with patch.dict(BLOCK_SCAN_MAX_BLOCKS, {CURRENCY.ETH: 1}):
+            self.assertEqual(BlockScanManagement.scan(CURRENCY.ETH), {'from': 101, 'to': 101, 'deposits': 0})
+            self.assertEqual(BlockScanManagement.scan(CURRENCY.ETH), {'from': 102, 'to': 102, 'deposits': 1})
+
+
+class TokenDepositTests(APITestCase):
+    def setUp(self):
+        self.chain = EthTesterChain()
+        patcher = patch.object(ethereum, 'w3', self.chain.w3)
+        patcher.start()
+        self.addCleanup(patcher.stop)
+
+        self.token = self.chain.deploy_token()
+        CryptoToken.objects.create(address=self.token, symbol=CURRENCY.USDT, protocol='eip-20', decimals=6,
+                                   auto_price=False)
+
+        self.address = '0x' + '12' * 20
+        self.order = OrderFactory(direction=DIRECTION.sell, currency=CURRENCY.USDT, amount=Decimal('10'),
+                                  address=self.address, status=ORDER_STATUS.transferring,
+                                  user__currency=FIAT_CURRENCY.PHP)
+        self.payment = SellingPayment.objects.create(address=self.address, order=self.order, amount=0,
+                                                     currency=CURRENCY.USDT, overspent=0,
+                                                     status=PAYMENT_STATUS.under)
+        AddressManagement.register_address(self.address, sell_order=self.order, selling_payment=self.payment)
+
+    def test_get_transfer_logs(self):
+        other_token = self.chain.deploy_token()
+        tx_hash = self.chain.transfer(self.token, self.address, 5)
+        self.chain.transfer(self.token, '0x' + '34' * 20, 7)
+        self.chain.transfer(other_token, self.address, 9)
+
+        logs = ethereum.get_transfer_logs([self.token], [self.address], 0, self.chain.w3.eth.blockNumber)
+        self.assertEqual([(log.tx_hash, log.to_address, log.value) for log in logs], [(tx_hash, self.address, 5)])
+        self.assertEqual(logs[0].from_address, self.chain.account.lower())
+
+    @patch('coin_exchange.business.crypto.TOKEN_CONFIRMATIONS', 2)
+    def test_scan(self):
+        self.chain.mine(2)
+        height = self.chain.w3.eth.blockNumber
+        self.assertEqual(TokenDepositManagement.scan(), {'from': height - 2, 'to': height - 2, 'deposits': 0})
+
+        other_token = self.chain.deploy_token()
+        self.chain.transfer(self.token, self.address, 4 * 10 ** 6)
+        self.chain.transfer(self.token, '0x' + '34' * 20, 10 ** 6)
+        self.chain.transfer(other_token, self.address, 10 ** 6)
+        self.assertEqual(TokenDepositManagement.scan(), {'from': height - 1, 'to': height + 2, 'deposits': 1})
+        self.payment.refresh_from_db()
+        self.assertEqual(self.payment.amount, Decimal('4'))
+        self.assertEqual(self.payment.status, PAYMENT_STATUS.under)
+
+        # Credited once confirmed only
+        self.chain.transfer(self.token, self.address, 6 * 10 ** 6)
+        self.chain.mine(1)
+        self.assertEqual(TokenDepositManagement.scan(), {'from': height + 3, 'to': height + 4, 'deposits': 0})
+        self.chain.mine(1)
+        self.assertEqual(TokenDepositManagement.scan(), {'from': height + 5, 'to': height + 5, 'deposits': 1})
+        self.payment.refresh_from_db()
+        self.order.refresh_from_db()
+        self.assertEqual(self.payment.status, PAYMENT_STATUS.matched)
+        self.assertEqual(self.order.status, ORDER_STATUS.transferred)
+
+        self.assertEqual(TokenDepositManagement.scan(), {'from': height + 6, 'to': height + 5, 'deposits': 0})
+        self.assertEqual(CryptoToken.objects.get(address=self.token).scanned_block, height + 5)
+        self.assertEqual(SellingPaymentDetail.objects.filter(payment=self.payment).count(), 2)
+
+    @patch('coin_exchange.business.crypto.TOKEN_CONFIRMATIONS', 0)
+    @patch('coin_exchange.business.crypto.TOKEN_LOG_BLOCK_RANGE', 2)
+    def test_scan_block_ranges(self):
+        TokenDepositManagement.scan()
+        for i in range(5):
+            self.chain.transfer(self.token, self.address, 10 ** 6)
+        # Added later, only its next blocks are scanned
+        CryptoToken.objects.create(address=self.chain.deploy_token(), symbol='OTHER', protocol='eip-20',
+                                   auto_price=False)
+
+        with patch.object(ethereum, 'get_transfer_logs', wraps=ethereum.get_transfer_logs) as get_transfer_logs:
+            self.assertEqual(TokenDepositManagement.scan()['deposits'], 5)
+        self.assertEqual(get_transfer_logs.call_count, 3)
+        self.payment.refresh_from_db()
+        self.assertEqual(self.payment.amount, Decimal('5'))
@@ -1,21 +1,37 @@
+import time
+from contextlib import contextmanager
+from datetime import datetime, timedelta
 from decimal import Decimal
+from importlib import import_module
 from unittest import TestCase
-from unittest.mock import MagicMock
+from unittest.mock import MagicMock, patch
 
+import fakeredis
+from django.apps import apps
+from django.db import IntegrityError, transaction
 from django.urls import reverse
 from rest_framework import status
 from rest_framework.test import APITestCase
 
+from coin_exchange.business.limit_counter import LimitCounterManagement, get_window_start
 from coin_exchange.business.order import OrderManagement
+from coin_exchange.business.order_counter import OrderCounterManagement, get_day
+from coin_exchange.business.order_state import OrderStateMachine, BUY
+from coin_exchange.business.quote import QuoteManagement
 from coin_exchange.constants import ORDER_TYPE, MIN_ETH_AMOUNT, MIN_BTC_AMOUNT, \
-    FEE_COIN_ORDER_BANK, FEE_COIN_ORDER_COD, FEE_COIN_SELLING_ORDER_BANK, ORDER_STATUS, FEE_COIN_SELLING_ORDER_COD
-from coin_exchange.exceptions import AmountIsTooSmallException, PriceChangeException
+    FEE_COIN_ORDER_BANK, FEE_COIN_ORDER_COD, FEE_COIN_SELLING_ORDER_BANK, ORDER_STATUS, FEE_COIN_SELLING_ORDER_COD, \
+    LIMIT_COUNTER_KEY_DIRTY, LIMIT_COUNTER_KEY_USER, LIMIT_COUNTER_KEY_POOL, USER_LIMIT_BUCKET, \
+    ORDER_EXPIRATION_DURATION, CONFIG_USER_LIMIT_RESET_AT
+from coin_exchange.exceptions import AmountIsTooSmallException, PriceChangeException, CoinOverLimitException, \
+    CoinUserOverLimitException
 from coin_exchange.factories import OrderFactory, PoolFactory, UserLimitFactory
-from coin_exchange.models import Order
+from coin_exchange.models import Order, OrderCounter, TrackingTransaction
 from coin_system.constants import FEE_TYPE
+from coin_system.models import Config
 from coin_system.factories import FeeFactory
-from common.business import PriceManagement, CryptoPrice, RateManagement
+from common.business import PriceManagement, CryptoPrice, RateManagement, get_now
 from common.constants import DIRECTION, CURRENCY, FIAT_CURRENCY, DIRECTION_ALL
+from common.http import StandardCursorPagination
 from common.tests.utils import AuthenticationUtils
 
 
@@ -48,6 +64,32 @@ class ListOrderTests(APITestCase):
         self.assertEqual(response.status_code, status.HTTP_200_OK)
         self.assertEqual(len(response.json()['results']), 5)
 
+    def test_cursor(self):
+        patcher = patch.object(StandardCursorPagination, 'page_size', 3)
+        patcher.start()
+        self.addCleanup(patcher.stop)
+
+        ids = []
+        url = reverse('exchange:order-list')
+        while url:
+            response = self.client.get(url, format='json')
+            self.assertEqual(response.status_code, status.HTTP_200_OK)
+            self.assertNotIn('count', response.json())
+            ids += [item['id'] for item in response.json()['results']]
+            url = response.json()['next']
+
+        self.assertEqual(ids, list(Order.objects.order_by('-created_at', '-id').values_list('id', flat=True)))
+
+    def test_page_size(self):
+        url = reverse('exchange:order-list')
+        response = self.client.get(url, data={'page_size': 4}, format='json')
+        self.assertEqual(len(response.json()['results']), 4)
+        self.assertIn('page_size=4', response.json()['next'])
+
+        with patch.object(StandardCursorPagination, 'max_page_size', 2):
+            response = self.client.get(url, data={'page_size': 4}, format='json')
+        self.assertEqual(len(response.json()['results']), 2)
+
 
 class AddOrderTest(APITestCase):
     def setUp(self):
@@ -98,6 +140,68 @@ class AddOrderTest(APITestCase):
 
         self.assertEqual(response.status_code, status.HTTP_201_CREATED)
 
+    def _get_quote_token(self):
+        url = reverse('exchange:quote-detail')
+        response = self.client.get(url, data={
+            'amount': '1',
+            'currency': CURRENCY.ETH,
+            'fiat_currency': FIAT_CURRENCY.PHP,
+        }, format='json')
+        return response.json()['quote_token']
+
+    def test_add_order_with_quote_token(self):
+        quote_token = self._get_quote_token()
+
+        url = reverse('exchange:order-list')
+        with patch.object(QuoteManagement, 'get_quote') as get_quote:
+            response = self.client.post(url, data={
+                'amount': '1',
+                'currency': CURRENCY.ETH,
+                'fiat_local_amount': '2323000',
+                'fiat_local_currency': FIAT_CURRENCY.PHP,
+                'order_type': ORDER_TYPE.bank,
+                'direction': DIRECTION.buy,
+                'address': '0x6d86cf435978cb75aecc43d0a4e3a379af7667d8',
+                'quote_token': quote_token,
+            }, format='json')
+            get_quote.assert_not_called()
+
+        self.assertEqual(response.status_code, status.HTTP_201_CREATED)
+        order = Order.objects.get(pk=response.json()['id'])
+        self.assertEqual(order.fiat_amount, Decimal('101'))
+
+    def test_add_order_with_other_quote_token(self):
+        quote_token = self._get_quote_token()
+
+        url = reverse('exchange:order-list')
+        response = self.client.post(url, data={
+            'amount': '2',
+            'currency': CURRENCY.ETH,
+            'fiat_local_amount': '2323000',
+            'fiat_local_currency': FIAT_CURRENCY.PHP,
+            'order_type': ORDER_TYPE.bank,
+            'direction': DIRECTION.buy,
+            'address': '0x6d86cf435978cb75aecc43d0a4e3a379af7667d8',
+            'quote_token': quote_token,
+        }, format='json')
+
+        self.assertEqual(response.status_code, status.HTTP_400_BAD_REQUEST, 'Quote is recalculated for 2 ETH')
+
+    def test_add_order_with_invalid_quote_token(self):
+        url = reverse('exchange:order-list')
+        response = self.client.post(url, data={
+            'amount': '1',
+            'currency': CURRENCY.ETH,
+            'fiat_local_amount': '2323000',
+            'fiat_local_currency': FIAT_CURRENCY.PHP,
+            'order_type': ORDER_TYPE.bank,
+            'direction': DIRECTION.buy,
+            'address': '0x6d86cf435978cb75aecc43d0a4e3a379af7667d8',
+            'quote_token': 'SomeInvalidToken',
+        }, format='json')
+
+        self.assertEqual(response.status_code, status.HTTP_201_CREATED)
+
 
 class AddSellingOrderTest(APITestCase):
     def setUp(self):
@@ -196,3 +300,307 @@ class OrderSupportFunctionTest(TestCase):
     def test_check_different_in_threshold(self):
         with self.assertRaises(PriceChangeException):
             OrderManagement._check_different_in_threshold(Decimal(5), Decimal(4.5))
+
+
+class LimitCounterTests(APITestCase):
+    def setUp(self):
+        self.pool = PoolFactory(currency=CURRENCY.ETH, direction=DIRECTION.buy, usage=1, limit=2)
+        self.user_limit = UserLimitFactory(fiat_currency=FIAT_CURRENCY.PHP, direction=DIRECTION_ALL, usage=100,
+                                           limit=1000, user__currency=FIAT_CURRENCY.PHP)
+        self.user = self.user_limit.user
+
+    def test_db_usage(self):
+        OrderManagement.increase_limit(self.user, Decimal('0.5'), CURRENCY.ETH, DIRECTION.buy,
+                                       Decimal('200'), FIAT_CURRENCY.PHP)
+        self.pool.refresh_from_db()
+        self.user_limit.refresh_from_db()
+        self.assertEqual(self.pool.usage, Decimal('1.5'))
+        self.assertEqual(self.user_limit.usage, Decimal('300'))
+
+        OrderManagement.decrease_limit(self.user, Decimal('2'), CURRENCY.ETH, DIRECTION.buy,
+                                       Decimal('200'), FIAT_CURRENCY.PHP)
+        self.pool.refresh_from_db()
+        self.user_limit.refresh_from_db()
+        self.assertEqual(self.pool.usage, Decimal('0'), 'Usage never goes under 0')
+        self.assertEqual(self.user_limit.usage, Decimal('100'))
+
+    def test_db_check(self):
+        with self.assertRaises(CoinOverLimitException):
+            QuoteManagement.check_pool(DIRECTION.buy, Decimal('1.5'), CURRENCY.ETH)
+        QuoteManagement.check_pool(DIRECTION.buy, Decimal('1'), CURRENCY.ETH)
+
+    def test_db_rolling_window(self):
+        now = time.time()
+        OrderManagement.increase_limit(self.user, Decimal('0.5'), CURRENCY.ETH, DIRECTION.buy, Decimal('500'),
+                                       FIAT_CURRENCY.PHP, created_at=datetime.fromtimestamp(now - 2 * 24 * 60 * 60))
+        self.user_limit.refresh_from_db()
+        self.assertEqual(self.user_limit.usage, Decimal('100'), 'Usage out of the window is dropped')
+
+        with self.assertRaises(CoinUserOverLimitException):
+            LimitCounterManagement.check_user_limit(self.user, Decimal('1000'))
+        with patch('coin_exchange.business.limit_counter.time.time', return_value=now + USER_LIMIT_BUCKET):
+            OrderManagement.reset_user_limit()
+            LimitCounterManagement.check_user_limit(self.user, Decimal('1000'))
+
+    def test_reset_at_seeded(self):
+        # Seeded by a migration, the rows of the migrations are gone after a transaction test case
+        migration = import_module('coin_exchange.migrations.0031_seed_user_limit_reset_at')
+        migration.seed_user_limit_reset_at(apps, None)
+        self.assertEqual(Config.objects.get(pk=CONFIG_USER_LIMIT_RESET_AT).get_value(), 0)
+        self.assertEqual(get_window_start(1000000), 910800)
+
+    def test_db_reserve(self):
+        self.assertFalse(LimitCounterManagement.reserve_usage(self.user, Decimal('200'), DIRECTION.buy,
+                                                              CURRENCY.ETH, Decimal('0.5')))
+        with self.assertRaises(CoinOverLimitException):
+            LimitCounterManagement.reserve_usage(self.user, Decimal('200'), DIRECTION.buy, CURRENCY.ETH,
+                                                 Decimal('0.6'))
+        with self.assertRaises(CoinUserOverLimitException):
+            LimitCounterManagement.reserve_usage(self.user, Decimal('800'), DIRECTION.buy, CURRENCY.ETH,
+                                                 Decimal('0.1'))
+
+        self.pool.refresh_from_db()
+        self.user_limit.refresh_from_db()
+        self.assertEqual(self.pool.usage, Decimal('1.5'))
+        self.assertEqual(self.user_limit.usage, Decimal('300'))
+
+
+class LimitCounterRedisTests(APITestCase):
+    def setUp(self):
+        self.pool = PoolFactory(currency=CURRENCY.ETH, direction=DIRECTION.buy, usage=1, limit=2)
+        self.user_limit = UserLimitFactory(fiat_currency=FIAT_CURRENCY.PHP, direction=DIRECTION_ALL, usage=100,
+                                           limit=1000, user__currency=FIAT_CURRENCY.PHP)
+        self.user = self.user_limit.user
+        self.redis = fakeredis.FakeStrictRedis()
+        patcher = patch('coin_exchange.business.limit_counter.get_redis', return_value=self.redis)
+        patcher.start()
+        self.addCleanup(patcher.stop)
+
+        self.pool_key = LIMIT_COUNTER_KEY_POOL.format(DIRECTION.buy, CURRENCY.ETH)
+        self.user_key = LIMIT_COUNTER_KEY_USER.format(self.user.pk)
+
+    def test_reserve(self):
+        self.assertTrue(LimitCounterManagement.reserve_usage(self.user, Decimal('200.5'), DIRECTION.buy,
+                                                             CURRENCY.ETH, Decimal('0.5')))
+        with self.assertRaises(CoinOverLimitException):
+            LimitCounterManagement.reserve_usage(self.user, Decimal('200'), DIRECTION.buy, CURRENCY.ETH,
+                                                 Decimal('0.6'))
+        with self.assertRaises(CoinUserOverLimitException):
+            LimitCounterManagement.reserve_usage(self.user, Decimal('800'), DIRECTION.buy, CURRENCY.ETH,
+                                                 Decimal('0.1'))
+
+        self.assertEqual(int(self.redis.hget(self.pool_key, 'usage')), 150000000, 'Nothing is taken over a limit')
+        self.assertEqual(sum(int(value) for field, value in self.redis.hgetall(self.user_key).items()
+                             if field.startswith(b'b:')), 30050)
+        self.pool.refresh_from_db()
+        self.assertEqual(self.pool.usage, Decimal('1'), 'DB is only written by the flush')
+
+        self.assertEqual(LimitCounterManagement.flush(), 2)
+        self.pool.refresh_from_db()
+        self.user_limit.refresh_from_db()
+        self.assertEqual(self.pool.usage, Decimal('1.5'))
+        self.assertEqual(self.user_limit.usage, Decimal('300.5'))
+        self.assertEqual(LimitCounterManagement.flush(), 0)
+
+    def test_reserve_rolling_window(self):
+        now = time.time()
+        LimitCounterManagement.reserve_usage(self.user, Decimal('800'), DIRECTION.buy, CURRENCY.ETH,
+                                             Decimal('0.1'), now - 2 * 24 * 60 * 60)
+        LimitCounterManagement.reserve_usage(self.user, Decimal('800'), DIRECTION.buy, CURRENCY.ETH,
+                                             Decimal('0.1'), now)
+        with self.assertRaises(CoinUserOverLimitException):
+            LimitCounterManagement.check_user_limit(self.user, Decimal('200'))
+
+    def test_rollback(self):
+        order = OrderFactory(user=self.user, direction=DIRECTION.buy, order_type=ORDER_TYPE.bank,
+                             currency=CURRENCY.ETH, amount=Decimal('0.5'), fiat_local_amount=Decimal('200'),
+                             fiat_local_currency=FIAT_CURRENCY.PHP)
+        serializer = MagicMock()
+        serializer.save.return_value = order
+        atomic = transaction.atomic
+
+        @contextmanager
+        def failed_commit():
+            with atomic():
+                yield
+            raise IntegrityError
+
+        with patch.object(transaction, 'atomic', side_effect=failed_commit):
+            with self.assertRaises(IntegrityError):
+                OrderManagement._save_order(serializer)
+
+        self.assertEqual(int(self.redis.hget(self.pool_key, 'usage')), 100000000)
+        LimitCounterManagement.reserve_usage(self.user, Decimal('900'), DIRECTION.buy, CURRENCY.ETH, Decimal('1'))
+
+    def test_load_counter(self):
+        with self.assertRaises(CoinOverLimitException):
+            QuoteManagement.check_pool(DIRECTION.buy, Decimal('1.5'), CURRENCY.ETH)
+
+        self.assertEqual(self.redis.hgetall(self.pool_key), {b'limit': b'200000000', b'usage': b'100000000'})
+
+    def test_admin_edit(self):
+        LimitCounterManagement.reserve_usage(self.user, Decimal('200'), DIRECTION.buy, CURRENCY.ETH,
+                                             Decimal('0.5'))
+        self.pool.usage = 0
+        with patch('coin_exchange.business.limit_counter.transaction.on_commit', side_effect=lambda func: func()):
+            self.pool.save()
+
+        self.assertFalse(self.redis.exists(self.pool_key))
+        self.assertEqual(LimitCounterManagement.flush(), 1, 'Only the user counter is written')
+        self.pool.refresh_from_db()
+        self.assertEqual(self.pool.usage, Decimal('0'))
+
+        LimitCounterManagement.reserve_usage(self.user, Decimal('200'), DIRECTION.buy, CURRENCY.ETH, Decimal('2'))
+
+
+class OrderCounterTests(APITestCase):
+    def setUp(self):
+        self.auth_utils = AuthenticationUtils(self.client)
+        self.user = self.auth_utils.create_exchange_user()
+        self.user.currency = FIAT_CURRENCY.USD
+        self.user.save()
+
+    def test_counter(self):
+        today = get_day(get_now())
+        OrderFactory.create_batch(3, direction=DIRECTION.buy, order_type=ORDER_TYPE.cod)
+        OrderFactory(direction=DIRECTION.sell, order_type=ORDER_TYPE.bank)
+        self.assertEqual(OrderCounterManagement.get_count(today, DIRECTION.buy, ORDER_TYPE.cod), 3)
+        self.assertEqual(OrderCounterManagement.get_count(today, DIRECTION.buy, ORDER_TYPE.bank), 0)
+        self.assertFalse(OrderCounter.objects.filter(direction=DIRECTION.sell).exists(), 'Only COD buys are counted')
+
+        OrderCounter.objects.all().delete()
+        result = OrderCounterManagement.recount(today)
+        self.assertEqual(result, {(DIRECTION.buy, ORDER_TYPE.cod): 3})
+        self.assertEqual(OrderCounterManagement.get_count(today, DIRECTION.buy, ORDER_TYPE.cod), 3)
+        self.assertEqual(OrderCounterManagement.get_count(today - timedelta(days=1), DIRECTION.buy, ORDER_TYPE.cod),
+                         0)
+
+    def test_check_cod_limit(self):
+        QuoteManagement.check_cod_limit(self.user.user, Decimal('2500'), FIAT_CURRENCY.USD)
+
+        OrderFactory(direction=DIRECTION.buy, order_type=ORDER_TYPE.cod)
+        with self.assertRaises(CoinUserOverLimitException):
+            QuoteManagement.check_cod_limit(self.user.user, Decimal('2500'), FIAT_CURRENCY.USD)
+
+
+class ExpireOrderTests(APITestCase):
+    def setUp(self):
+        self.pool = PoolFactory(currency=CURRENCY.ETH, direction=DIRECTION.buy, usage=0, limit=100)
+        self.user_limit = UserLimitFactory(fiat_currency=FIAT_CURRENCY.PHP, direction=DIRECTION_ALL, usage=0,
+                                           limit=1000000000, user__currency=FIAT_CURRENCY.PHP)
+        self.user = self.user_limit.user
+        self.orders = OrderFactory.create_batch(3, user=self.user, direction=DIRECTION.buy,
+                                                order_type=ORDER_TYPE.bank, currency=CURRENCY.ETH)
+        self.kept = OrderFactory(user=self.user, direction=DIRECTION.buy, order_type=ORDER_TYPE.bank,
+                                 currency=CURRENCY.ETH)
+        Order.objects.exclude(pk=self.kept.pk).update(
+            created_at=get_now() - timedelta(seconds=ORDER_EXPIRATION_DURATION + 60))
+        for order in Order.objects.all():
+            OrderManagement.reserve_limit(order)
+
+    def test_expire(self):
+        self.assertEqual(OrderManagement.expire_order(), 3)
+
+        self.assertEqual(Order.objects.filter(status=ORDER_STATUS.expired).count(), 3)
+        self.pool.refresh_from_db()
+        self.user_limit.refresh_from_db()
+        self.assertEqual(self.pool.usage, self.kept.amount)
+        self.assertEqual(self.user_limit.usage, self.kept.fiat_local_amount)
+        self.assertEqual(OrderManagement.expire_order(), 0)
+
+    def test_expire_redis(self):
+        redis = fakeredis.FakeStrictRedis()
+        pool_key = LIMIT_COUNTER_KEY_POOL.format(DIRECTION.buy, CURRENCY.ETH)
+        self.pool.refresh_from_db()
+        with patch('coin_exchange.business.limit_counter.get_redis', return_value=redis):
+            LimitCounterManagement.check_pool(DIRECTION.buy, Decimal('0'), CURRENCY.ETH)
+            with self.assertRaises(IntegrityError):
+                with transaction.atomic():
+                    OrderManagement.expire_order()
+                    raise IntegrityError
+            self.assertEqual(int(redis.hget(pool_key, 'usage')), int(self.pool.usage * 10 ** 8),
+                             'Nothing is released when the orders are not expired')
+
+            with patch.object(transaction, 'on_commit', side_effect=lambda func: func()):
+                self.assertEqual(OrderManagement.expire_order(), 3)
+            self.assertEqual(LimitCounterManagement.flush(), 2)
+            self.assertFalse(redis.scard(LIMIT_COUNTER_KEY_DIRTY))
+
+        self.pool.refresh_from_db()
+        self.user_limit.refresh_from_db()
+        self.assertEqual(self.pool.usage, self.kept.amount)
+        self.assertEqual(self.user_limit.usage, self.kept.fiat_local_amount)
+
+
+class TransferringOrderTrackingTests(APITestCase):
+    def test_track_withdrawal(self):
+        order = OrderFactory(direction=DIRECTION.buy, order_type=ORDER_TYPE.bank, status=ORDER_STATUS.transferring,
+                             tx_hash='', provider_data='{"tx_id": 1}')
+        withdrawals = [{'id': 1, 'transaction_id': '0xtx1'}]
+        with patch('coin_exchange.business.order.bitstamp.list_withdrawal_requests', return_value=withdrawals):
+            OrderManagement.load_transferring_order_to_track()
+
+        order.refresh_from_db()
+        self.assertEqual(order.tx_hash, '0xtx1')
+        self.assertTrue(TrackingTransaction.objects.filter(order=order, tx_hash='0xtx1').exists())
+
+    def test_withdrawal_pending(self):
+        OrderFactory(direction=DIRECTION.buy, order_type=ORDER_TYPE.bank, status=ORDER_STATUS.transferring,
+                     tx_hash='', provider_data='{"tx_id": 1}')
+        withdrawals = [{'id': 1, 'transaction_id': ''}]
+        with patch('coin_exchange.business.order.bitstamp.list_withdrawal_requests', return_value=withdrawals):
+            OrderManagement.load_transferring_order_to_track()
+
+        self.assertFalse(TrackingTransaction.objects.exists())
+
+
+class OrderStateMachineTests(APITestCase):
+    def setUp(self):
+        self.order = OrderFactory(direction=DIRECTION.buy, order_type=ORDER_TYPE.bank,
+                                  status=ORDER_STATUS.transferring)
+        self.machine = OrderStateMachine()
+        self.immediate = MagicMock()
+        self.deferred = MagicMock()
+        self.machine.register(BUY, ((ORDER_STATUS.transferring, ORDER_STATUS.success),), self.immediate,
+                              deferred=False)
+        self.machine.register(BUY, ((ORDER_STATUS.transferring, ORDER_STATUS.success),), self.deferred,
+                              order_types=(ORDER_TYPE.bank,))
+
+    def test_transition(self):
+        callbacks = []
+        with patch.object(transaction, 'on_commit', side_effect=callbacks.append):
+            order = Order.objects.get(pk=self.order.pk)
+            order.status = ORDER_STATUS.success
+            self.machine.saved(order, False, None)
+            self.machine.saved(order, False, None)
+            self.machine.saved(order, False, ['tx_hash'])
+        self.immediate.assert_called_once_with(order)
+        self.deferred.assert_not_called()
+
+        # Run as the test transaction is never committed
+        self.assertEqual(len(callbacks), 1)
+        callbacks[0]()
+        self.deferred.assert_called_once_with(order)
+
+    def test_status_not_loaded(self):
+        order = Order(pk=self.order.pk, direction=DIRECTION.buy, order_type=ORDER_TYPE.bank,
+                      status=ORDER_STATUS.success)
+        self.machine.saved(order, False, ['status'])
+        self.immediate.assert_called_once_with(order)
+
+    def test_unknown_transition(self):
+        order = Order.objects.get(pk=self.order.pk)
+        order.status = ORDER_STATUS.pending
+        with self.assertLogs(level='WARNING'):
+            self.machine.saved(order, False, None)
+        self.immediate.assert_not_called()
+
+        # Still saved, as a correction made in the admin
+        order = OrderFactory(direction=DIRECTION.sell, order_type=ORDER_TYPE.bank, status=ORDER_STATUS.processing)
+        order.status = ORDER_STATUS.cancelled
+        order.save(update_fields=['status', 'updated_at'])
+        self.assertEqual(Order.objects.get(pk=order.pk).status, ORDER_STATUS.cancelled)
+
+    def test_register_illegal_transition(self):
+        with self.assertRaises(ValueError):
+            self.machine.register((DIRECTION.sell,), ((ORDER_STATUS.pending, ORDER_STATUS.cancelled),), MagicMock())
@@ -3,7 +3,7 @@ from decimal import Decimal
 from unittest.mock import MagicMock
 
 from django.urls import reverse
-from rest_framework.test import APITestCase
+from rest_framework.test import APITransactionTestCase
 
 from coin_exchange.constants import FEE_COIN_ORDER_COD, ORDER_TYPE, FEE_COIN_ORDER_BANK, FEE_COIN_SELLING_ORDER_BANK, \
     FEE_COIN_SELLING_ORDER_COD, ORDER_STATUS
@@ -16,7 +16,7 @@ from common.constants import CURRENCY, DIRECTION, DIRECTION_ALL, FIAT_CURRENCY
 from common.tests.utils import AuthenticationUtils
 
 
-class PromotionTest(APITestCase):
+class PromotionTest(APITransactionTestCase):
     def setUp(self):
         self.buy_rate = self.sell_rate = Decimal('100')
         self.fiat_rate = Decimal('1')
@@ -44,6 +44,16 @@ class PromotionTest(APITestCase):
         UserLimitFactory(fiat_currency=self.user.currency, direction=DIRECTION_ALL, usage=0, limit=5000,
                          user=self.user)
 
+    def _complete_order(self, order: Order):
+        # Through the statuses of a completed order
+        if order.direction == DIRECTION.buy:
+            statuses = [ORDER_STATUS.processing, ORDER_STATUS.transferring, ORDER_STATUS.success]
+        else:
+            statuses = [ORDER_STATUS.transferred, ORDER_STATUS.processing, ORDER_STATUS.success]
+        for status in statuses:
+            order.status = status
+            order.save(update_fields=['status', ])
+
     def _make_buy_order(self, amount: Decimal):
         url = reverse('exchange:order-list')
         response = self.client.post(url, data={
@@ -79,8 +89,7 @@ class PromotionTest(APITestCase):
 
         order_id = self._make_buy_order(Decimal('10'))
         order = Order.objects.get(id=order_id)
-        order.status = ORDER_STATUS.success
-        order.save(update_fields=['status', ])
+        self._complete_order(order)
 
         ref1 = PromotionOrder.objects.filter(order=order, user=self.referral).first()
         ref2 = PromotionOrder.objects.filter(order=order, user=self.user).first()
@@ -93,8 +102,7 @@ class PromotionTest(APITestCase):
 
         order_id = self._make_sell_order(Decimal('10'))
         order = Order.objects.get(id=order_id)
-        order.status = ORDER_STATUS.success
-        order.save(update_fields=['status', ])
+        self._complete_order(order)
 
         ref1 = PromotionOrder.objects.filter(order=order, user=self.referral).first()
         ref2 = PromotionOrder.objects.filter(order=order, user=self.user).first()
@@ -107,8 +115,7 @@ class PromotionTest(APITestCase):
 
         order_id = self._make_sell_order(Decimal('10'))
         order = Order.objects.get(id=order_id)
-        order.status = ORDER_STATUS.success
-        order.save(update_fields=['status', ])
+        self._complete_order(order)
 
         ref1 = PromotionOrder.objects.filter(order=order, user=self.referral).first()
         ref2 = PromotionOrder.objects.filter(order=order, user=self.user).first()
@@ -121,8 +128,7 @@ class PromotionTest(APITestCase):
 
         order_id = self._make_sell_order(Decimal('7'))
         order = Order.objects.get(id=order_id)
-        order.status = ORDER_STATUS.success
-        order.save(update_fields=['status', ])
+        self._complete_order(order)
 
         ref1 = PromotionOrder.objects.filter(order=order, user=self.referral).first()
         ref2 = PromotionOrder.objects.filter(order=order, user=self.user).first()
@@ -131,8 +137,7 @@ class PromotionTest(APITestCase):
 
         order_id = self._make_sell_order(Decimal('3'))
         order = Order.objects.get(id=order_id)
-        order.status = ORDER_STATUS.success
-        order.save(update_fields=['status', ])
+        self._complete_order(order)
 
         ref1 = PromotionOrder.objects.filter(order=order, user=self.referral).first()
         ref2 = PromotionOrder.objects.filter(order=order, user=self.user).first()
@@ -144,8 +149,7 @@ class PromotionTest(APITestCase):
 
         order_id = self._make_sell_order(Decimal('7'))
         order = Order.objects.get(id=order_id)
-        order.status = ORDER_STATUS.success
-        order.save(update_fields=['status', ])
+        self._complete_order(order)
 
         ref1 = PromotionOrder.objects.filter(order=order, user=self.referral).first()
         ref2 = PromotionOrder.objects.filter(order=order, user=self.user).first()
@@ -154,8 +158,7 @@ class PromotionTest(APITestCase):
 
         order_id = self._make_sell_order(Decimal('3'))
         order = Order.objects.get(id=order_id)
-        order.status = ORDER_STATUS.success
-        order.save(update_fields=['status', ])
+        self._complete_order(order)
 
         ref1 = PromotionOrder.objects.filter(order=order, user=self.referral).first()
         ref2 = PromotionOrder.objects.filter(order=order, user=self.user).first()
@@ -164,8 +167,7 @@ class PromotionTest(APITestCase):
 
         order_id = self._make_sell_order(Decimal('1'))
         order = Order.objects.get(id=order_id)
-        order.status = ORDER_STATUS.success
-        order.save(update_fields=['status', ])
+        self._complete_order(order)
 
         ref1 = PromotionOrder.objects.filter(order=order, user=self.referral).first()
         ref2 = PromotionOrder.objects.filter(order=order, user=self.user).first()
@@ -178,8 +180,7 @@ class PromotionTest(APITestCase):
         # Not enough for promotion
         order_id = self._make_sell_order(Decimal('7'))
         order = Order.objects.get(id=order_id)
-        order.status = ORDER_STATUS.success
-        order.save(update_fields=['status', ])
+        self._complete_order(order)
         self.assertEqual(order.first_purchase, True)
 
         ref1 = PromotionOrder.objects.filter(order=order, user=self.referral).first()
@@ -190,8 +191,7 @@ class PromotionTest(APITestCase):
         # It's enough for promotion
         order_id = self._make_sell_order(Decimal('3'))
         order = Order.objects.get(id=order_id)
-        order.status = ORDER_STATUS.success
-        order.save(update_fields=['status', ])
+        self._complete_order(order)
         self.assertEqual(order.first_purchase, False)
 
         ref1 = PromotionOrder.objects.filter(order=order, user=self.referral).first()
@@ -202,8 +202,7 @@ class PromotionTest(APITestCase):
         # Only for first time
         order_id = self._make_sell_order(Decimal('1'))
         order = Order.objects.get(id=order_id)
-        order.status = ORDER_STATUS.success
-        order.save(update_fields=['status', ])
+        self._complete_order(order)
         self.assertEqual(order.first_purchase, False)
 
         ref1 = PromotionOrder.objects.filter(order=order, user=self.referral).first()
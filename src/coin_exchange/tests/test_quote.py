@@ -1,19 +1,24 @@
 from decimal import Decimal
-from unittest.mock import MagicMock
+from unittest.mock import MagicMock, patch
 
 from django.contrib.auth.models import User
+from django.core.cache import cache
+from django.test import TestCase, override_settings
 from django.urls import reverse
 from rest_framework import status
 from rest_framework.test import APITestCase
 
 from coin_exchange.constants import FEE_COIN_ORDER_BANK, FEE_COIN_ORDER_COD, FEE_COIN_SELLING_ORDER_BANK, ORDER_TYPE, \
-    FEE_COIN_SELLING_ORDER_COD
+    FEE_COIN_SELLING_ORDER_COD, QUOTE_BATCH_MAX_SIZE
+from coin_exchange.business.quote import Quote, QuoteManagement
 from coin_exchange.factories import PoolFactory, UserLimitFactory
+from coin_system.business import get_fee_version
 from coin_system.constants import FEE_TYPE
 from coin_system.factories import FeeFactory
 from coin_user.factories import ExchangeUserFactory
-from common.business import PriceManagement, RateManagement, CryptoPrice
+from common.business import PriceManagement, RateManagement, CryptoPrice, OrderBook
 from common.constants import CURRENCY, FIAT_CURRENCY, DIRECTION, DIRECTION_ALL
+from common.local_cache import new_cache_version
 from common.tests.utils import AuthenticationUtils
 
 
@@ -61,6 +66,24 @@ class BuyingQuoteTests(APITestCase):
         self.assertEqual(data['fiat_local_amount'], Decimal(2323000), '100 added 1% * 23000')
         self.assertEqual(data['fiat_local_amount_cod'], Decimal(2530000), '100 added 10% * 23000')
 
+    def test_crypto_rate_by_depth(self):
+        PriceManagement.get_cache_price = MagicMock(return_value=CryptoPrice(
+            CURRENCY.ETH,
+            Decimal('100'),
+            Decimal('100'),
+            order_book=OrderBook({'asks': [['100', '1'], ['110', '1']], 'bids': [['100', '1']]}),
+        ))
+        url = reverse('exchange:quote-detail')
+        response = self.client.get(url, data={
+            'amount': '2',
+            'currency': CURRENCY.ETH,
+            'fiat_currency': FIAT_CURRENCY.PHP,
+        }, format='json')
+
+        data = response.json()
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.assertEqual(Decimal(str(data['fiat_amount'])), Decimal('212.1'), 'Average of the 2 ask levels added 1%')
+
     def test_check_pool_limit_success(self):
         url = reverse('exchange:quote-detail')
         response = self.client.get(url, data={
@@ -553,3 +576,126 @@ class SellingQuoteReverseTests(APITestCase):
         })
         token = token_resp.json()['access']
         self.client.credentials(HTTP_AUTHORIZATION='Bearer ' + token)
+
+
+class BatchQuoteTests(APITestCase):
+    def setUp(self):
+        PriceManagement.get_cache_price = MagicMock(return_value=CryptoPrice(
+            CURRENCY.ETH,
+            Decimal('100'),
+            Decimal('90'),
+        ))
+        RateManagement.get_cache_rate = MagicMock(return_value=Decimal('23000'))
+
+        FeeFactory(key=FEE_COIN_ORDER_BANK, value=Decimal('1'), fee_type=FEE_TYPE.percentage)
+        FeeFactory(key=FEE_COIN_ORDER_COD, value=Decimal('10'), fee_type=FEE_TYPE.percentage)
+        FeeFactory(key=FEE_COIN_SELLING_ORDER_BANK, value=Decimal('1'), fee_type=FEE_TYPE.percentage)
+        FeeFactory(key=FEE_COIN_SELLING_ORDER_COD, value=Decimal('1'), fee_type=FEE_TYPE.fixed)
+
+    def test_invalid(self):
+        url = reverse('exchange:quote-batch')
+        response = self.client.post(url, data={'quotes': []}, format='json')
+
+        self.assertEqual(response.status_code, status.HTTP_400_BAD_REQUEST)
+
+    def test_too_many(self):
+        url = reverse('exchange:quote-batch')
+        response = self.client.post(url, data={
+            'quotes': [{'amount': '1', 'currency': CURRENCY.ETH}] * (QUOTE_BATCH_MAX_SIZE + 1),
+        }, format='json')
+
+        self.assertEqual(response.status_code, status.HTTP_400_BAD_REQUEST)
+
+    def test_crypto_rate(self):
+        url = reverse('exchange:quote-batch')
+        response = self.client.post(url, data={
+            'quotes': [
+                {'amount': '1', 'currency': CURRENCY.ETH, 'fiat_currency': FIAT_CURRENCY.PHP},
+                {'amount': '2', 'currency': CURRENCY.BTC, 'fiat_currency': FIAT_CURRENCY.PHP,
+                 'direction': DIRECTION.sell},
+            ]
+        }, format='json')
+
+        data = response.json()
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.assertEqual(len(data), 2)
+        self.assertEqual(data[0]['fiat_amount'], Decimal(101), '100 added 1%')
+        self.assertEqual(data[0]['fiat_amount_cod'], Decimal(110), '100 added 10%')
+        self.assertEqual(data[0]['fiat_local_amount'], Decimal(2323000), '100 added 1% * 23000')
+        self.assertEqual(data[1]['currency'], CURRENCY.BTC)
+        self.assertEqual(Decimal(str(data[1]['fiat_amount'])), Decimal('181.8'), '2 * 90 added 1%')
+        self.assertEqual(data[1]['fiat_amount_cod'], Decimal(181), '2 * 90 added 1 fixed')
+        self.assertEqual(PriceManagement.get_cache_price.call_count, 2, '1 price lookup per currency')
+        self.assertEqual(RateManagement.get_cache_rate.call_count, 1, '1 rate lookup per fiat currency')
+
+
+@override_settings(CACHES={'default': {'BACKEND': 'django.core.cache.backends.locmem.LocMemCache'}})
+class QuoteResponseCacheTests(APITestCase):
+    def setUp(self):
+        cache.clear()
+        PriceManagement.get_cache_price = MagicMock(return_value=CryptoPrice(
+            CURRENCY.ETH,
+            Decimal('100'),
+            Decimal('100'),
+        ))
+        RateManagement.get_cache_rate = MagicMock(return_value=Decimal('23000'))
+
+        FeeFactory(key=FEE_COIN_ORDER_BANK, value=Decimal('1'), fee_type=FEE_TYPE.percentage)
+        FeeFactory(key=FEE_COIN_ORDER_COD, value=Decimal('10'), fee_type=FEE_TYPE.percentage)
+        PoolFactory(currency=CURRENCY.ETH, direction=DIRECTION.buy, usage=1, limit=2)
+
+    def _get_quote(self, **params):
+        url = reverse('exchange:quote-detail')
+        response = self.client.get(url, data=dict({
+            'amount': '1',
+            'currency': CURRENCY.ETH,
+            'fiat_currency': FIAT_CURRENCY.PHP,
+        }, **params), format='json')
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        return response.json()
+
+    def test_cached(self):
+        data = self._get_quote()
+        self.assertEqual(self._get_quote(), data)
+        self.assertEqual(PriceManagement.get_cache_price.call_count, 1, 'Same request is computed once')
+
+        self._get_quote(amount='2')
+        self.assertEqual(PriceManagement.get_cache_price.call_count, 2)
+
+    def test_not_cached_with_check(self):
+        self._get_quote(check='true')
+        self._get_quote(check='true')
+        self.assertEqual(PriceManagement.get_cache_price.call_count, 2)
+
+    def test_new_fee_version(self):
+        self._get_quote()
+        with patch('coin_system.signals.transaction.on_commit', side_effect=lambda func: func()):
+            FeeFactory(key=FEE_COIN_SELLING_ORDER_BANK, value=Decimal('1'), fee_type=FEE_TYPE.percentage)
+        self._get_quote()
+        self.assertEqual(PriceManagement.get_cache_price.call_count, 2, 'Fee change makes a new key')
+
+
+class QuoteObjectTests(TestCase):
+    def test_immutable(self):
+        quote = Quote(amount=Decimal('1'), currency=CURRENCY.ETH, fiat_amount=Decimal('101'))
+        with self.assertRaises(AttributeError):
+            quote.fiat_amount = Decimal('1')
+
+        self.assertEqual(quote.to_dict(['amount', 'fiat_amount']),
+                         {'amount': Decimal('1'), 'fiat_amount': Decimal('101')})
+        self.assertIsNone(quote.fee_cod)
+
+    def test_token_round_trip(self):
+        quote = Quote(amount=Decimal('1'), currency=CURRENCY.ETH, direction=DIRECTION.buy, price=Decimal('100'),
+                      raw_fiat_amount=Decimal('100'), fiat_local_currency=FIAT_CURRENCY.PHP,
+                      fiat_amount=Decimal('101'), fiat_local_amount=Decimal('2323000'), fee=Decimal('1'),
+                      fiat_amount_cod=Decimal('110'), fiat_local_amount_cod=Decimal('2530000'), fee_cod=Decimal('10'))
+        token = QuoteManagement.sign_quote(quote, PriceManagement.get_price_version(), get_fee_version())
+
+        loaded = QuoteManagement.load_quote(token, Decimal('1'), CURRENCY.ETH, DIRECTION.buy, FIAT_CURRENCY.PHP)
+        self.assertEqual(loaded.fiat_amount, Decimal('101'))
+        self.assertEqual(loaded.fee_cod, Decimal('10'))
+
+        with patch('coin_exchange.business.quote.get_fee_version', return_value=new_cache_version()):
+            self.assertIsNone(QuoteManagement.load_quote(token, Decimal('1'), CURRENCY.ETH, DIRECTION.buy,
+                                                         FIAT_CURRENCY.PHP), 'Fees changed since the quote')
@@ -2,7 +2,7 @@ from decimal import Decimal
 from unittest.mock import MagicMock
 
 from django.urls import reverse
-from rest_framework.test import APITestCase
+from rest_framework.test import APITransactionTestCase
 
 from coin_exchange.constants import FEE_COIN_ORDER_COD, ORDER_TYPE, FEE_COIN_ORDER_BANK, FEE_COIN_SELLING_ORDER_BANK, \
     FEE_COIN_SELLING_ORDER_COD, ORDER_STATUS
@@ -15,7 +15,7 @@ from common.constants import CURRENCY, DIRECTION, DIRECTION_ALL, FIAT_CURRENCY
 from common.tests.utils import AuthenticationUtils
 
 
-class ReferralTest(APITestCase):
+class ReferralTest(APITransactionTestCase):
     def setUp(self):
         self.buy_rate = self.sell_rate = Decimal('100')
         self.fiat_rate = Decimal('1')
@@ -43,6 +43,16 @@ class ReferralTest(APITestCase):
         UserLimitFactory(fiat_currency=self.user.currency, direction=DIRECTION_ALL, usage=0, limit=5000,
                          user=self.user)
 
+    def _complete_order(self, order: Order):
+        # Through the statuses of a completed order
+        if order.direction == DIRECTION.buy:
+            statuses = [ORDER_STATUS.processing, ORDER_STATUS.transferring, ORDER_STATUS.success]
+        else:
+            statuses = [ORDER_STATUS.transferred, ORDER_STATUS.processing, ORDER_STATUS.success]
+        for status in statuses:
+            order.status = status
+            order.save(update_fields=['status', ])
+
     def _make_buy_order(self, amount: Decimal):
         url = reverse('exchange:order-list')
         response = self.client.post(url, data={
@@ -78,8 +88,7 @@ class ReferralTest(APITestCase):
 
         order_id = self._make_buy_order(Decimal('10'))
         order = Order.objects.get(id=order_id)
-        order.status = ORDER_STATUS.success
-        order.save(update_fields=['status', ])
+        self._complete_order(order)
 
         ref1 = ReferralOrder.objects.filter(order=order, user=self.referral).first()
         ref2 = ReferralOrder.objects.filter(order=order, user=self.user).first()
@@ -92,8 +101,7 @@ class ReferralTest(APITestCase):
 
         order_id = self._make_sell_order(Decimal('10'))
         order = Order.objects.get(id=order_id)
-        order.status = ORDER_STATUS.success
-        order.save(update_fields=['status', ])
+        self._complete_order(order)
 
         ref1 = ReferralOrder.objects.filter(order=order, user=self.referral).first()
         ref2 = ReferralOrder.objects.filter(order=order, user=self.user).first()
@@ -106,8 +114,7 @@ class ReferralTest(APITestCase):
 
         order_id = self._make_sell_order(Decimal('10'))
         order = Order.objects.get(id=order_id)
-        order.status = ORDER_STATUS.success
-        order.save(update_fields=['status', ])
+        self._complete_order(order)
 
         ref1 = ReferralOrder.objects.filter(order=order, user=self.referral).first()
         ref2 = ReferralOrder.objects.filter(order=order, user=self.user).first()
@@ -4,9 +4,9 @@ from rest_framework.routers import DefaultRouter
 from coin_exchange.resource import ReviewViewSet, OrderViewSet, ReferralOrderViewSet, PromotionOrderViewSet
 from coin_exchange.views import QuoteView, QuoteReverseView, AddressView, ExpireOrderView, DepositedAddressView, \
     TrackingAddressView, TrackingAddressDetailView, TrackingTransactionView, TrackingTransactionDetailView, \
-    ResetUserLimitView, TrackingBitstampTransactionView, PayReferralOrderView, \
+    ResetUserLimitView, TrackingBitstampTransactionView, TrackingBlockView, TrackingTokenView, PayReferralOrderView, \
     TrackingBitstampReferralTransactionView, TrackingFundTransactionView, TrackingInFundView, TrackingOutFundView, \
-    CurrencyView
+    CurrencyView, QuoteBatchView, FlushLimitCounterView
 
 router = DefaultRouter()
 router.register('reviews', ReviewViewSet)
@@ -17,6 +17,7 @@ router.register('promotions', PromotionOrderViewSet)
 patterns = ([
     path('', include(router.urls)),
     path('quote/', QuoteView.as_view(), name='quote-detail'),
+    path('quote/batch/', QuoteBatchView.as_view(), name='quote-batch'),
     path('quote-reverse/', QuoteReverseView.as_view(), name='quote-reverse-detail'),
     path('addresses/', AddressView.as_view(), name='address-list'),
     path('deposited-address/', DepositedAddressView.as_view(), name='deposited-address-view'),
@@ -24,6 +25,7 @@ patterns = ([
 
     path('expire-order/', ExpireOrderView.as_view(), name='expire-order-view'),
     path('reset-user-limit/', ResetUserLimitView.as_view(), name='reset-user-limit-view'),
+    path('flush-limit-counter/', FlushLimitCounterView.as_view(), name='flush-limit-counter-view'),
     path('tracking-addresses/', TrackingAddressView.as_view(),
          name='tracking-address-list'),
     path('tracking-transactions/', TrackingTransactionView.as_view(),
@@ -32,6 +34,10 @@ patterns = ([
          name='tracking-address-detail'),
     path('tracking-transactions/<int:pk>/', TrackingTransactionDetailView.as_view(),
          name='tracking-transaction-detail'),
+    path('tracking-blocks/', TrackingBlockView.as_view(),
+         name='tracking-block-list'),
+    path('tracking-tokens/', TrackingTokenView.as_view(),
+         name='tracking-token-list'),
     path('tracking-bitstamp-transactions/', TrackingBitstampTransactionView.as_view(),
          name='tracking-bitstamp-transaction-list'),
     path('pay-referral-order/', PayReferralOrderView.as_view(), name='pay-referral-order-view'),
@@ -8,12 +8,15 @@ from rest_framework.response import Response
 from rest_framework.views import APIView
 from rest_framework_simplejwt.authentication import JWTAuthentication
 
-from coin_exchange.business.crypto import AddressManagement, TrackingManagement
+from coin_exchange.business.crypto import AddressManagement, TrackingManagement, BlockScanManagement, \
+    TokenDepositManagement
 from coin_exchange.business.fund import FundManagement
+from coin_exchange.business.limit_counter import LimitCounterManagement
 from coin_exchange.business.order import OrderManagement
 from coin_exchange.business.quote import QuoteManagement
 from coin_exchange.business.referral import ReferralManagement
-from common.business import view_serializer_fields
+from coin_system.business import get_fee_version
+from common.business import PriceManagement
 from common.constants import SUPPORT_CURRENCIES
 from common.exceptions import InvalidInputDataException
 
@@ -35,30 +38,60 @@ class QuoteView(APIView):
     authentication_classes = (JWTAuthentication, TokenAuthentication)
 
     def get(self, request, format=None):
-        serializer = QuoteManagement.get_quote(request.user, request.query_params)
+        return Response(QuoteManagement.get_cached_response(
+            'quote', ['amount', 'currency', 'fiat_currency', 'direction'], request.query_params,
+            lambda: self.get_quote(request),
+        ))
+
+    @staticmethod
+    def get_quote(request) -> dict:
+        # Read the versions before pricing, a newer price or fee only makes the token unusable
+        price_version = PriceManagement.get_price_version()
+        fee_version = get_fee_version()
+        quote = QuoteManagement.get_quote(request.user, request.query_params)
         view_fields = ['amount', 'currency', 'fiat_currency', 'direction', 'fiat_local_currency',
                        'fiat_amount', 'fiat_local_amount',
                        'fiat_amount_cod', 'fiat_local_amount_cod']
 
-        return Response(view_serializer_fields(view_fields, serializer.validated_data))
+        data = quote.to_dict(view_fields)
+        data['quote_token'] = QuoteManagement.sign_quote(quote, price_version, fee_version)
+        return data
+
+
+class QuoteBatchView(APIView):
+    authentication_classes = (JWTAuthentication, TokenAuthentication)
+
+    def post(self, request, format=None):
+        return Response(QuoteManagement.get_quotes(request.data))
 
 
 class QuoteReverseView(APIView):
     authentication_classes = (JWTAuthentication, TokenAuthentication)
 
     def get(self, request, format=None):
-        serializer = QuoteManagement.get_quote_reverse(request.user, request.query_params)
+        return Response(QuoteManagement.get_cached_response(
+            'quote-reverse', ['fiat_amount', 'currency', 'fiat_currency', 'direction', 'type'], request.query_params,
+            lambda: self.get_quote_reverse(request),
+        ))
+
+    @staticmethod
+    def get_quote_reverse(request) -> dict:
+        quote = QuoteManagement.get_quote_reverse(request.user, request.query_params)
         view_fields = ['amount', 'currency', 'fiat_currency', 'direction', 'fiat_local_currency',
                        'fiat_amount', 'fiat_local_amount',
                        ]
 
-        return Response(view_serializer_fields(view_fields, serializer.validated_data))
+        return quote.to_dict(view_fields)
 
 
 class ExpireOrderView(APIView):
     def post(self, request, format=None):
-        OrderManagement.expire_order()
-        return Response()
+        return Response(OrderManagement.expire_order())
+
+
+class FlushLimitCounterView(APIView):
+    def post(self, request, format=None):
+        return Response(LimitCounterManagement.flush())
 
 
 class ResetUserLimitView(APIView):
@@ -88,8 +121,7 @@ class CurrencyView(APIView):
 
 class TrackingAddressView(APIView):
     def post(self, request, format=None):
-        TrackingManagement.load_tracking_address()
-        return Response()
+        return Response(TrackingManagement.load_tracking_address())
 
 
 class TrackingAddressDetailView(APIView):
@@ -100,8 +132,7 @@ class TrackingAddressDetailView(APIView):
 
 class TrackingTransactionView(APIView):
     def post(self, request, format=None):
-        TrackingManagement.load_tracking_transaction()
-        return Response()
+        return Response(TrackingManagement.load_tracking_transaction())
 
 
 class TrackingTransactionDetailView(APIView):
@@ -110,6 +141,22 @@ class TrackingTransactionDetailView(APIView):
         return Response()
 
 
+class TrackingBlockView(APIView):
+    def post(self, request, format=None):
+        result = {}
+        for curr in SUPPORT_CURRENCIES:
+            try:
+                result[curr] = BlockScanManagement.scan(curr)
+            except Exception as ex:
+                logging.exception(ex)
+        return Response(result)
+
+
+class TrackingTokenView(APIView):
+    def post(self, request, format=None):
+        return Response(TokenDepositManagement.scan())
+
+
 class TrackingBitstampTransactionView(APIView):
     def post(self, request, format=None):
         OrderManagement.load_transferring_order_to_track()
@@ -4,3 +4,6 @@ from django.apps import AppConfig
 class CoinSystemAppConfig(AppConfig):
     name = "coin_system"
     verbose_name = '4. System'
+
+    def ready(self):
+        from . import signals  # noqa
@@ -1,9 +1,23 @@
+import logging
+from concurrent.futures import ThreadPoolExecutor
 from decimal import Decimal, ROUND_CEILING
+from typing import List
 
-from coin_system.constants import CACHE_KEY_CONFIG, CACHE_KEY_FEE, CACHE_KEY_COUNTRY_DEFAULT, FEE_TYPE
+from django.core.cache import cache
+
+from coin_system.constants import CACHE_KEY_CONFIG, CACHE_KEY_FEE, CACHE_KEY_COUNTRY_DEFAULT, FEE_TYPE, \
+    CACHE_KEY_FEE_VERSION, CACHE_KEY_FEE_SCHEDULE, CONFIG_VERSION_CHECK_INTERVAL, CACHE_KEY_COMPARE_PRICE_STATE, \
+    CACHE_KEY_COMPARE_PRICE_ALERT, CONFIG_COMPARE_PRICE_ALERT_THRESHOLD, CONFIG_COMPARE_PRICE_CLEAR_THRESHOLD, \
+    COMPARE_PRICE_ALERT_THRESHOLD, COMPARE_PRICE_CLEAR_THRESHOLD, COMPARE_PRICE_ALERT_WINDOW, FEE_SCHEDULE_TTL
 from coin_system.models import Config, Fee, CountryDefaultConfig
+from common.constants import PRICE_REFRESH_MAX_WORKERS
 from common.decorators import raise_api_exception, cache_first
 from common.exceptions import UnexpectedException, InvalidDataException
+from common.local_cache import VersionedLocalCache, new_cache_version
+from integration import bitstamp, coincap
+
+# Fee schedule of this worker, compiled again when any fee changes
+fee_local_cache = VersionedLocalCache(CACHE_KEY_FEE_VERSION, CONFIG_VERSION_CHECK_INTERVAL, FEE_SCHEDULE_TTL)
 
 
 @raise_api_exception(UnexpectedException)
@@ -27,28 +41,82 @@ def get_country_default(key: str) -> CountryDefaultConfig:
     return obj
 
 
-def markup_fee(amount: Decimal, fee_key: str) -> (Decimal, Decimal):
-    fee = get_fee(fee_key)
-    value = fee.value
-    if fee.fee_type == FEE_TYPE.fixed:
-        return amount + value, value
-    elif fee.fee_type == FEE_TYPE.percentage:
-        added_fee = (amount * value) / Decimal('100')
-        return amount + added_fee, added_fee
+class CompiledFee(object):
+    __slots__ = ('key', 'fee_type', 'value', 'rate', 'multiplier')
 
-    raise InvalidDataException
+    def __init__(self, fee: Fee):
+        self.key = fee.key
+        self.fee_type = fee.fee_type
+        self.value = fee.value
+        self.rate = fee.value / Decimal('100')
+        self.multiplier = Decimal(1) + self.rate
 
 
-def remove_markup_fee(amount: Decimal, fee_key: str) -> (Decimal, Decimal):
-    fee = get_fee(fee_key)
-    value = fee.value
-    if fee.fee_type == FEE_TYPE.fixed:
-        return amount - value, value
-    elif fee.fee_type == FEE_TYPE.percentage:
-        removed_fee = amount / (Decimal(1) + value / Decimal('100'))
-        return removed_fee, amount - removed_fee
+class FeeSchedule(object):
+    """
+    All fees compiled once, percentage fees carry their precomputed multipliers.
+    """
+    __slots__ = ('_fees',)
+
+    def __init__(self, fees):
+        self._fees = {fee.key: CompiledFee(fee) for fee in fees}
+
+    @staticmethod
+    def load():
+        return FeeSchedule(Fee.objects.all())
+
+    def get(self, fee_key: str) -> CompiledFee:
+        try:
+            return self._fees[fee_key]
+        except KeyError:
+            raise UnexpectedException
+
+    def markup(self, amount: Decimal, fee_key: str) -> (Decimal, Decimal):
+        fee = self.get(fee_key)
+        if fee.fee_type == FEE_TYPE.fixed:
+            return amount + fee.value, fee.value
+        elif fee.fee_type == FEE_TYPE.percentage:
+            added_fee = amount * fee.rate
+            return amount + added_fee, added_fee
+
+        raise InvalidDataException
+
+    def remove_markup(self, amount: Decimal, fee_key: str) -> (Decimal, Decimal):
+        fee = self.get(fee_key)
+        if fee.fee_type == FEE_TYPE.fixed:
+            return amount - fee.value, fee.value
+        elif fee.fee_type == FEE_TYPE.percentage:
+            removed_fee = amount / fee.multiplier
+            return removed_fee, amount - removed_fee
+
+        raise InvalidDataException
+
 
-    raise InvalidDataException
+def get_fee_schedule() -> FeeSchedule:
+    return fee_local_cache.get_or_load(CACHE_KEY_FEE_SCHEDULE, FeeSchedule.load)
+
+
+def get_fee_version():
+    return fee_local_cache.version
+
+
+def reset_fee_schedule(fee_key: str = None):
+    """
+    Called once a Fee change is committed, by the Fee signals.
+    Fee.objects.update() and bulk_create() send no signal, call it after them.
+    """
+    if fee_key:
+        cache.delete(CACHE_KEY_FEE.format(fee_key))
+    cache.set(CACHE_KEY_FEE_VERSION, new_cache_version(), timeout=None)
+    fee_local_cache.clear()
+
+
+def markup_fee(amount: Decimal, fee_key: str) -> (Decimal, Decimal):
+    return get_fee_schedule().markup(amount, fee_key)
+
+
+def remove_markup_fee(amount: Decimal, fee_key: str) -> (Decimal, Decimal):
+    return get_fee_schedule().remove_markup(amount, fee_key)
 
 
 def round_currency(amount: Decimal) -> Decimal:
@@ -57,3 +125,61 @@ def round_currency(amount: Decimal) -> Decimal:
 
 def round_crypto_currency(amount: Decimal) -> Decimal:
     return amount.quantize(Decimal('.000001'), ROUND_CEILING)
+
+
+def get_config_decimal(key: str, default: Decimal) -> Decimal:
+    # An optional config, a missing row is not an error
+    value = Config.objects.filter(pk=key).values_list('value', flat=True).first()
+    return Decimal(value) if value is not None else default
+
+
+class ComparePriceManagement(object):
+    @staticmethod
+    def fetch_prices(currencies: List[str]) -> list:
+        # Our price and the reference rate of all currencies at the same time
+        with ThreadPoolExecutor(max_workers=min(len(currencies) * 2, PRICE_REFRESH_MAX_WORKERS)) as executor:
+            futures = [(currency,
+                        executor.submit(bitstamp.get_price, currency),
+                        executor.submit(coincap.get_rate, coincap.CURRENCY_IDS[currency]))
+                       for currency in currencies]
+
+            result = []
+            for currency, price_future, rate_future in futures:
+                try:
+                    result.append((currency, Decimal(price_future.result()), rate_future.result()))
+                except Exception as e:
+                    logging.exception(e)
+
+        return result
+
+    @staticmethod
+    def compare_prices(currencies: List[str]) -> (list, list):
+        """
+        Rates too far from our prices, and those of them to send an alert for.
+        """
+        if not currencies:
+            return [], []
+
+        alert_threshold = get_config_decimal(CONFIG_COMPARE_PRICE_ALERT_THRESHOLD, COMPARE_PRICE_ALERT_THRESHOLD)
+        clear_threshold = get_config_decimal(CONFIG_COMPARE_PRICE_CLEAR_THRESHOLD, COMPARE_PRICE_CLEAR_THRESHOLD)
+
+        result = []
+        alerts = []
+        for currency, price, rate in ComparePriceManagement.fetch_prices(currencies):
+            diff = (price - rate['rateUsd']) / rate['rateUsd'] * Decimal('100')
+            state_key = CACHE_KEY_COMPARE_PRICE_STATE.format(currency)
+            alert_key = CACHE_KEY_COMPARE_PRICE_ALERT.format(currency)
+            active = cache.get(state_key)
+
+            # Once raised, the alert stays until the difference goes under the clear threshold
+            if diff >= alert_threshold or (active and diff >= clear_threshold):
+                if not active:
+                    cache.set(state_key, True, timeout=None)
+                # Only the 1st run in the window alerts
+                if cache.add(alert_key, True, timeout=COMPARE_PRICE_ALERT_WINDOW):
+                    alerts.append(rate)
+                result.append(rate)
+            elif active:
+                cache.delete_many([state_key, alert_key])
+
+        return result, alerts
@@ -1,3 +1,5 @@
+from decimal import Decimal
+
 from model_utils import Choices
 
 FEE_TYPE = Choices(
@@ -5,9 +7,24 @@ FEE_TYPE = Choices(
     ('percentage', 'Percentage'),
 )
 
+CONFIG_VERSION_CHECK_INTERVAL = 5  # in second
+FEE_SCHEDULE_TTL = 5 * 60  # in second
+
 CACHE_KEY_CONFIG = 'system_config.{}'
 CACHE_KEY_FEE = 'system_fee.{}'
+CACHE_KEY_FEE_VERSION = 'system_fee_version'
+CACHE_KEY_FEE_SCHEDULE = 'system_fee_schedule'
 CACHE_KEY_COUNTRY_DEFAULT = 'system_country_default.{}'
 CACHE_KEY_SYSTEM_NOTIFICATION = 'system_notification.{}'
 CACHE_KEY_SYSTEM_REMINDER = 'system_reminder.{}'
 CACHE_KEY_BONUS = 'system_bonus.{}'
+CACHE_KEY_COMPARE_PRICE_STATE = 'system_compare_price_state.{}'
+CACHE_KEY_COMPARE_PRICE_ALERT = 'system_compare_price_alert.{}'
+
+# Alert when our price is over the reference by the alert threshold,
+# the alert is cleared only once the difference goes under the clear threshold
+CONFIG_COMPARE_PRICE_ALERT_THRESHOLD = 'COMPARE_PRICE_ALERT_THRESHOLD'
+CONFIG_COMPARE_PRICE_CLEAR_THRESHOLD = 'COMPARE_PRICE_CLEAR_THRESHOLD'
+COMPARE_PRICE_ALERT_THRESHOLD = Decimal('0')  # in %
+COMPARE_PRICE_CLEAR_THRESHOLD = Decimal('-0.5')  # in %
+COMPARE_PRICE_ALERT_WINDOW = 60 * 60  # 1 alert per currency per hour at most
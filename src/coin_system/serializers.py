@@ -2,6 +2,7 @@ from rest_framework import serializers
 
 from coin_system.models import Bank, PopularPlace, CountryCurrency, CountryDefaultConfig, LandingPageContact, \
     PopularBank
+from common.constants import SUPPORT_CURRENCIES, PRICE_CANDLE_INTERVALS
 
 
 class BankSerializer(serializers.ModelSerializer):
@@ -38,3 +39,9 @@ class ContactSerializer(serializers.ModelSerializer):
     class Meta:
         model = LandingPageContact
         fields = '__all__'
+
+
+class PriceCandleInputSerializer(serializers.Serializer):
+    currency = serializers.ChoiceField(choices=SUPPORT_CURRENCIES)
+    interval = serializers.ChoiceField(choices=PRICE_CANDLE_INTERVALS, default=60 * 60)
+    since = serializers.IntegerField(required=False, min_value=0)
@@ -0,0 +1,14 @@
+from django.db import transaction
+from django.db.models.signals import post_save, post_delete
+from django.dispatch import receiver
+
+from coin_system.business import reset_fee_schedule
+from coin_system.models import Fee
+
+
+@receiver(post_save, sender=Fee)
+@receiver(post_delete, sender=Fee)
+def post_change_fee(sender, **kwargs):
+    # Workers reading the new version before the commit would load the old fees
+    fee = kwargs['instance']
+    transaction.on_commit(lambda: reset_fee_schedule(fee.key))
@@ -1,17 +1,22 @@
 from decimal import Decimal
-from unittest.mock import MagicMock
+from unittest.mock import MagicMock, patch
 
-from django.test import TestCase
+from django.core.cache import cache
+from django.test import TestCase, override_settings
 from django.urls import reverse
 from rest_framework import status
 from rest_framework.test import APITestCase
 
-from coin_system.business import get_config, get_fee, get_country_default
+from coin_system.business import get_config, get_fee, get_country_default, get_fee_schedule, markup_fee, \
+    ComparePriceManagement
+from coin_system.constants import FEE_TYPE, CONFIG_COMPARE_PRICE_ALERT_THRESHOLD
 from coin_system.factories import ConfigFactory, FeeFactory, BankFactory, PopularPlaceFactory, CountryCurrencyFactory, \
     CountryDefaultConfigFactory
-from coin_system.models import Config
+from coin_system.models import Config, Fee
 from common.business import PriceManagement, CryptoPrice, RateManagement
 from common.constants import VALUE_TYPE, COUNTRY, FIAT_CURRENCY, CURRENCY
+from common.exceptions import UnexpectedException
+from common.price_history import PriceHistory
 
 
 class ConfigValueTypeTest(TestCase):
@@ -81,6 +86,41 @@ class GetterTests(TestCase):
         self.assertEqual(FIAT_CURRENCY.PHP, config2.currency)
 
 
+class FeeScheduleTests(TestCase):
+    def setUp(self):
+        FeeFactory(key='PERCENTAGE', value=Decimal('1'), fee_type=FEE_TYPE.percentage)
+        FeeFactory(key='FIXED', value=Decimal('5'), fee_type=FEE_TYPE.fixed)
+
+    def test_markup(self):
+        schedule = get_fee_schedule()
+        self.assertEqual(schedule.markup(Decimal('100'), 'PERCENTAGE'), (Decimal('101'), Decimal('1')))
+        self.assertEqual(schedule.markup(Decimal('100'), 'FIXED'), (Decimal('105'), Decimal('5')))
+
+    def test_remove_markup(self):
+        schedule = get_fee_schedule()
+        self.assertEqual(schedule.remove_markup(Decimal('101'), 'PERCENTAGE'), (Decimal('100'), Decimal('1')))
+        self.assertEqual(schedule.remove_markup(Decimal('105'), 'FIXED'), (Decimal('100'), Decimal('5')))
+
+    def test_missing_fee(self):
+        with self.assertRaises(UnexpectedException):
+            get_fee_schedule().markup(Decimal('100'), 'MISSING')
+
+    def test_fee_changed(self):
+        self.assertEqual(markup_fee(Decimal('100'), 'PERCENTAGE'), (Decimal('101'), Decimal('1')))
+
+        fee = Fee.objects.get(pk='PERCENTAGE')
+        fee.value = Decimal('2')
+        callbacks = []
+        with patch('coin_system.signals.transaction.on_commit', side_effect=callbacks.append):
+            fee.save()
+        self.assertEqual(markup_fee(Decimal('100'), 'PERCENTAGE'), (Decimal('101'), Decimal('1')),
+                         'Reset once committed')
+
+        for callback in callbacks:
+            callback()
+        self.assertEqual(markup_fee(Decimal('100'), 'PERCENTAGE'), (Decimal('102'), Decimal('2')))
+
+
 class BankTests(APITestCase):
     def setUp(self):
         BankFactory(active=True, country='US', currency='USD')
@@ -157,12 +197,17 @@ class PopularPlaceTests(APITestCase):
 
 class SetupData(APITestCase):
     def setUp(self):
-        PriceManagement.save_cache_price = MagicMock(return_value=CryptoPrice(
-            CURRENCY.ETH,
-            Decimal('100'),
-            Decimal('100'),
-        ))
-        RateManagement.save_rates = MagicMock(return_value=None)
+        patchers = [
+            patch.object(PriceManagement, 'save_cache_prices', MagicMock(return_value=[CryptoPrice(
+                CURRENCY.ETH,
+                Decimal('100'),
+                Decimal('100'),
+            )])),
+            patch.object(RateManagement, 'save_rates', MagicMock(return_value=None)),
+        ]
+        for patcher in patchers:
+            patcher.start()
+            self.addCleanup(patcher.stop)
 
     def test_save_rates(self):
         url = reverse('system:currency-rates')
@@ -175,3 +220,83 @@ class SetupData(APITestCase):
         response = self.client.post(url, format='json')
 
         self.assertEqual(response.status_code, status.HTTP_200_OK)
+
+
+class CryptoRateCandleTests(APITestCase):
+    def setUp(self):
+        history = PriceHistory(10)
+        for timestamp, price in [(0, 100), (30, 110), (60, 90), (90, 95)]:
+            history.append(timestamp, price)
+
+        patcher = patch('common.business.price_local_cache.get', return_value=history)
+        patcher.start()
+        self.addCleanup(patcher.stop)
+
+    def test_get_candles(self):
+        url = reverse('system:crypto-rate-candles')
+        response = self.client.get(url, data={'currency': CURRENCY.ETH, 'interval': 60}, format='json')
+
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.assertEqual(response.json(), [
+            {'time': 0, 'open': 100, 'high': 110, 'low': 100, 'close': 110},
+            {'time': 60, 'open': 90, 'high': 95, 'low': 90, 'close': 95},
+        ])
+
+    def test_invalid_interval(self):
+        url = reverse('system:crypto-rate-candles')
+        response = self.client.get(url, data={'currency': CURRENCY.ETH, 'interval': 7}, format='json')
+
+        self.assertEqual(response.status_code, status.HTTP_400_BAD_REQUEST)
+
+
+@override_settings(CACHES={'default': {'BACKEND': 'django.core.cache.backends.locmem.LocMemCache'}})
+class ComparePriceTests(TestCase):
+    def setUp(self):
+        cache.clear()
+
+    def _patch_prices(self, price: str):
+        patcher = patch('coin_system.business.bitstamp.get_price', return_value=price)
+        patcher.start()
+        self.addCleanup(patcher.stop)
+        patcher = patch('coin_system.business.coincap.get_rate',
+                        return_value={'symbol': CURRENCY.ETH, 'rateUsd': Decimal('100')})
+        patcher.start()
+        self.addCleanup(patcher.stop)
+
+    def _compare(self, price: str):
+        self._patch_prices(price)
+        return ComparePriceManagement.compare_prices([CURRENCY.ETH])
+
+    def test_alert_once(self):
+        result, alerts = self._compare('101')
+        self.assertEqual((len(result), len(alerts)), (1, 1))
+        result, alerts = self._compare('102')
+        self.assertEqual((len(result), len(alerts)), (1, 0), 'Alert once per window')
+
+    def test_hysteresis(self):
+        self._compare('101')
+        result, _ = self._compare('99.8')
+        self.assertEqual(len(result), 1, 'Still over the clear threshold')
+        result, _ = self._compare('99')
+        self.assertEqual(len(result), 0)
+
+        _, alerts = self._compare('101')
+        self.assertEqual(len(alerts), 1, 'Alert again after it was cleared')
+
+    def test_no_alert(self):
+        self.assertEqual(self._compare('99.8'), ([], []))
+
+    def test_config_threshold(self):
+        Config.objects.create(key=CONFIG_COMPARE_PRICE_ALERT_THRESHOLD, value='2', value_type=VALUE_TYPE.decimal)
+        self.assertEqual(self._compare('101'), ([], []))
+
+    def test_view_sends_alert(self):
+        self._patch_prices('101')
+        with patch('coin_system.views.SUPPORT_CURRENCIES', [CURRENCY.ETH]), \
+                patch('coin_system.views.ComparePriceNotification.send_new_compare_price_notification') as notify:
+            response = self.client.get(reverse('system:compare-price'), format='json')
+            self.client.get(reverse('system:compare-price'), format='json')
+
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.assertEqual(len(response.json()), 1)
+        self.assertEqual(notify.call_count, 1)
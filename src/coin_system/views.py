@@ -1,17 +1,15 @@
 # from django.utils.decorators import method_decorator
 # from django.views.decorators.cache import cache_page
-from decimal import Decimal
-
 from rest_framework.response import Response
 from rest_framework.views import APIView
 
 from coin_exchange.constants import CONFIG_USER_LIMIT
+from coin_system.business import ComparePriceManagement
 from coin_system.models import Config
+from coin_system.serializers import PriceCandleInputSerializer
 from common.business import PriceManagement, RateManagement
-from common.constants import SUPPORT_CURRENCIES, LANGUAGE, CURRENCY
-from integration import coincap
+from common.constants import SUPPORT_CURRENCIES, LANGUAGE
 from notification.business import ComparePriceNotification
-from integration.bitstamp import get_price
 
 
 class CurrencyRateView(APIView):
@@ -34,12 +32,21 @@ class CryptoRateView(APIView):
         return Response(result)
 
     def post(self, request, format=None):
-        for currency in SUPPORT_CURRENCIES:
-            PriceManagement.save_cache_price(currency)
+        PriceManagement.save_cache_prices(SUPPORT_CURRENCIES)
 
         return Response(True)
 
 
+class CryptoRateCandleView(APIView):
+    def get(self, request, format=None):
+        serializer = PriceCandleInputSerializer(data=request.query_params)
+        serializer.is_valid(raise_exception=True)
+        safe_data = serializer.validated_data
+
+        return Response(PriceManagement.get_price_candles(safe_data['currency'], safe_data['interval'],
+                                                          safe_data.get('since')))
+
+
 class CurrencyLevelLimitView(APIView):
     # @method_decorator(cache_page(5 * 60))
     def get(self, request, format=None):
@@ -65,15 +72,8 @@ class LanguageView(APIView):
 
 class ComparePrice(APIView):
     def get(self, request, format=None):
-        result = []
-        coins = [
-            (CURRENCY.BTC, 'bitcoin'),
-            (CURRENCY.ETH, 'ethereum')
-        ]
-        for currency in coins:
-            price = coincap.get_rate(currency[1])
-            if Decimal(get_price(currency[0])) >= price['rateUsd']:
-                ComparePriceNotification.send_new_compare_price_notification(price)
-                result.append(price)
+        result, alerts = ComparePriceManagement.compare_prices(SUPPORT_CURRENCIES)
+        for rate in alerts:
+            ComparePriceNotification.send_new_compare_price_notification(rate)
 
         return Response(result)
@@ -1,32 +1,20 @@
-import logging
-
 import simplejson
 
-import requests
-from django.conf import settings
-from requests import Timeout
-
 from coin_user.models import ExchangeUser
 from common.business import get_now
+from notification.business import NotificationOutboxManagement
+from notification.constants import NOTIFICATION_OUTBOX_KIND
 
 
 class UserVerificationManagement(object):
     @staticmethod
     def send_user_verification_request(user: ExchangeUser):
-        if settings.UNIT_TEST:
-            return
-
-        url = settings.NOTIFICATION_API + '/user-verification-notification/'
-        try:
-            requests.post(url, json={
-                'level': user.verification_level,
-                'id': user.id,
-                'name': user.name,
-            }, headers={'Content-type': 'application/json'}, timeout=200)
-        except Timeout:
-            pass
-        except Exception as ex:
-            logging.error(ex)
+        # Sent by the outbox worker
+        NotificationOutboxManagement.add(NOTIFICATION_OUTBOX_KIND.user_verification, {
+            'level': user.verification_level,
+            'id': user.id,
+            'name': user.name,
+        })
 
 
 class UserWalletManagement(object):
@@ -1,42 +1,351 @@
+from array import array
+from bisect import bisect_left
+from concurrent.futures import ThreadPoolExecutor, TimeoutError
+from decimal import Decimal
+import logging
 import random
+import statistics
 import string
-from decimal import Decimal
-from typing import List
+import time
+from typing import Dict, List
 
 import pyotp
 from django.core.cache import cache
 from django.utils import timezone
 from rest_framework.permissions import BasePermission
 
-from common.constants import CACHE_KEY_CRYPTO_RATE_CURRENCY_BY_EXCHANGE, CACHE_KEY_CURRENCY_RATE, EXCHANGE_SITE
+from common.constants import CACHE_KEY_CRYPTO_RATE_CURRENCY_BY_EXCHANGE, CACHE_KEY_CURRENCY_RATE, EXCHANGE_SITE, \
+    PRICE_REFRESH_MAX_WORKERS, CACHE_KEY_PRICE_VERSION, PRICE_VERSION_CHECK_INTERVAL, SUPPORT_FIAT_CURRENCIES, \
+    RATE_CHANGE_EPSILON, CACHE_KEY_RATE_VERSION, PRICE_SOURCES, PRICE_SOURCE_METHOD, PRICE_SOURCE_MAX_AGE, \
+    PRICE_SOURCE_OUTLIER_THRESHOLD, PRICE_REFERENCE_METHOD, ORDER_BOOK_DEPTH_LEVELS, DIRECTION, \
+    CACHE_KEY_PRICE_HISTORY, PRICE_HISTORY_SIZE
 from common.exceptions import InvalidDataException
-from integration.bitstamp import get_buy_price, get_sell_price
+from common.local_cache import VersionedLocalCache, new_cache_version
+from common.price_history import PriceHistory
+from integration import binance, bitstamp, coinbase, coincap
+from integration.exceptions import ExternalAPIException
 from integration.openexchangerates import get_rates
 
+# Prices and rates of this worker, refreshed when the refresher bumps the price version
+price_local_cache = VersionedLocalCache(CACHE_KEY_PRICE_VERSION, PRICE_VERSION_CHECK_INTERVAL)
+
+
+class PriceSource(object):
+    __slots__ = ('exchange', 'buy', 'sell', 'timestamp')
+
+    def __init__(self, exchange: str, buy: Decimal, sell: Decimal, timestamp: float = None):
+        self.exchange = exchange
+        self.buy = buy
+        self.sell = sell
+        # Time of the price at the venue, fetch time if the venue does not tell
+        self.timestamp = timestamp if timestamp is not None else time.time()
+
+    @property
+    def mid(self) -> Decimal:
+        return (self.buy + self.sell) / 2
+
+    def __repr__(self):
+        return '<PriceSource {} {}/{}>'.format(self.exchange, self.buy, self.sell)
+
+
+def to_decimal(value: float) -> Decimal:
+    # Shortest repr of the double, Decimal(value) would carry its binary noise
+    return Decimal(repr(value))
+
+
+class OrderBookDepth(object):
+    """
+    1 side of an order book, best level first, kept as cumulative amount and cost arrays of doubles
+    so the cached book stays small and the average price of any size is found by bisect.
+    """
+    __slots__ = ('prices', 'amounts', 'costs')
+
+    def __init__(self, levels: list):
+        self.prices = array('d')
+        self.amounts = array('d')
+        self.costs = array('d')
+
+        total_amount = total_cost = 0.0
+        for price, amount in levels[:ORDER_BOOK_DEPTH_LEVELS]:
+            price, amount = float(price), float(amount)
+            total_amount += amount
+            total_cost += price * amount
+            self.prices.append(price)
+            self.amounts.append(total_amount)
+            self.costs.append(total_cost)
+
+    def __bool__(self):
+        return bool(self.prices)
+
+    @property
+    def best(self) -> Decimal:
+        return to_decimal(self.prices[0])
+
+    def _level(self, totals: array, total: float):
+        # Level which fills the total, over the depth the rest is filled at the last level
+        i = min(bisect_left(totals, total), len(totals) - 1)
+        if i == 0:
+            return i, 0.0, 0.0
+        return i, self.amounts[i - 1], self.costs[i - 1]
+
+    def average_price(self, amount: Decimal) -> Decimal:
+        if amount <= 0:
+            return self.best
+        amount = float(amount)
+        i, prev_amount, prev_cost = self._level(self.amounts, amount)
+        return to_decimal((prev_cost + (amount - prev_amount) * self.prices[i]) / amount)
+
+    def average_price_by_cost(self, cost: Decimal) -> Decimal:
+        if cost <= 0:
+            return self.best
+        cost = float(cost)
+        i, prev_amount, prev_cost = self._level(self.costs, cost)
+        return to_decimal(cost / (prev_amount + (cost - prev_cost) / self.prices[i]))
+
+
+class OrderBook(object):
+    __slots__ = ('asks', 'bids')
+
+    def __init__(self, data: dict):
+        self.asks = OrderBookDepth(data.get('asks', []))
+        self.bids = OrderBookDepth(data.get('bids', []))
+
+    def slippage(self, direction: str, amount: Decimal = None, cost: Decimal = None) -> Decimal:
+        """
+        Ratio between the average price of the size and the top of the book, 1 if the size is unknown.
+        Buying takes the asks, selling takes the bids.
+        """
+        depth = self.asks if direction == DIRECTION.buy else self.bids
+        if not depth:
+            return Decimal(1)
+        if amount is not None:
+            return depth.average_price(amount) / depth.best
+        if cost is not None:
+            return depth.average_price_by_cost(cost) / depth.best
+        return Decimal(1)
+
 
 class CryptoPrice(object):
-    def __init__(self, currency: str, buy: Decimal, sell: Decimal):
+    def __init__(self, currency: str, buy: Decimal, sell: Decimal, sources: List[PriceSource] = None,
+                 order_book: OrderBook = None):
         self.currency = currency
         self.buy = buy
         self.sell = sell
+        self.sources = sources or []
+        self.order_book = order_book
+
+    @property
+    def mid(self) -> Decimal:
+        return (self.buy + self.sell) / 2
+
+    def get_price(self, direction: str, amount: Decimal = None, cost: Decimal = None) -> Decimal:
+        # Reference price moved by the depth of the order book for the size
+        price = self.buy if direction == DIRECTION.buy else self.sell
+        order_book = getattr(self, 'order_book', None)
+        if order_book:
+            price = price * order_book.slippage(direction, amount, cost)
+        return price
+
+    @property
+    def exchanges(self) -> List[str]:
+        return [source.exchange for source in self.sources]
+
+
+def _fetch_bitstamp(currency: str) -> PriceSource:
+    ticker = bitstamp.get_ticker(currency)
+    timestamp = float(ticker['timestamp']) if ticker.get('timestamp') else None
+    return PriceSource(EXCHANGE_SITE.bitstamp, Decimal(ticker['ask']), Decimal(ticker['bid']), timestamp)
+
+
+def _fetch_coinbase(currency: str) -> PriceSource:
+    return PriceSource(EXCHANGE_SITE.coinbase,
+                       Decimal(coinbase.get_buy_price(currency)),
+                       Decimal(coinbase.get_sell_price(currency)))
+
+
+def _fetch_binance(currency: str) -> PriceSource:
+    ticker = binance.get_ticker(currency)
+    return PriceSource(EXCHANGE_SITE.binance, Decimal(ticker['askPrice']), Decimal(ticker['bidPrice']))
+
+
+def _fetch_coincap(currency: str) -> PriceSource:
+    # CoinCap only gives a reference rate, no bid/ask
+    rate = coincap.get_price(currency)
+    return PriceSource(EXCHANGE_SITE.coincap, rate, rate)
+
+
+PRICE_FETCHERS = {
+    EXCHANGE_SITE.bitstamp: _fetch_bitstamp,
+    EXCHANGE_SITE.coinbase: _fetch_coinbase,
+    EXCHANGE_SITE.binance: _fetch_binance,
+    EXCHANGE_SITE.coincap: _fetch_coincap,
+}
+
+
+class PriceAggregator(object):
+    """
+    Query all the venues concurrently and build 1 reference price per currency.
+    A venue which does not answer before its deadline, is stale or is too far from the others is left out.
+    """
+
+    def __init__(self, sources: list = None, method: str = None, max_age: int = None,
+                 outlier_threshold: Decimal = None):
+        self.sources = sources if sources is not None else PRICE_SOURCES
+        self.method = method or PRICE_SOURCE_METHOD
+        self.max_age = max_age if max_age is not None else PRICE_SOURCE_MAX_AGE
+        self.outlier_threshold = outlier_threshold if outlier_threshold is not None \
+            else PRICE_SOURCE_OUTLIER_THRESHOLD
+
+    def fetch(self, currencies: List[str]) -> Dict[str, List[PriceSource]]:
+        result = {currency: [] for currency in currencies}
+        jobs = [(currency, exchange, deadline) for currency in currencies for exchange, deadline in self.sources]
+        if not jobs:
+            return result
+
+        executor = ThreadPoolExecutor(max_workers=min(len(jobs), PRICE_REFRESH_MAX_WORKERS))
+        try:
+            start = time.monotonic()
+            futures = [(currency, exchange, deadline, executor.submit(PRICE_FETCHERS[exchange], currency))
+                       for currency, exchange, deadline in jobs]
+            # Collect by deadline, so a slow venue is only waited for until its own deadline
+            for currency, exchange, deadline, future in sorted(futures, key=lambda item: item[2]):
+                try:
+                    result[currency].append(future.result(timeout=max(deadline - (time.monotonic() - start), 0)))
+                except TimeoutError:
+                    future.cancel()
+                    logging.warning('Price source %s timeout for %s', exchange, currency)
+                except Exception as e:
+                    logging.exception(e)
+        finally:
+            # Do not wait for the slow venues, their result is dropped anyway
+            executor.shutdown(wait=False)
+
+        return result
+
+    def filter_sources(self, sources: List[PriceSource]) -> List[PriceSource]:
+        now = time.time()
+        sources = [source for source in sources
+                   if now - source.timestamp <= self.max_age and source.buy > 0 and source.sell > 0]
+        if len(sources) < 3:
+            # Not enough sources to tell which one is wrong
+            return sources
+
+        median = statistics.median([source.mid for source in sources])
+        return [source for source in sources
+                if abs(source.mid - median) / median * 100 <= self.outlier_threshold]
+
+    def aggregate(self, currency: str, sources: List[PriceSource]) -> CryptoPrice:
+        sources = self.filter_sources(sources)
+        if not sources:
+            raise ExternalAPIException('No price source for {}'.format(currency))
+
+        if self.method == PRICE_REFERENCE_METHOD.best:
+            buy = min(source.buy for source in sources)
+            sell = max(source.sell for source in sources)
+        else:
+            buy = statistics.median([source.buy for source in sources])
+            sell = statistics.median([source.sell for source in sources])
+
+        return CryptoPrice(currency, buy, sell, sources)
+
+    def get_price(self, currency: str) -> CryptoPrice:
+        return self.aggregate(currency, self.fetch([currency])[currency])
+
+    def get_prices(self, currencies: List[str]) -> List[CryptoPrice]:
+        """
+        Prices of the currencies with a usable source, the others are left out and keep their last price.
+        """
+        sources = self.fetch(currencies)
+        result = []
+        for currency in currencies:
+            try:
+                result.append(self.aggregate(currency, sources[currency]))
+            except ExternalAPIException:
+                logging.warning('No price source for %s, keep its last price', currency)
+
+        return result
 
 
 class PriceManagement(object):
+    @staticmethod
+    def get_price(currency: str) -> CryptoPrice:
+        return PriceAggregator().get_price(currency)
+
+    @staticmethod
+    def get_order_book(currency: str) -> OrderBook:
+        return OrderBook(bitstamp.get_order_book(currency))
+
     @staticmethod
     def save_cache_price(currency: str) -> CryptoPrice:
-        buy_price = get_buy_price(currency)
-        sell_price = get_sell_price(currency)
+        coin_prices = PriceManagement.save_cache_prices([currency])
+        if not coin_prices:
+            raise ExternalAPIException('No price source for {}'.format(currency))
 
-        coin_price = CryptoPrice(currency, Decimal(buy_price), Decimal(sell_price))
+        return coin_prices[0]
 
-        cache.set(CACHE_KEY_CRYPTO_RATE_CURRENCY_BY_EXCHANGE.format(currency, EXCHANGE_SITE.bitstamp),
-                  coin_price, timeout=None)
+    @staticmethod
+    def save_cache_prices(currencies: List[str]) -> List[CryptoPrice]:
+        if not currencies:
+            return []
+
+        # All venues of all currencies are fetched in parallel, the order books along with them
+        with ThreadPoolExecutor(max_workers=min(len(currencies), PRICE_REFRESH_MAX_WORKERS)) as executor:
+            order_books = {currency: executor.submit(PriceManagement.get_order_book, currency)
+                           for currency in currencies}
+            coin_prices = PriceAggregator().get_prices(currencies)
+
+            for coin_price in coin_prices:
+                try:
+                    coin_price.order_book = order_books[coin_price.currency].result()
+                except Exception as e:
+                    # Quote at the reference price without the book
+                    logging.exception(e)
+
+        if not coin_prices:
+            # Nothing new, the readers keep the last prices
+            return coin_prices
+
+        # Keep the reference price under the bitstamp key, the readers do not change
+        data = {
+            CACHE_KEY_CRYPTO_RATE_CURRENCY_BY_EXCHANGE.format(coin_price.currency, EXCHANGE_SITE.bitstamp): coin_price
+            for coin_price in coin_prices
+        }
+        data.update(PriceManagement.append_price_history(coin_prices))
+        data[CACHE_KEY_PRICE_VERSION] = new_cache_version()
+        cache.set_many(data, timeout=None)
+
+        return coin_prices
+
+    @staticmethod
+    def append_price_history(coin_prices: List[CryptoPrice]) -> dict:
+        # The refresher is the only writer of the history, readers get it with the new price version
+        keys = [CACHE_KEY_PRICE_HISTORY.format(coin_price.currency) for coin_price in coin_prices]
+        histories = cache.get_many(keys)
+        now = int(time.time())
+
+        data = {}
+        for key, coin_price in zip(keys, coin_prices):
+            history = histories.get(key) or PriceHistory(PRICE_HISTORY_SIZE)
+            history.append(now, float(coin_price.mid))
+            data[key] = history
 
-        return coin_price
+        return data
+
+    @staticmethod
+    def get_price_candles(currency: str, interval: int, since: int = None) -> list:
+        history = price_local_cache.get(CACHE_KEY_PRICE_HISTORY.format(currency))
+        if not history:
+            return []
+        return history.candles(interval, since)
+
+    @staticmethod
+    def get_price_version():
+        return price_local_cache.version
 
     @staticmethod
     def get_cache_price(currency: str) -> CryptoPrice:
-        data = cache.get(CACHE_KEY_CRYPTO_RATE_CURRENCY_BY_EXCHANGE.format(currency, EXCHANGE_SITE.bitstamp))
+        key = CACHE_KEY_CRYPTO_RATE_CURRENCY_BY_EXCHANGE.format(currency, EXCHANGE_SITE.bitstamp)
+        data = price_local_cache.get(key)
         if not data:
             raise InvalidDataException
         return data
@@ -44,15 +353,30 @@ class PriceManagement(object):
 
 class RateManagement(object):
     @staticmethod
-    def save_rates():
-        rates = get_rates()
-        for rate in rates:
-            cache.set(CACHE_KEY_CURRENCY_RATE.format(rate['currency']), rate['value'],
-                      timeout=None)
+    def save_rates() -> dict:
+        rates = {rate['currency']: rate['value'] for rate in get_rates(SUPPORT_FIAT_CURRENCIES)
+                 if rate['currency'] in SUPPORT_FIAT_CURRENCIES}
+        keys = {currency: CACHE_KEY_CURRENCY_RATE.format(currency) for currency in rates}
+        current_rates = cache.get_many(keys.values())
+
+        # Only write the rates which really changed, so the workers keep their local cache
+        data = {}
+        for currency, value in rates.items():
+            current_value = current_rates.get(keys[currency])
+            if not current_value or abs(value - current_value) / current_value > RATE_CHANGE_EPSILON:
+                data[keys[currency]] = value
+
+        if data:
+            version = new_cache_version()
+            data[CACHE_KEY_RATE_VERSION] = version
+            data[CACHE_KEY_PRICE_VERSION] = version
+            cache.set_many(data, timeout=None)
+
+        return {currency: value for currency, value in rates.items() if keys[currency] in data}
 
     @staticmethod
     def get_cache_rate(currency: str) -> Decimal:
-        data = cache.get(CACHE_KEY_CURRENCY_RATE.format(currency))
+        data = price_local_cache.get(CACHE_KEY_CURRENCY_RATE.format(currency))
         if not data:
             raise InvalidDataException
         return data
@@ -1,3 +1,5 @@
+from decimal import Decimal
+
 from model_utils import Choices
 
 VALUE_TYPE = Choices(
@@ -56,8 +58,37 @@ EXCHANGE_SITE = Choices(
     ('coinbase', 'Coinbase'),
     ('bitstamp', 'BitStamp'),
     ('binance', 'Binance'),
+    ('coincap', 'CoinCap'),
+)
+
+PRICE_REFERENCE_METHOD = Choices(
+    ('median', 'Median'),
+    ('best', 'Best bid/ask'),
 )
 
+# Venue and its deadline in second
+PRICE_SOURCES = [
+    (EXCHANGE_SITE.bitstamp, 3),
+    (EXCHANGE_SITE.coinbase, 3),
+    (EXCHANGE_SITE.binance, 3),
+    (EXCHANGE_SITE.coincap, 3),
+]
+PRICE_SOURCE_METHOD = PRICE_REFERENCE_METHOD.median
+PRICE_SOURCE_MAX_AGE = 60  # in second
+PRICE_SOURCE_OUTLIER_THRESHOLD = Decimal('2')  # 2% from median
+
+ORDER_BOOK_DEPTH_LEVELS = 100
+
+PRICE_HISTORY_SIZE = 7 * 24 * 60  # 1 week of 1 minute refresh
+PRICE_CANDLE_INTERVALS = [60, 5 * 60, 15 * 60, 60 * 60, 4 * 60 * 60, 24 * 60 * 60]  # in second
+
+PRICE_REFRESH_MAX_WORKERS = 16
+PRICE_VERSION_CHECK_INTERVAL = 1  # in second
+RATE_CHANGE_EPSILON = Decimal('0.0001')  # 0.01%
+
 CACHE_KEY_CRYPTO_RATE_CURRENCY_BY_EXCHANGE = 'crypto_rates.{}_{}'
 CACHE_KEY_CURRENCY_RATE = 'currency_rates.{}'
+CACHE_KEY_PRICE_VERSION = 'price_version'
+CACHE_KEY_PRICE_HISTORY = 'price_history.{}'
+CACHE_KEY_RATE_VERSION = 'currency_rates_version'
 CACHE_KEY_FORGOT_PASSWORD = 'forgot_password.{}'
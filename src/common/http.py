@@ -1,5 +1,5 @@
 from rest_framework import status
-from rest_framework.pagination import PageNumberPagination
+from rest_framework.pagination import PageNumberPagination, CursorPagination
 from rest_framework.response import Response
 from rest_framework.views import exception_handler
 
@@ -9,6 +9,15 @@ class StandardPagination(PageNumberPagination):
     max_page_size = 1000
 
 
+class StandardCursorPagination(CursorPagination):
+    # Keyset pages, no COUNT and no OFFSET, each page costs the same however deep it is.
+    # Lists using it need an index ending with (created_at, id).
+    page_size = 100
+    page_size_query_param = 'page_size'
+    max_page_size = 1000
+    ordering = ('-created_at', '-id')
+
+
 class SuccessResponse(Response):
     def __init__(self, data=None, code=None, message=None, default_status=None,
                  template_name=None, headers=None,
@@ -0,0 +1,110 @@
+import threading
+import time
+from concurrent.futures import Future
+
+from django.core.cache import cache
+
+
+def new_cache_version() -> int:
+    return int(time.time() * 1000)
+
+
+class VersionedLocalCache(object):
+    """
+    In-process copy of values stored in the shared cache.
+
+    Values are kept in memory until the version key in the shared cache changes, or for ttl seconds at most.
+    The version key itself is read at most once per check_interval seconds.
+    """
+
+    def __init__(self, version_key: str, check_interval: float, ttl: float = None):
+        self.version_key = version_key
+        self.check_interval = check_interval
+        self.ttl = ttl
+        self._lock = threading.Lock()
+        self._data = {}
+        self._version = None
+        self._checked_at = None
+        self._cleared_at = time.monotonic()
+
+    @property
+    def version(self):
+        self._sync_version()
+        return self._version
+
+    def get(self, key: str):
+        self._sync_version()
+        data = self._data.get(key)
+        if data is None:
+            data = cache.get(key)
+            if data is not None:
+                self._data[key] = data
+
+        return data
+
+    def get_or_load(self, key: str, loader):
+        # Keep the loaded value in memory only, it is loaded again once the version changes
+        self._sync_version()
+        data = self._data.get(key)
+        if data is None:
+            data = loader()
+            self._data[key] = data
+
+        return data
+
+    def clear(self):
+        with self._lock:
+            self._data = {}
+            self._version = None
+            self._checked_at = None
+            self._cleared_at = time.monotonic()
+
+    def _sync_version(self):
+        now = time.monotonic()
+        if self.ttl is not None and now - self._cleared_at >= self.ttl:
+            # A value loaded from rows not committed yet could be kept under the new version, drop it anyway
+            with self._lock:
+                self._data = {}
+                self._cleared_at = now
+
+        if self._checked_at is not None and now - self._checked_at < self.check_interval:
+            return
+
+        version = cache.get(self.version_key)
+        with self._lock:
+            if version != self._version:
+                self._data = {}
+                self._cleared_at = now
+                self._version = version
+            self._checked_at = now
+
+
+class SingleFlight(object):
+    """
+    Concurrent calls with the same key in this process run the loader once and share its result.
+    """
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._calls = {}
+
+    def do(self, key: str, loader):
+        with self._lock:
+            call = self._calls.get(key)
+            leader = call is None
+            if leader:
+                call = self._calls[key] = Future()
+
+        if not leader:
+            return call.result()
+
+        try:
+            result = loader()
+            call.set_result(result)
+            return result
+        except Exception as e:
+            call.set_exception(e)
+            raise
+        finally:
+            with self._lock:
+                del self._calls[key]
@@ -0,0 +1,69 @@
+from array import array
+from bisect import bisect_left
+
+
+class PriceHistory(object):
+    """
+    Fixed size ring buffer of (timestamp, price) kept in 2 compact arrays.
+
+    The arrays grow until size, then the oldest slot is overwritten.
+    Timestamps are in second and only increasing timestamps are appended.
+    """
+    __slots__ = ('size', 'timestamps', 'prices', 'head')
+
+    def __init__(self, size: int):
+        self.size = size
+        self.timestamps = array('L')
+        self.prices = array('d')
+        # Oldest slot once the buffer is full
+        self.head = 0
+
+    def __len__(self):
+        return len(self.timestamps)
+
+    @property
+    def last_timestamp(self):
+        if not self.timestamps:
+            return None
+        return self.timestamps[self.head - 1]
+
+    def append(self, timestamp: int, price: float):
+        last_timestamp = self.last_timestamp
+        if last_timestamp is not None and timestamp <= last_timestamp:
+            return
+
+        if len(self.timestamps) < self.size:
+            self.timestamps.append(timestamp)
+            self.prices.append(price)
+        else:
+            self.timestamps[self.head] = timestamp
+            self.prices[self.head] = price
+            self.head = (self.head + 1) % self.size
+
+    def ordered(self):
+        # Oldest first
+        if not self.head:
+            return self.timestamps, self.prices
+        return self.timestamps[self.head:] + self.timestamps[:self.head], \
+            self.prices[self.head:] + self.prices[:self.head]
+
+    def candles(self, interval: int, since: int = None) -> list:
+        timestamps, prices = self.ordered()
+        i = bisect_left(timestamps, since) if since else 0
+
+        # 1 bisect per candle to find its end, open/high/low/close are taken on the array slice
+        result = []
+        while i < len(timestamps):
+            start = timestamps[i] - timestamps[i] % interval
+            end = bisect_left(timestamps, start + interval, i)
+            window = prices[i:end]
+            result.append({
+                'time': start,
+                'open': window[0],
+                'high': max(window),
+                'low': min(window),
+                'close': window[-1],
+            })
+            i = end
+
+        return result
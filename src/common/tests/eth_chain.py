@@ -0,0 +1,34 @@
+from web3 import Web3
+from web3.providers.eth_tester import EthereumTesterProvider
+
+from integration.ethereum import ERC20_ABI, TRANSFER_TOPIC
+
+# Runtime code of a token whose transfer(address,uint256) only emits Transfer(caller, to, value):
+# mstore(0, calldataload(0x24)) log3(0, 0x20, TRANSFER_TOPIC, caller, calldataload(0x04)) stop
+TOKEN_RUNTIME = '602435600052600435337f' + TRANSFER_TOPIC[2:] + '60206000a300'
+# Copies the runtime code after it and returns it
+TOKEN_INIT = '60{:02x}80600b6000396000f3'.format(len(TOKEN_RUNTIME) // 2)
+
+
+class EthTesterChain(object):
+    """
+    In memory chain of eth-tester, a block is mined per transaction.
+    """
+
+    def __init__(self):
+        self.w3 = Web3(EthereumTesterProvider())
+        self.account = self.w3.eth.accounts[0]
+
+    def deploy_token(self) -> str:
+        tx_hash = self.w3.eth.sendTransaction({'from': self.account, 'data': '0x' + TOKEN_INIT + TOKEN_RUNTIME,
+                                               'gas': 200000})
+        return self.w3.eth.getTransactionReceipt(tx_hash).contractAddress
+
+    def transfer(self, contract: str, to_address: str, value: int) -> str:
+        erc20 = self.w3.eth.contract(address=contract, abi=ERC20_ABI)
+        tx_hash = erc20.functions.transfer(Web3.toChecksumAddress(to_address), value) \
+            .transact({'from': self.account})
+        return tx_hash.hex()
+
+    def mine(self, blocks: int):
+        self.w3.testing.mine(blocks)
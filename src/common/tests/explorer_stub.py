@@ -0,0 +1,84 @@
+import threading
+import time
+from http.server import HTTPServer, BaseHTTPRequestHandler
+from urllib.parse import urlparse, parse_qs
+
+import simplejson
+
+
+class ExplorerStubServer(object):
+    """
+    Local HTTP server answering the insight (/btc) and etherscan (/eth) calls used by the explorer adapters.
+    btc: {address: {'balance': float, 'txs': [txid]}}, eth: {address: {'balance': wei, 'txs': [hash]}}
+    """
+
+    def __init__(self, btc: dict = None, eth: dict = None):
+        self.btc = btc or {}
+        self.eth = eth or {}
+        self.paths = []
+        # Seconds before answering
+        self.delay = 0
+        self.server = HTTPServer(('127.0.0.1', 0), self._make_handler())
+        self.thread = threading.Thread(target=self.server.serve_forever, daemon=True)
+
+    @property
+    def url(self) -> str:
+        return 'http://127.0.0.1:{}'.format(self.server.server_port)
+
+    def start(self):
+        self.thread.start()
+
+    def stop(self):
+        self.server.shutdown()
+        self.server.server_close()
+
+    def btc_response(self, path: str, query: dict):
+        # /btc/addrs/<addresses>/utxo or /btc/addrs/<addresses>/txs
+        addrs, kind = path.split('/')[3:]
+        addresses = [address for address in addrs.split(',') if address in self.btc]
+        if kind == 'utxo':
+            return [{'address': address, 'amount': self.btc[address]['balance'], 'confirmations': 6}
+                    for address in addresses if self.btc[address]['balance']]
+
+        items = [{'txid': txid, 'vin': [], 'vout': [{'scriptPubKey': {'addresses': [address]}}]}
+                 for address in addresses for txid in self.btc[address]['txs']]
+        start, end = int(query['from'][0]), int(query['to'][0])
+        return {'totalItems': len(items), 'from': start, 'to': end, 'items': items[start:end]}
+
+    def eth_response(self, query: dict):
+        action = query['action'][0]
+        if action == 'balancemulti':
+            addresses = query['address'][0].split(',')
+            if any(address not in self.eth for address in addresses):
+                return {'status': '0', 'message': 'NOTOK', 'result': 'Error! Invalid address format'}
+            return {'status': '1', 'result': [{'account': address, 'balance': str(self.eth[address]['balance'])}
+                                              for address in addresses]}
+        if action == 'txlist':
+            address = query['address'][0]
+            return {'status': '1', 'result': [{'hash': tx_hash} for tx_hash in self.eth[address]['txs']]}
+
+    def _make_handler(self):
+        stub = self
+
+        class Handler(BaseHTTPRequestHandler):
+            def do_GET(self):
+                url = urlparse(self.path)
+                stub.paths.append(self.path)
+                time.sleep(stub.delay)
+                query = parse_qs(url.query)
+                if url.path.startswith('/btc/'):
+                    data = stub.btc_response(url.path, query)
+                else:
+                    data = stub.eth_response(query)
+
+                body = simplejson.dumps(data).encode()
+                self.send_response(200)
+                self.send_header('Content-Type', 'application/json')
+                self.send_header('Content-Length', str(len(body)))
+                self.end_headers()
+                self.wfile.write(body)
+
+            def log_message(self, *args):
+                pass
+
+        return Handler
@@ -0,0 +1,64 @@
+from decimal import Decimal
+from unittest.mock import patch
+
+from django.test import SimpleTestCase, override_settings
+
+from common.constants import CURRENCY
+from common.tests.explorer_stub import ExplorerStubServer
+from integration import explorer, bitpay, etherscan
+from integration.exceptions import ExternalAPIException
+
+
+class ExplorerTests(SimpleTestCase):
+    def setUp(self):
+        self.stub = ExplorerStubServer(
+            btc={
+                'btc1': {'balance': 0.5, 'txs': ['tx1', 'tx2']},
+                'btc2': {'balance': 0, 'txs': ['tx3']},
+                'btc3': {'balance': 1, 'txs': []},
+            },
+            eth={
+                '0xeth1': {'balance': 10 ** 18, 'txs': ['0xtx1']},
+                '0xeth2': {'balance': 0, 'txs': ['0xtx2']},
+            },
+        )
+        self.stub.start()
+        self.addCleanup(self.stub.stop)
+
+        settings = override_settings(BITPAY_BTC={'URL': self.stub.url + '/btc'},
+                                     ETHERSCAN={'URL': self.stub.url + '/eth', 'API_KEY': ''})
+        settings.enable()
+        self.addCleanup(settings.disable)
+
+    def test_btc(self):
+        with patch.dict(explorer.ADDRESS_BATCH_SIZE, {CURRENCY.BTC: 2}), \
+                patch.object(bitpay, 'BTC_TX_PAGE_SIZE', 2):
+            addr_objs = explorer.get_addresses(CURRENCY.BTC, ['btc1', 'btc2', 'btc3'])
+
+        self.assertEqual(addr_objs['btc1'].balance, Decimal('0.5'))
+        self.assertEqual(addr_objs['btc1'].tx_hashes, ['tx1', 'tx2'])
+        self.assertEqual(addr_objs['btc2'].tx_hashes, ['tx3'])
+        self.assertEqual(addr_objs['btc3'].balance, Decimal('1'))
+        self.assertEqual(addr_objs['btc3'].tx_hashes, [])
+        # 2 chunks, the 1st one has 2 pages of transactions
+        self.assertEqual(len(self.stub.paths), 5)
+
+    def test_eth(self):
+        addr_objs = explorer.get_addresses(CURRENCY.ETH, ['0xeth1', '0xeth2'])
+
+        self.assertEqual(addr_objs['0xeth1'].balance, Decimal('1'))
+        self.assertEqual(addr_objs['0xeth1'].tx_hashes, ['0xtx1'])
+        self.assertEqual(addr_objs['0xeth2'].balance, Decimal('0'))
+        self.assertEqual(addr_objs['0xeth2'].tx_hashes, ['0xtx2'], 'Listed without a balance')
+        self.assertEqual(len(self.stub.paths), 3)
+
+    def test_eth_error(self):
+        with self.assertRaises(ExternalAPIException):
+            explorer.get_addresses(CURRENCY.ETH, ['0xeth1', 'invalid'])
+
+    def test_timeout(self):
+        self.stub.delay = 0.5
+        with patch.object(bitpay, 'REQUEST_TIMEOUT', 0.1), self.assertRaises(ExternalAPIException):
+            explorer.get_addresses(CURRENCY.BTC, ['btc1'])
+        with patch.object(etherscan, 'REQUEST_TIMEOUT', 0.1), self.assertRaises(ExternalAPIException):
+            explorer.get_addresses(CURRENCY.ETH, ['0xeth1'])
@@ -0,0 +1,87 @@
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+from django.core.cache import cache
+from django.test import TestCase, override_settings
+
+from common.local_cache import VersionedLocalCache, SingleFlight
+
+LOCAL_CACHES = {
+    'default': {
+        'BACKEND': 'django.core.cache.backends.locmem.LocMemCache',
+    }
+}
+
+
+@override_settings(CACHES=LOCAL_CACHES)
+class VersionedLocalCacheTests(TestCase):
+    def setUp(self):
+        cache.clear()
+        cache.set('version', 1)
+        cache.set('key', 'value 1')
+
+    def test_keep_value_until_version_changed(self):
+        local_cache = VersionedLocalCache('version', 0)
+        self.assertEqual(local_cache.get('key'), 'value 1')
+
+        cache.set('key', 'value 2')
+        self.assertEqual(local_cache.get('key'), 'value 1', 'Same version, read from memory')
+
+        cache.set('version', 2)
+        self.assertEqual(local_cache.get('key'), 'value 2', 'New version, read from shared cache')
+        self.assertEqual(local_cache.version, 2)
+
+    def test_check_version_by_interval(self):
+        local_cache = VersionedLocalCache('version', 60)
+        self.assertEqual(local_cache.get('key'), 'value 1')
+
+        cache.set('version', 2)
+        cache.set('key', 'value 2')
+        self.assertEqual(local_cache.get('key'), 'value 1', 'Version is not checked again yet')
+
+        local_cache.clear()
+        self.assertEqual(local_cache.get('key'), 'value 2')
+
+    def test_expire_value(self):
+        local_cache = VersionedLocalCache('version', 60, ttl=0)
+        self.assertEqual(local_cache.get('key'), 'value 1')
+
+        cache.set('key', 'value 2')
+        self.assertEqual(local_cache.get('key'), 'value 2', 'Same version, expired in memory')
+
+    def test_missing_value(self):
+        local_cache = VersionedLocalCache('version', 0)
+        self.assertIsNone(local_cache.get('missing'))
+
+
+class SingleFlightTests(TestCase):
+    def test_coalesce_concurrent_calls(self):
+        single_flight = SingleFlight()
+        started = threading.Event()
+        calls = []
+
+        def loader():
+            calls.append(1)
+            started.set()
+            time.sleep(0.2)
+            return 'value'
+
+        with ThreadPoolExecutor(max_workers=3) as executor:
+            first = executor.submit(single_flight.do, 'key', loader)
+            started.wait()
+            others = [executor.submit(single_flight.do, 'key', loader) for _ in range(2)]
+            results = [first.result()] + [future.result() for future in others]
+
+        self.assertEqual(results, ['value'] * 3)
+        self.assertEqual(len(calls), 1)
+
+    def test_share_error(self):
+        single_flight = SingleFlight()
+
+        def loader():
+            raise ValueError
+
+        with self.assertRaises(ValueError):
+            single_flight.do('key', loader)
+        self.assertEqual(single_flight.do('key', lambda: 'value'), 'value', 'Failed call is not kept')
@@ -0,0 +1,193 @@
+import time
+from decimal import Decimal
+from unittest.mock import MagicMock, patch
+
+from django.core.cache import cache
+from django.test import TestCase, override_settings
+
+from common.business import PriceManagement, RateManagement, PriceAggregator, PriceSource, PRICE_FETCHERS, \
+    CryptoPrice, OrderBook
+from common.constants import CURRENCY, FIAT_CURRENCY, CACHE_KEY_CURRENCY_RATE, CACHE_KEY_RATE_VERSION, EXCHANGE_SITE, \
+    PRICE_REFERENCE_METHOD, DIRECTION, CACHE_KEY_CRYPTO_RATE_CURRENCY_BY_EXCHANGE
+from integration.exceptions import ExternalAPIException
+
+
+def fake_fetcher(buy: str, sell: str, delay: float = 0, age: int = 0):
+    def fetch(currency: str):
+        if delay:
+            time.sleep(delay)
+        return PriceSource('fake', Decimal(buy), Decimal(sell), time.time() - age)
+    return fetch
+
+
+ORDER_BOOK = {
+    'asks': [['100', '1'], ['110', '2'], ['120', '3']],
+    'bids': [['99', '1'], ['90', '2']],
+}
+
+
+class OrderBookTests(TestCase):
+    def setUp(self):
+        self.order_book = OrderBook(ORDER_BOOK)
+
+    def test_average_price(self):
+        asks = self.order_book.asks
+        self.assertEqual(asks.average_price(Decimal('0.5')), Decimal('100'))
+        self.assertEqual(asks.average_price(Decimal('1')), Decimal('100'))
+        self.assertEqual(asks.average_price(Decimal('2')), Decimal('105'))
+        # Over the depth, the rest is filled at the last level
+        self.assertEqual(asks.average_price(Decimal('10')), Decimal('116'))
+
+    def test_average_price_by_cost(self):
+        asks = self.order_book.asks
+        self.assertEqual(asks.average_price_by_cost(Decimal('50')), Decimal('100'))
+        self.assertEqual(asks.average_price_by_cost(Decimal('210')), Decimal('105'))
+
+    def test_get_price(self):
+        price = CryptoPrice(CURRENCY.ETH, Decimal('200'), Decimal('198'), order_book=self.order_book)
+        self.assertEqual(price.get_price(DIRECTION.buy), Decimal('200'))
+        self.assertEqual(price.get_price(DIRECTION.buy, amount=Decimal('1')), Decimal('200'))
+        self.assertEqual(price.get_price(DIRECTION.buy, amount=Decimal('2')), Decimal('210'))
+        self.assertEqual(price.get_price(DIRECTION.sell, amount=Decimal('3')), Decimal('186'))
+        self.assertEqual(price.get_price(DIRECTION.buy, cost=Decimal('210')), Decimal('210'))
+
+
+class PriceRefreshTests(TestCase):
+    def test_save_cache_prices(self):
+        fetcher = MagicMock(side_effect=fake_fetcher('101', '99'))
+        with patch.dict(PRICE_FETCHERS, {EXCHANGE_SITE.bitstamp: fetcher}), \
+                patch('common.business.PRICE_SOURCES', [(EXCHANGE_SITE.bitstamp, 1)]), \
+                patch('common.business.bitstamp.get_order_book', return_value=ORDER_BOOK):
+            prices = PriceManagement.save_cache_prices([CURRENCY.ETH, CURRENCY.BTC])
+
+        self.assertEqual(fetcher.call_count, 2, '1 request per currency and venue')
+        self.assertEqual([price.currency for price in prices], [CURRENCY.ETH, CURRENCY.BTC])
+        self.assertEqual(prices[0].buy, Decimal('101'))
+        self.assertEqual(prices[0].sell, Decimal('99'))
+        self.assertEqual(prices[0].order_book.asks.best, Decimal('100'))
+
+    def test_save_cache_prices_without_order_book(self):
+        with patch.dict(PRICE_FETCHERS, {EXCHANGE_SITE.bitstamp: fake_fetcher('101', '99')}), \
+                patch('common.business.PRICE_SOURCES', [(EXCHANGE_SITE.bitstamp, 1)]), \
+                patch('common.business.bitstamp.get_order_book', side_effect=ExternalAPIException):
+            prices = PriceManagement.save_cache_prices([CURRENCY.ETH])
+
+        self.assertIsNone(prices[0].order_book)
+        self.assertEqual(prices[0].get_price(DIRECTION.buy, amount=Decimal('100')), Decimal('101'))
+
+    @override_settings(CACHES={'default': {'BACKEND': 'django.core.cache.backends.locmem.LocMemCache'}})
+    def test_keep_last_price(self):
+        cache.clear()
+
+        def fetch(currency: str):
+            if currency == CURRENCY.BTC:
+                raise ExternalAPIException
+            return fake_fetcher('101', '99')(currency)
+
+        btc_key = CACHE_KEY_CRYPTO_RATE_CURRENCY_BY_EXCHANGE.format(CURRENCY.BTC, EXCHANGE_SITE.bitstamp)
+        eth_key = CACHE_KEY_CRYPTO_RATE_CURRENCY_BY_EXCHANGE.format(CURRENCY.ETH, EXCHANGE_SITE.bitstamp)
+        cache.set(btc_key, CryptoPrice(CURRENCY.BTC, Decimal('5000'), Decimal('4900')))
+        with patch.dict(PRICE_FETCHERS, {EXCHANGE_SITE.bitstamp: fetch}), \
+                patch('common.business.PRICE_SOURCES', [(EXCHANGE_SITE.bitstamp, 1)]), \
+                patch('common.business.bitstamp.get_order_book', return_value=ORDER_BOOK):
+            prices = PriceManagement.save_cache_prices([CURRENCY.BTC, CURRENCY.ETH])
+
+        self.assertEqual([price.currency for price in prices], [CURRENCY.ETH])
+        self.assertEqual(cache.get(eth_key).buy, Decimal('101'))
+        self.assertEqual(cache.get(btc_key).buy, Decimal('5000'))
+
+    def test_save_cache_prices_empty(self):
+        self.assertEqual(PriceManagement.save_cache_prices([]), [])
+
+
+class PriceAggregatorTests(TestCase):
+    def _get_price(self, fetchers: dict, **kwargs) -> CryptoPrice:
+        sources = [(exchange, 0.5) for exchange in fetchers]
+        with patch.dict(PRICE_FETCHERS, fetchers):
+            return PriceAggregator(sources=sources, **kwargs).get_prices([CURRENCY.ETH])[0]
+
+    def test_median(self):
+        price = self._get_price({
+            EXCHANGE_SITE.bitstamp: fake_fetcher('101', '99'),
+            EXCHANGE_SITE.coinbase: fake_fetcher('102', '100'),
+            EXCHANGE_SITE.binance: fake_fetcher('100.5', '99.5'),
+        })
+        self.assertEqual(price.buy, Decimal('101'))
+        self.assertEqual(price.sell, Decimal('99.5'))
+        self.assertEqual(len(price.sources), 3)
+
+    def test_best(self):
+        price = self._get_price({
+            EXCHANGE_SITE.bitstamp: fake_fetcher('101', '99'),
+            EXCHANGE_SITE.coinbase: fake_fetcher('102', '100'),
+        }, method=PRICE_REFERENCE_METHOD.best)
+        self.assertEqual(price.buy, Decimal('101'))
+        self.assertEqual(price.sell, Decimal('100'))
+
+    def test_drop_outlier(self):
+        price = self._get_price({
+            EXCHANGE_SITE.bitstamp: fake_fetcher('101', '99'),
+            EXCHANGE_SITE.coinbase: fake_fetcher('102', '100'),
+            EXCHANGE_SITE.binance: fake_fetcher('150', '148'),
+        })
+        self.assertEqual(len(price.sources), 2)
+        self.assertEqual(price.buy, Decimal('101.5'))
+
+    def test_drop_stale(self):
+        price = self._get_price({
+            EXCHANGE_SITE.bitstamp: fake_fetcher('101', '99', age=120),
+            EXCHANGE_SITE.coinbase: fake_fetcher('102', '100'),
+        }, max_age=60)
+        self.assertEqual(len(price.sources), 1)
+        self.assertEqual(price.buy, Decimal('102'))
+
+    def test_slow_source(self):
+        start = time.monotonic()
+        price = self._get_price({
+            EXCHANGE_SITE.bitstamp: fake_fetcher('101', '99', delay=2),
+            EXCHANGE_SITE.coinbase: fake_fetcher('102', '100'),
+        })
+        self.assertLess(time.monotonic() - start, 1.5, 'Slow venue does not stall the refresh')
+        self.assertEqual(len(price.sources), 1)
+
+    def test_no_source(self):
+        def fail(currency):
+            raise ExternalAPIException
+
+        with patch.dict(PRICE_FETCHERS, {EXCHANGE_SITE.bitstamp: fail}):
+            aggregator = PriceAggregator(sources=[(EXCHANGE_SITE.bitstamp, 0.5)])
+            self.assertEqual(aggregator.get_prices([CURRENCY.ETH]), [])
+            with self.assertRaises(ExternalAPIException):
+                aggregator.get_price(CURRENCY.ETH)
+
+
+@override_settings(CACHES={'default': {'BACKEND': 'django.core.cache.backends.locmem.LocMemCache'}})
+class RateIngestionTests(TestCase):
+    def setUp(self):
+        cache.clear()
+
+    def _save_rates(self, php_rate: str):
+        rates = [
+            {'currency': FIAT_CURRENCY.USD, 'value': Decimal('1')},
+            {'currency': FIAT_CURRENCY.PHP, 'value': Decimal(php_rate)},
+            {'currency': 'EUR', 'value': Decimal('0.9')},
+        ]
+        with patch('common.business.get_rates', return_value=rates):
+            return RateManagement.save_rates()
+
+    def test_save_supported_rates(self):
+        updated = self._save_rates('52')
+
+        self.assertEqual(set(updated.keys()), {FIAT_CURRENCY.USD, FIAT_CURRENCY.PHP})
+        self.assertEqual(cache.get(CACHE_KEY_CURRENCY_RATE.format(FIAT_CURRENCY.PHP)), Decimal('52'))
+        self.assertIsNone(cache.get(CACHE_KEY_CURRENCY_RATE.format('EUR')))
+        self.assertIsNotNone(cache.get(CACHE_KEY_RATE_VERSION))
+
+    def test_skip_unchanged_rates(self):
+        self._save_rates('52')
+        version = cache.get(CACHE_KEY_RATE_VERSION)
+
+        self.assertEqual(self._save_rates('52.0001'), {}, 'Change is under epsilon')
+        self.assertEqual(cache.get(CACHE_KEY_RATE_VERSION), version)
+
+        self.assertEqual(self._save_rates('53'), {FIAT_CURRENCY.PHP: Decimal('53')})
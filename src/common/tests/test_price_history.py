@@ -0,0 +1,39 @@
+from django.test import TestCase
+
+from common.price_history import PriceHistory
+
+
+class PriceHistoryTests(TestCase):
+    def test_ring_buffer(self):
+        history = PriceHistory(3)
+        for timestamp in range(5):
+            history.append(timestamp, float(timestamp))
+
+        timestamps, prices = history.ordered()
+        self.assertEqual(len(history), 3)
+        self.assertEqual(list(timestamps), [2, 3, 4], 'Oldest values are overwritten')
+        self.assertEqual(list(prices), [2., 3., 4.])
+        self.assertEqual(history.last_timestamp, 4)
+
+    def test_skip_old_timestamp(self):
+        history = PriceHistory(3)
+        history.append(10, 1.)
+        history.append(10, 2.)
+        history.append(5, 3.)
+
+        self.assertEqual(len(history), 1)
+
+    def test_candles(self):
+        history = PriceHistory(5)
+        for timestamp, price in [(100, 1.), (110, 3.), (120, 2.), (130, 4.), (150, 5.), (250, 6.)]:
+            history.append(timestamp, price)
+
+        self.assertEqual(history.candles(60), [
+            {'time': 60, 'open': 3., 'high': 3., 'low': 3., 'close': 3.},
+            {'time': 120, 'open': 2., 'high': 5., 'low': 2., 'close': 5.},
+            {'time': 240, 'open': 6., 'high': 6., 'low': 6., 'close': 6.},
+        ])
+        self.assertEqual(len(history.candles(60, since=200)), 1)
+
+    def test_empty(self):
+        self.assertEqual(PriceHistory(5).candles(60), [])
@@ -0,0 +1,9 @@
+import pytest
+
+from coin_system.business import fee_local_cache
+
+
+@pytest.fixture(autouse=True)
+def clear_fee_schedule():
+    # Test transactions are never committed, so the fee changes of a test don't reset the schedule of this process
+    fee_local_cache.clear()
@@ -16,6 +16,11 @@ def get_address(currency: str) -> str:
     return client.get_deposit_address(asset=currency)
 
 
+@raise_api_exception(ExternalAPIException)
+def get_ticker(currency: str) -> dict:
+    return client.get_orderbook_ticker(symbol='{}USDT'.format(currency))
+
+
 @raise_api_exception(ExternalAPIException)
 def send_transaction(address: str, currency: str, amount: Decimal):
     result = client.withdraw(
@@ -7,12 +7,17 @@ from common.decorators import raise_api_exception
 from integration.exceptions import ExternalAPIException
 from integration.objects import AddressResponse, TransactionResponse, BTCTransactionResponse
 
+# Transactions per page of the multi address endpoint, the most insight returns
+BTC_TX_PAGE_SIZE = 50
+# Connect and read timeout of each request, a tracking worker never waits longer on the explorer
+REQUEST_TIMEOUT = 10  # in second
+
 
 @raise_api_exception(ExternalAPIException)
 def make_bitpay_btc_request(uri: str, params=None):
-    resp = requests.get(settings.BITPAY_BTC['URL'] + uri, headers={
+    resp = requests.get(settings.BITPAY_BTC['URL'] + uri, params=params, headers={
         'Accept': 'application/json'
-    })
+    }, timeout=REQUEST_TIMEOUT)
     if not resp.ok:
         raise Exception('BitPay: StatusCode={} Detail={}'.format(resp.status_code, resp.content))
 
@@ -31,6 +36,47 @@ def get_btc_address(address: str) -> AddressResponse:
     return addr_obj
 
 
+def get_btc_addresses(addresses: list) -> dict:
+    """
+    Balances and transactions of many addresses with the insight multi address endpoints.
+    """
+    addrs = ','.join(addresses)
+    addr_objs = {address: AddressResponse(address,
+                                          Decimal('0'),
+                                          tx_hashes=[],
+                                          unconfirmed_balance=Decimal('0'),
+                                          unconfirmed_tx=0) for address in addresses}
+
+    resp = make_bitpay_btc_request('/addrs/{}/utxo'.format(addrs))
+    for utxo in resp.json():
+        addr_obj = addr_objs.get(utxo['address'])
+        if not addr_obj:
+            continue
+        if utxo['confirmations']:
+            addr_obj.balance += Decimal(str(utxo['amount']))
+        else:
+            addr_obj.unconfirmed_balance += Decimal(str(utxo['amount']))
+            addr_obj.unconfirmed_tx += 1
+
+    start = 0
+    while True:
+        resp = make_bitpay_btc_request('/addrs/{}/txs'.format(addrs), {'from': start, 'to': start + BTC_TX_PAGE_SIZE})
+        data = resp.json()
+        for tx in data['items']:
+            # A transaction goes to every requested address in its inputs or outputs
+            tx_addresses = {vin.get('addr') for vin in tx.get('vin', [])}
+            for vout in tx.get('vout', []):
+                tx_addresses.update(vout.get('scriptPubKey', {}).get('addresses') or [])
+            for address in tx_addresses:
+                addr_obj = addr_objs.get(address)
+                if addr_obj and tx['txid'] not in addr_obj.tx_hashes:
+                    addr_obj.tx_hashes.append(tx['txid'])
+
+        start += BTC_TX_PAGE_SIZE
+        if not data['items'] or start >= data['totalItems']:
+            return addr_objs
+
+
 def get_btc_transaction(tx_hash: str) -> TransactionResponse:
     resp = make_bitpay_btc_request('/tx/{}'.format(tx_hash))
     data = resp.json()
@@ -39,3 +85,31 @@ def get_btc_transaction(tx_hash: str) -> TransactionResponse:
                                     data['confirmations'])
 
     return tx_obj
+
+
+def get_btc_block_height() -> int:
+    resp = make_bitpay_btc_request('/status', {'q': 'getInfo'})
+    return resp.json()['info']['blocks']
+
+
+def get_btc_block_transactions(height: int) -> list:
+    """
+    (tx hash, output addresses) of every transaction in the block.
+    """
+    resp = make_bitpay_btc_request('/block-index/{}'.format(height))
+    block_hash = resp.json()['blockHash']
+
+    txs = []
+    page = 0
+    while True:
+        resp = make_bitpay_btc_request('/txs', {'block': block_hash, 'pageNum': page})
+        data = resp.json()
+        for tx in data['txs']:
+            addresses = set()
+            for vout in tx.get('vout', []):
+                addresses.update(vout.get('scriptPubKey', {}).get('addresses') or [])
+            txs.append((tx['txid'], addresses))
+
+        page += 1
+        if page >= data['pagesTotal']:
+            return txs
@@ -26,6 +26,16 @@ trading_client = CustomClientTrading(settings.BITSTAMP['CUSTOMER_ID'],
                                      settings.BITSTAMP['API_SECRET'])
 
 
+@raise_api_exception(ExternalAPIException)
+def get_ticker(currency: str) -> dict:
+    return public_client.ticker(base=currency.lower())
+
+
+@raise_api_exception(ExternalAPIException)
+def get_order_book(currency: str) -> dict:
+    return public_client.order_book(group=True, base=currency.lower())
+
+
 @raise_api_exception(ExternalAPIException)
 def get_buy_price(currency: str) -> str:
     return public_client.ticker(base=currency.lower())['ask']
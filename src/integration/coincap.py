@@ -4,6 +4,11 @@ import requests
 from common.decorators import raise_api_exception
 from integration.exceptions import ExternalAPIException
 
+CURRENCY_IDS = {
+    'BTC': 'bitcoin',
+    'ETH': 'ethereum',
+}
+
 
 class Client(object):
     def __init__(self):
@@ -26,3 +31,7 @@ def get_rate(symbol: str):
     result = {'symbol': rate['symbol'], 'rateUsd': Decimal(str(rate['rateUsd']))}
 
     return result
+
+
+def get_price(currency: str) -> Decimal:
+    return get_rate(CURRENCY_IDS[currency])['rateUsd']
@@ -4,10 +4,12 @@ from decimal import Decimal
 import simplejson
 
 from django.conf import settings
+from hexbytes import HexBytes
 from web3 import Web3
 
 from common.decorators import raise_api_exception
 from integration.exceptions import ExternalAPIException
+from integration.objects import TransferLog
 
 w3 = Web3(Web3.HTTPProvider(settings.ETH['URL']))
 
@@ -15,6 +17,18 @@ w3 = Web3(Web3.HTTPProvider(settings.ETH['URL']))
 # Test contract address: 0xc25D80fF9D25802cb69b2A751394F83534011308
 ERC20_ABI = simplejson.loads('[{"constant":true,"inputs":[],"name":"name","outputs":[{"name":"","type":"string"}],"payable":false,"stateMutability":"view","type":"function"},{"constant":false,"inputs":[{"name":"_spender","type":"address"},{"name":"_value","type":"uint256"}],"name":"approve","outputs":[{"name":"","type":"bool"}],"payable":false,"stateMutability":"nonpayable","type":"function"},{"constant":true,"inputs":[],"name":"totalSupply","outputs":[{"name":"","type":"uint256"}],"payable":false,"stateMutability":"view","type":"function"},{"constant":false,"inputs":[{"name":"_from","type":"address"},{"name":"_to","type":"address"},{"name":"_value","type":"uint256"}],"name":"transferFrom","outputs":[{"name":"","type":"bool"}],"payable":false,"stateMutability":"nonpayable","type":"function"},{"constant":true,"inputs":[],"name":"decimals","outputs":[{"name":"","type":"uint8"}],"payable":false,"stateMutability":"view","type":"function"},{"constant":true,"inputs":[{"name":"_owner","type":"address"}],"name":"balanceOf","outputs":[{"name":"","type":"uint256"}],"payable":false,"stateMutability":"view","type":"function"},{"constant":true,"inputs":[],"name":"symbol","outputs":[{"name":"","type":"string"}],"payable":false,"stateMutability":"view","type":"function"},{"constant":false,"inputs":[{"name":"_to","type":"address"},{"name":"_value","type":"uint256"}],"name":"transfer","outputs":[{"name":"","type":"bool"}],"payable":false,"stateMutability":"nonpayable","type":"function"},{"constant":true,"inputs":[{"name":"_owner","type":"address"},{"name":"_spender","type":"address"}],"name":"allowance","outputs":[{"name":"","type":"uint256"}],"payable":false,"stateMutability":"view","type":"function"},{"anonymous":false,"inputs":[{"indexed":true,"name":"_from","type":"address"},{"indexed":true,"name":"_to","type":"address"},{"indexed":false,"name":"_value","type":"uint256"}],"name":"Transfer","type":"event"},{"anonymous":false,"inputs":[{"indexed":true,"name":"_owner","type":"address"},{"indexed":true,"name":"_spender","type":"address"},{"indexed":false,"name":"_value","type":"uint256"}],"name":"Approval","type":"event"}]')  # noqa: 501
 
+# keccak of Transfer(address,address,uint256)
+TRANSFER_TOPIC = '0xddf252ad1be2c89b69c2b068fc378daa952ba7f163c4a11628f55a4df523b3ef'
+
+
+def address_topic(address: str) -> str:
+    # Indexed addresses are left padded to 32 bytes
+    return '0x' + address[2:].lower().rjust(64, '0')
+
+
+def topic_address(topic) -> str:
+    return '0x' + HexBytes(topic).hex()[-40:]
+
 
 @raise_api_exception(ExternalAPIException)
 def check_connected():
@@ -42,6 +56,34 @@ def inspect_erc20(address: str):
     }
 
 
+@raise_api_exception(ExternalAPIException)
+def get_block_number() -> int:
+    return w3.eth.blockNumber
+
+
+@raise_api_exception(ExternalAPIException)
+def get_transfer_logs(contracts: list, recipients: list, from_block: int, to_block: int) -> list:
+    """
+    Transfer events of all the contracts to the recipients within the block range, with 1 eth_getLogs request.
+    """
+    logs = w3.eth.getLogs({
+        'fromBlock': from_block,
+        'toBlock': to_block,
+        'address': [Web3.toChecksumAddress(contract) for contract in contracts],
+        'topics': [TRANSFER_TOPIC, None, [address_topic(recipient) for recipient in recipients]],
+    })
+
+    return [TransferLog(
+        HexBytes(log['transactionHash']).hex(),
+        log['logIndex'],
+        log['blockNumber'],
+        log['address'],
+        topic_address(log['topics'][1]),
+        topic_address(log['topics'][2]),
+        int.from_bytes(HexBytes(log['data']), 'big'),
+    ) for log in logs]
+
+
 @raise_api_exception(ExternalAPIException)
 def send_ether_to_contract(amount, contract_address):
     amount_in_wei = w3.toWei(amount, 'ether')
@@ -8,14 +8,18 @@ from integration.exceptions import ExternalAPIException
 from integration.objects import AddressResponse, TransactionResponse, ETHTransactionResponse
 
 WEI = Decimal('1000000000000000000')
+# Connect and read timeout of each request, a tracking worker never waits longer on the explorer
+REQUEST_TIMEOUT = 10  # in second
 
 
 @raise_api_exception(ExternalAPIException)
 def make_request(uri: str, params=None):
     resp = requests.get(settings.ETHERSCAN['URL'] + '?' + uri + '&apikey={}'.format(settings.ETHERSCAN['API_KEY']),
+                        params=params,
                         headers={
                             'Accept': 'application/json'
-                        })
+                        },
+                        timeout=REQUEST_TIMEOUT)
     if not resp.ok:
         raise Exception('Etherscan: StatusCode={} Detail={}'.format(resp.status_code, resp.content))
 
@@ -41,6 +45,27 @@ def get_address(address: str) -> AddressResponse:
     return addr_obj
 
 
+def get_addresses(addresses: list) -> dict:
+    """
+    Balances of many addresses in 1 balancemulti call (20 addresses at most).
+    There is no multi address transaction list: it is read for every address, as a deposit already sent away
+    leaves no balance.
+    """
+    resp = make_request('module=account&action=balancemulti&address={}&tag=latest'.format(','.join(addresses)))
+    data = resp.json()
+    if data['status'] != '1':
+        raise ExternalAPIException('Etherscan: {} {}'.format(data.get('message'), data.get('result')))
+    balances = {item['account'].lower(): Decimal(str(item['balance'])) / WEI for item in data['result']}
+
+    addr_objs = {}
+    for address in addresses:
+        addr_obj = get_address(address)
+        addr_obj.balance = balances.get(address.lower())
+        addr_objs[address] = addr_obj
+
+    return addr_objs
+
+
 def get_eth_transaction(tx_hash: str):
     resp = make_request('module=proxy&action=eth_getTransactionByHash&txhash={}'.format(tx_hash))
     data = resp.json()['result']
@@ -55,6 +80,21 @@ def get_eth_transaction_receipt(tx_hash: str):
     return data
 
 
+def get_block_number() -> int:
+    resp = make_request('module=proxy&action=eth_blockNumber')
+    return int(resp.json()['result'], 16)
+
+
+def get_block_transactions(height: int) -> list:
+    """
+    (tx hash, recipient addresses) of every transaction in the block.
+    """
+    resp = make_request('module=proxy&action=eth_getBlockByNumber&tag={}&boolean=true'.format(hex(height)))
+    data = resp.json()['result']
+
+    return [(tx['hash'], {tx['to']} if tx.get('to') else set()) for tx in data['transactions']]
+
+
 def get_transaction(tx_hash: str) -> TransactionResponse:
     tx_data = get_eth_transaction(tx_hash)
     tx_receipt_data = get_eth_transaction_receipt(tx_hash)
@@ -0,0 +1,48 @@
+from common.constants import CURRENCY
+from integration import bitpay, etherscan
+
+# Addresses per request of each explorer
+ADDRESS_BATCH_SIZE = {
+    CURRENCY.BTC: 50,
+    CURRENCY.ETH: 20,
+}
+
+ADDRESS_FETCHERS = {
+    CURRENCY.BTC: bitpay.get_btc_addresses,
+    CURRENCY.ETH: etherscan.get_addresses,
+}
+
+BLOCK_HEIGHT_FETCHERS = {
+    CURRENCY.BTC: bitpay.get_btc_block_height,
+    CURRENCY.ETH: etherscan.get_block_number,
+}
+
+BLOCK_TRANSACTION_FETCHERS = {
+    CURRENCY.BTC: bitpay.get_btc_block_transactions,
+    CURRENCY.ETH: etherscan.get_block_transactions,
+}
+
+
+def get_addresses(currency: str, addresses: list) -> dict:
+    """
+    AddressResponse of each address, fetched with as few multi address requests as possible.
+    """
+    size = ADDRESS_BATCH_SIZE[currency]
+    fetch = ADDRESS_FETCHERS[currency]
+
+    addr_objs = {}
+    for i in range(0, len(addresses), size):
+        addr_objs.update(fetch(addresses[i:i + size]))
+
+    return addr_objs
+
+
+def get_block_height(currency: str) -> int:
+    return BLOCK_HEIGHT_FETCHERS[currency]()
+
+
+def get_block_transactions(currency: str, height: int) -> list:
+    """
+    (tx hash, set of receiving addresses) of the transactions in the block.
+    """
+    return BLOCK_TRANSACTION_FETCHERS[currency](height)
@@ -10,6 +10,18 @@ class AddressResponse(object):
         self.unconfirmed_tx = unconfirmed_tx
 
 
+class TransferLog(object):
+    def __init__(self, tx_hash, log_index: int, block_number: int, contract, from_address, to_address, value: int):
+        self.tx_hash = tx_hash
+        self.log_index = log_index
+        self.block_number = block_number
+        self.contract = contract
+        self.from_address = from_address
+        self.to_address = to_address
+        # In the smallest unit of the token
+        self.value = value
+
+
 class TransactionResponse(object):
     def __init__(self, tx_hash, amount: Decimal, confirmation=None, is_pending=True, is_success=False):
         self.tx_hash = tx_hash
@@ -28,6 +40,10 @@ class TransactionResponse(object):
         self.called_check_pending = True
         return self.is_pending
 
+    def get_pending_confirmations(self):
+        # Confirmations still expected, None if unknown
+        return None
+
 
 class BTCTransactionResponse(TransactionResponse):
     def check_success(self):
@@ -38,6 +54,9 @@ class BTCTransactionResponse(TransactionResponse):
         super(BTCTransactionResponse, self).check_pending()
         return self.confirmation < self._get_confirmation_range()
 
+    def get_pending_confirmations(self):
+        return max(0, self._get_confirmation_range() - self.confirmation)
+
     def _get_confirmation_range(self) -> int:
         if self.amount < Decimal('5'):
             return 1
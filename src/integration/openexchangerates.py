@@ -12,8 +12,11 @@ class Client(object):
         self.url = 'https://openexchangerates.org/api'
         self.api_key = api_key
 
-    def get_rates(self):
-        resp = requests.get('{}/latest.json?app_id={}'.format(self.url, self.api_key))
+    def get_rates(self, symbols: list = None):
+        url = '{}/latest.json?app_id={}'.format(self.url, self.api_key)
+        if symbols:
+            url += '&symbols={}'.format(','.join(symbols))
+        resp = requests.get(url)
         if resp.status_code == 200:
             return resp.json()
 
@@ -24,8 +27,8 @@ client = Client(settings.OPENEXCHANGERATES['API_KEY'])
 
 
 @raise_api_exception(ExternalAPIException)
-def get_rates():
-    rates = client.get_rates()['rates']
+def get_rates(symbols: list = None):
+    rates = client.get_rates(symbols)['rates']
     result = [{'currency': key, 'value': Decimal(str(value))} for key, value in rates.items()]
 
     return result
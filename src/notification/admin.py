@@ -1,6 +1,6 @@
 from django.contrib import admin
 
-from notification.models import SystemReminder, SystemReminderAction, SystemNotification
+from notification.models import SystemReminder, SystemReminderAction, SystemNotification, NotificationOutbox
 
 
 @admin.register(SystemReminder)
@@ -16,3 +16,9 @@ class SystemReminderActionAdmin(admin.ModelAdmin):
 @admin.register(SystemNotification)
 class SystemNotificationAdmin(admin.ModelAdmin):
     list_display = ['group', 'method', 'active']
+
+
+@admin.register(NotificationOutbox)
+class NotificationOutboxAdmin(admin.ModelAdmin):
+    list_display = ['kind', 'status', 'attempts', 'next_attempt_at', 'created_at']
+    list_filter = ('kind', 'status')
@@ -1,6 +1,10 @@
+import logging
+from concurrent.futures import ThreadPoolExecutor
 from datetime import timedelta
 
+import simplejson
 from django.conf import settings
+from django.db import transaction, connection
 from django.db.models import Q, F
 
 from coin_exchange.constants import ORDER_TYPE, ORDER_STATUS
@@ -12,8 +16,10 @@ from common.business import get_now
 from common.constants import DIRECTION
 from common.decorators import raise_api_exception, cache_first
 from common.exceptions import UnexpectedException
-from notification.constants import NOTIFICATION_METHOD, NOTIFICATION_GROUP
-from notification.models import SystemNotification, SystemReminder, SystemReminderAction
+from notification.constants import NOTIFICATION_METHOD, NOTIFICATION_GROUP, NOTIFICATION_OUTBOX_KIND, \
+    NOTIFICATION_OUTBOX_STATUS, NOTIFICATION_OUTBOX_BATCH, NOTIFICATION_OUTBOX_MAX_WORKERS, \
+    NOTIFICATION_OUTBOX_MAX_ATTEMPTS, NOTIFICATION_OUTBOX_RETRY_DELAY, NOTIFICATION_OUTBOX_LEASE
+from notification.models import SystemNotification, SystemReminder, SystemReminderAction, NotificationOutbox
 from notification.provider.email import EmailNotification
 from notification.provider.slack import SlackNotification
 from notification.provider.sms import SmsNotification
@@ -35,33 +41,35 @@ def get_system_notification(group) -> list:
 
 class NotificationManagement(object):
     @staticmethod
-    def send_notification(notification: SystemNotification, **kwargs):
+    def send_notification(notification: SystemNotification, raise_exception: bool = False, **kwargs):
         if notification.method == NOTIFICATION_METHOD.email:
-            NotificationManagement.send_email_notification(notification, kwargs['subject'], kwargs['content'])
+            NotificationManagement.send_email_notification(notification, kwargs['subject'], kwargs['content'],
+                                                           raise_exception)
         elif notification.method == NOTIFICATION_METHOD.slack:
-            NotificationManagement.send_slack_notification(notification, kwargs['content'])
+            NotificationManagement.send_slack_notification(notification, kwargs['content'], raise_exception)
         elif notification.method == NOTIFICATION_METHOD.sms:
-            NotificationManagement.send_sms_notification(notification, kwargs['content'])
+            NotificationManagement.send_sms_notification(notification, kwargs['content'], raise_exception)
 
     @staticmethod
-    def send_email_notification(notification: SystemNotification, subject: str, content: str):
+    def send_email_notification(notification: SystemNotification, subject: str, content: str,
+                                raise_exception: bool = False):
         emails = [email.strip() for email in notification.target.split(';')]
-        EmailNotification.send_simple_emails(emails, subject, content)
+        EmailNotification.send_simple_emails(emails, subject, content, raise_exception)
 
     @staticmethod
-    def send_slack_notification(notification: SystemNotification, content):
-        SlackNotification.send_channel(notification.target, content)
+    def send_slack_notification(notification: SystemNotification, content, raise_exception: bool = False):
+        SlackNotification.send_channel(notification.target, content, raise_exception)
 
     @staticmethod
-    def send_sms_notification(notification: SystemNotification, content):
+    def send_sms_notification(notification: SystemNotification, content, raise_exception: bool = False):
         to_phones = [phone.strip() for phone in notification.target.split(';')]
         for to_phone in to_phones:
-            SmsNotification.send_sms(to_phone, content)
+            SmsNotification.send_sms(to_phone, content, raise_exception)
 
 
 class OrderNotification(object):
     @staticmethod
-    def send_new_order_notification(order_data: dict):
+    def send_new_order_notification(order_data: dict, raise_exception: bool = False):
         msg = ''
         if settings.TEST:
             msg = 'TEST - '
@@ -87,11 +95,11 @@ class OrderNotification(object):
         notifications = get_system_notification(NOTIFICATION_GROUP.order)
         for notification in notifications:
             if notification.method == NOTIFICATION_METHOD.email:
-                NotificationManagement.send_email_notification(notification, msg, email_content)
+                NotificationManagement.send_email_notification(notification, msg, email_content, raise_exception)
             elif notification.method == NOTIFICATION_METHOD.slack:
-                NotificationManagement.send_slack_notification(notification, slack_content)
+                NotificationManagement.send_slack_notification(notification, slack_content, raise_exception)
             elif notification.method == NOTIFICATION_METHOD.sms:
-                NotificationManagement.send_sms_notification(notification, msg)
+                NotificationManagement.send_sms_notification(notification, msg, raise_exception)
 
 
 class ComparePriceNotification(object):
@@ -121,7 +129,7 @@ class ComparePriceNotification(object):
 
 class UserVerificationNotification(object):
     @staticmethod
-    def send_user_verification_notification(user_data: dict):
+    def send_user_verification_notification(user_data: dict, raise_exception: bool = False):
         msg = ''
         if settings.TEST:
             msg = 'TEST - '
@@ -140,11 +148,77 @@ class UserVerificationNotification(object):
         notifications = get_system_notification(NOTIFICATION_GROUP.verification)
         for notification in notifications:
             if notification.method == NOTIFICATION_METHOD.email:
-                NotificationManagement.send_email_notification(notification, msg, email_content)
+                NotificationManagement.send_email_notification(notification, msg, email_content, raise_exception)
             elif notification.method == NOTIFICATION_METHOD.slack:
-                NotificationManagement.send_slack_notification(notification, slack_content)
+                NotificationManagement.send_slack_notification(notification, slack_content, raise_exception)
             elif notification.method == NOTIFICATION_METHOD.sms:
-                NotificationManagement.send_sms_notification(notification, msg)
+                NotificationManagement.send_sms_notification(notification, msg, raise_exception)
+
+
+# Sender of each outbox message kind, called with the message data
+OUTBOX_SENDERS = {
+    NOTIFICATION_OUTBOX_KIND.new_order: OrderNotification.send_new_order_notification,
+    NOTIFICATION_OUTBOX_KIND.user_verification: UserVerificationNotification.send_user_verification_notification,
+}
+
+
+class NotificationOutboxManagement(object):
+    """
+    Notifications are written in the transaction of their change and sent later by process(),
+    a failed message is sent again with an exponential delay.
+    """
+
+    @staticmethod
+    def add(kind: str, data: dict) -> NotificationOutbox:
+        return NotificationOutbox.objects.create(kind=kind, payload=simplejson.dumps(data))
+
+    @staticmethod
+    @transaction.atomic
+    def claim(batch: int) -> list:
+        now = get_now()
+        objs = list(NotificationOutbox.objects.select_for_update(skip_locked=True)
+                    .filter(status=NOTIFICATION_OUTBOX_STATUS.pending, next_attempt_at__lte=now)
+                    .order_by('next_attempt_at')[:batch])
+        # Other workers skip them until the lease ends
+        NotificationOutbox.objects.filter(id__in=[obj.id for obj in objs]) \
+            .update(next_attempt_at=now + timedelta(seconds=NOTIFICATION_OUTBOX_LEASE))
+        return objs
+
+    @staticmethod
+    def send(obj: NotificationOutbox) -> str:
+        # Return the error, None if sent
+        try:
+            # The providers swallow the delivery errors unless asked to raise them
+            OUTBOX_SENDERS[obj.kind](simplejson.loads(obj.payload), raise_exception=True)
+        except Exception as ex:
+            logging.exception(ex)
+            return repr(ex)
+        finally:
+            # Connection of the worker thread
+            connection.close()
+
+    @staticmethod
+    def process() -> int:
+        objs = NotificationOutboxManagement.claim(NOTIFICATION_OUTBOX_BATCH)
+        if not objs:
+            return 0
+
+        with ThreadPoolExecutor(max_workers=min(NOTIFICATION_OUTBOX_MAX_WORKERS, len(objs))) as executor:
+            errors = list(executor.map(NotificationOutboxManagement.send, objs))
+
+        now = get_now()
+        for obj, error in zip(objs, errors):
+            obj.attempts += 1
+            obj.last_error = error
+            if not error:
+                obj.status = NOTIFICATION_OUTBOX_STATUS.sent
+            elif obj.attempts >= NOTIFICATION_OUTBOX_MAX_ATTEMPTS:
+                obj.status = NOTIFICATION_OUTBOX_STATUS.failed
+            else:
+                obj.next_attempt_at = now + timedelta(seconds=NOTIFICATION_OUTBOX_RETRY_DELAY * 2 ** (obj.attempts - 1))
+            obj.save(update_fields=['status', 'attempts', 'last_error', 'next_attempt_at', 'updated_at'])
+
+        return len(objs)
 
 
 class ReminderManagement(object):
@@ -46,3 +46,20 @@ STATIC_PAGE = Choices(
     ('api-reference', 'API Reference'),
     ('digital-assets', 'Digital Assets'),
 )
+
+NOTIFICATION_OUTBOX_KIND = Choices(
+    ('new_order', 'New order'),
+    ('user_verification', 'User verification'),
+)
+
+NOTIFICATION_OUTBOX_STATUS = Choices(
+    ('pending', 'Pending'),
+    ('sent', 'Sent'),
+    ('failed', 'Failed'),
+)
+
+NOTIFICATION_OUTBOX_BATCH = 100
+NOTIFICATION_OUTBOX_MAX_WORKERS = 8
+NOTIFICATION_OUTBOX_MAX_ATTEMPTS = 5
+NOTIFICATION_OUTBOX_RETRY_DELAY = 60  # in second, doubled after each failed attempt
+NOTIFICATION_OUTBOX_LEASE = 5 * 60  # in second, claimed messages are sent again after it if the worker died
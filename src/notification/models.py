@@ -1,7 +1,9 @@
 from django.db import models
+from django.utils import timezone
 
 from coin_base.models import TimestampedModel
-from notification.constants import NOTIFICATION_GROUP, NOTIFICATION_METHOD
+from notification.constants import NOTIFICATION_GROUP, NOTIFICATION_METHOD, NOTIFICATION_OUTBOX_KIND, \
+    NOTIFICATION_OUTBOX_STATUS
 
 
 class SystemReminder(models.Model):
@@ -44,3 +46,23 @@ class SystemNotification(models.Model):
     method = models.CharField(max_length=50, choices=NOTIFICATION_METHOD)
     target = models.CharField(max_length=1000, blank=True)
     active = models.BooleanField(default=True)
+
+
+class NotificationOutbox(TimestampedModel):
+    class Meta:
+        verbose_name = 'Notification Outbox'
+        verbose_name_plural = 'Notification Outbox'
+        indexes = [
+            models.Index(fields=['status', 'next_attempt_at']),
+        ]
+
+    kind = models.CharField(max_length=50, choices=NOTIFICATION_OUTBOX_KIND)
+    payload = models.TextField()
+    status = models.CharField(max_length=20, choices=NOTIFICATION_OUTBOX_STATUS,
+                              default=NOTIFICATION_OUTBOX_STATUS.pending)
+    attempts = models.IntegerField(default=0)
+    next_attempt_at = models.DateTimeField(default=timezone.now)
+    last_error = models.TextField(null=True, blank=True)
+
+    def __str__(self):
+        return '%s #%s' % (NOTIFICATION_OUTBOX_KIND[self.kind], self.id)
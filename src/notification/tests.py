@@ -0,0 +1,83 @@
+from unittest.mock import MagicMock, patch
+
+from django.urls import reverse
+from rest_framework import status
+from rest_framework.test import APITestCase
+
+from coin_exchange.constants import ORDER_TYPE
+from coin_exchange.factories import OrderFactory
+from common.business import get_now
+from common.constants import DIRECTION, FIAT_CURRENCY
+from notification.business import OUTBOX_SENDERS, NotificationOutboxManagement
+from notification.constants import NOTIFICATION_OUTBOX_KIND, NOTIFICATION_OUTBOX_STATUS, \
+    NOTIFICATION_OUTBOX_MAX_ATTEMPTS, NOTIFICATION_GROUP, NOTIFICATION_METHOD
+from notification.models import NotificationOutbox, SystemNotification
+
+
+class NotificationOutboxTests(APITestCase):
+    def setUp(self):
+        self.sender = MagicMock()
+        patcher = patch.dict(OUTBOX_SENDERS, {NOTIFICATION_OUTBOX_KIND.new_order: self.sender})
+        patcher.start()
+        self.addCleanup(patcher.stop)
+
+    def test_order_notification(self):
+        order = OrderFactory(direction=DIRECTION.buy, order_type=ORDER_TYPE.cod, user__currency=FIAT_CURRENCY.PHP)
+        obj = NotificationOutbox.objects.get()
+        self.assertEqual(obj.kind, NOTIFICATION_OUTBOX_KIND.new_order)
+
+        response = self.client.post(reverse('notification:process-outbox'), format='json')
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.assertEqual(response.json(), 1)
+        self.sender.assert_called_once_with({
+            'order_type': ORDER_TYPE.cod,
+            'direction': DIRECTION.buy,
+            'ref_code': order.ref_code,
+            'id': order.id,
+        }, raise_exception=True)
+        obj.refresh_from_db()
+        self.assertEqual(obj.status, NOTIFICATION_OUTBOX_STATUS.sent)
+        self.assertEqual(NotificationOutboxManagement.process(), 0)
+
+    def test_retry(self):
+        self.sender.side_effect = Exception('Slack is down')
+        obj = NotificationOutboxManagement.add(NOTIFICATION_OUTBOX_KIND.new_order, {'id': 1})
+
+        self.assertEqual(NotificationOutboxManagement.process(), 1)
+        obj.refresh_from_db()
+        self.assertEqual(obj.status, NOTIFICATION_OUTBOX_STATUS.pending)
+        self.assertEqual(obj.attempts, 1)
+        self.assertIn('Slack is down', obj.last_error)
+        self.assertGreater(obj.next_attempt_at, get_now())
+        self.assertEqual(NotificationOutboxManagement.process(), 0, 'Not due yet')
+
+        for _ in range(NOTIFICATION_OUTBOX_MAX_ATTEMPTS - 1):
+            NotificationOutbox.objects.filter(pk=obj.pk).update(next_attempt_at=get_now())
+            NotificationOutboxManagement.process()
+        obj.refresh_from_db()
+        self.assertEqual(obj.status, NOTIFICATION_OUTBOX_STATUS.failed)
+        self.assertEqual(self.sender.call_count, NOTIFICATION_OUTBOX_MAX_ATTEMPTS)
+
+
+class NotificationOutboxDeliveryTests(APITestCase):
+    def test_provider_error(self):
+        # Read by the sender thread, which does not see the rows of the test transaction
+        notification = SystemNotification(group=NOTIFICATION_GROUP.order, method=NOTIFICATION_METHOD.slack,
+                                          target='#orders')
+        patcher = patch('notification.business.get_system_notification', return_value=[notification])
+        patcher.start()
+        self.addCleanup(patcher.stop)
+        obj = NotificationOutboxManagement.add(NOTIFICATION_OUTBOX_KIND.new_order, {
+            'order_type': ORDER_TYPE.cod,
+            'direction': DIRECTION.buy,
+            'ref_code': 'RefCode',
+            'id': 1,
+        })
+
+        with patch('integration.slack.client.api_call', side_effect=Exception('Slack is down')) as api_call:
+            self.assertEqual(NotificationOutboxManagement.process(), 1)
+
+        api_call.assert_called_once()
+        obj.refresh_from_db()
+        self.assertEqual(obj.status, NOTIFICATION_OUTBOX_STATUS.pending)
+        self.assertEqual(obj.attempts, 1)
@@ -1,7 +1,8 @@
 from django.urls import path, include
 from rest_framework.routers import DefaultRouter
 
-from notification.views import NewOrderNotificationView, UserVerificationNotificationView
+from notification.views import NewOrderNotificationView, UserVerificationNotificationView, \
+    ProcessNotificationOutboxView
 
 router = DefaultRouter()
 
@@ -11,6 +12,8 @@ patterns = ([
          name='new-order-notification'),
     path('user-verification-notification/', UserVerificationNotificationView.as_view(),
          name='user-verification-notification'),
+    path('process-outbox/', ProcessNotificationOutboxView.as_view(),
+         name='process-outbox'),
 
 ], 'notification')
 
@@ -1,7 +1,7 @@
 from rest_framework.response import Response
 from rest_framework.views import APIView
 
-from notification.business import OrderNotification, UserVerificationNotification
+from notification.business import OrderNotification, UserVerificationNotification, NotificationOutboxManagement
 
 
 class NewOrderNotificationView(APIView):
@@ -15,3 +15,8 @@ class UserVerificationNotificationView(APIView):
     def post(self, request, format=None):
         UserVerificationNotification.send_user_verification_notification(request.data)
         return Response()
+
+
+class ProcessNotificationOutboxView(APIView):
+    def post(self, request, format=None):
+        return Response(NotificationOutboxManagement.process())